@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -48,6 +50,9 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "protocole1.metrics.MetricsMiddleware",
+    "protocole1.slow_queries.SlowQueryMiddleware",
+    "protocole1.profiling.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "feedback.urls"
@@ -56,31 +61,91 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": ["templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
+            "loaders": [
+                "django.template.loaders.filesystem.Loader",
+                "django.template.loaders.app_directories.Loader",
+            ],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
-            ]
+            ],
         },
     }
 ]
 
+# Out of DEBUG, the templates are compiled once per process (restart the server to
+# see the changes of a template)
+if not DEBUG:
+    TEMPLATES[0]["OPTIONS"]["loaders"] = [
+        ("django.template.loaders.cached.Loader", TEMPLATES[0]["OPTIONS"]["loaders"])
+    ]
+
 WSGI_APPLICATION = "feedback.wsgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
+# The database is chosen by the environment variable FEEDBACK_DB_PROFILE:
+#   - "default": the SQLite file FEEDBACK_DB_NAME (db.sqlite3 by default) with the
+#     default settings of SQLite, a connection per request;
+#   - "sqlite": the same file in WAL mode (the readers do not block the writer),
+#     tuned by SQLITE_PRAGMAS, with persistent connections;
+#   - "postgresql": the database FEEDBACK_DB_NAME on FEEDBACK_DB_HOST and
+#     FEEDBACK_DB_PORT with FEEDBACK_DB_USER and FEEDBACK_DB_PASSWORD, with
+#     persistent connections. Set FEEDBACK_DB_PGBOUNCER to 1 when the connections
+#     go through pgbouncer in transaction mode.
+# FEEDBACK_DB_CONN_MAX_AGE sets the lifetime of the persistent connections in
+# seconds (60 by default, 0 closes them after each request).
+
+DATABASE_PROFILE = os.environ.get("FEEDBACK_DB_PROFILE", "default")
 
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+        "NAME": os.environ.get(
+            "FEEDBACK_DB_NAME", os.path.join(BASE_DIR, "db.sqlite3")
+        ),
     }
 }
 
+# The PRAGMA statements run on each new SQLite connection (see protocole1.database)
+SQLITE_PRAGMAS = {}
+
+if DATABASE_PROFILE == "sqlite":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(
+        os.environ.get("FEEDBACK_DB_CONN_MAX_AGE", 60)
+    )
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        # in WAL mode, the database stays consistent without syncing every commit
+        "synchronous": "NORMAL",
+        # waits up to 20 s for the lock instead of failing with "database is locked"
+        "busy_timeout": 20000,
+        "mmap_size": 256 * 1024 * 1024,
+        # in KiB when negative
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    }
+elif DATABASE_PROFILE == "postgresql":
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("FEEDBACK_DB_NAME", "feedback"),
+        "USER": os.environ.get("FEEDBACK_DB_USER", ""),
+        "PASSWORD": os.environ.get("FEEDBACK_DB_PASSWORD", ""),
+        "HOST": os.environ.get("FEEDBACK_DB_HOST", ""),
+        "PORT": os.environ.get("FEEDBACK_DB_PORT", ""),
+        "CONN_MAX_AGE": int(os.environ.get("FEEDBACK_DB_CONN_MAX_AGE", 60)),
+        # the server side cursors do not survive the transaction pooling
+        "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("FEEDBACK_DB_PGBOUNCER") == "1",
+    }
+elif DATABASE_PROFILE != "default":
+    raise ImproperlyConfigured(
+        "Unknown database profile %r (FEEDBACK_DB_PROFILE)" % DATABASE_PROFILE
+    )
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -113,3 +178,111 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = "/static/"
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# The default cache is local to each process: with several workers, use a cache
+# shared between the processes (see the caches of protocole1 below). It can keep
+# the fragments of the results pages, one per participant.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+
+# Pools of ideas
+# The pools of ideas of the experiments are cached in each process. Set this to
+# the alias of a cache of CACHES to share them (and their invalidations) between
+# the processes when several workers are used.
+
+PROTOCOLE1_POOL_CACHE = None
+
+
+# Participation status
+# The status of the users on the experiments (shown on the homepage) can be cached
+# in a cache of CACHES, for PROTOCOLE1_STATUS_CACHE_TIMEOUT seconds. The
+# invalidations are only seen by the processes sharing this cache: with several
+# workers, it must be shared between the processes (memcached, database...), the
+# default cache being local to each process. None (the default) disables the cache.
+
+PROTOCOLE1_STATUS_CACHE = None
+PROTOCOLE1_STATUS_CACHE_TIMEOUT = 300
+
+
+# Results pages
+# The results pages and their fragments (see protocole1.results_cache) can be
+# cached in a cache of CACHES for PROTOCOLE1_RESULTS_CACHE_TIMEOUT seconds, under
+# the version of the results of the experiment. The versions are only seen by the
+# processes sharing this cache: with several workers, it must be shared between
+# the processes (memcached, database...), the default cache being local to each
+# process. None (the default) disables the cache. The pages larger than
+# PROTOCOLE1_RESULTS_CACHE_MAX_PAGE_SIZE characters are not cached, only their
+# fragments (memcached stores values up to 1 MB by default).
+
+PROTOCOLE1_RESULTS_CACHE = None
+PROTOCOLE1_RESULTS_CACHE_TIMEOUT = 3600
+PROTOCOLE1_RESULTS_CACHE_MAX_PAGE_SIZE = 1024 * 1024
+
+
+# Participation links
+# The signed participation links (see the command create_participants) log the
+# participants in without password for this number of seconds (None: forever).
+
+PROTOCOLE1_PARTICIPATION_TOKEN_MAX_AGE = 7 * 24 * 3600
+
+
+# Write-behind reactions
+# When PROTOCOLE1_WRITE_BEHIND_LOG names a directory, the reactions are appended
+# to a journal in this directory and written to the database by a background
+# thread every PROTOCOLE1_WRITE_BEHIND_INTERVAL seconds (see protocole1.journal),
+# so that the participants do not wait for the lock of the database. It requires
+# the participation to be served by a single process, which writes the journal
+# left by a crashed process when it starts.
+
+PROTOCOLE1_WRITE_BEHIND_LOG = os.environ.get("FEEDBACK_WRITE_BEHIND_LOG")
+PROTOCOLE1_WRITE_BEHIND_INTERVAL = 1
+
+
+# Metrics
+# The metrics of the requests and of the stages of the participation are kept in
+# each process (see protocole1.metrics) and exposed to the staff on /metrics.
+# With several workers, set PROTOCOLE1_METRICS_DIR to a directory shared by the
+# processes, where each one writes its metrics every
+# PROTOCOLE1_METRICS_DUMP_INTERVAL seconds at most.
+
+PROTOCOLE1_METRICS_DIR = os.environ.get("FEEDBACK_METRICS_DIR")
+PROTOCOLE1_METRICS_DUMP_INTERVAL = 5
+
+
+# Slow queries
+# The requests of protocole1 slower than PROTOCOLE1_SLOW_REQUEST_THRESHOLD seconds
+# (None disables it) are written with the plans of their
+# PROTOCOLE1_SLOW_QUERY_STATEMENTS slowest SQL statements to the rotating log
+# PROTOCOLE1_SLOW_QUERY_LOG (see protocole1.slow_queries, disabled without it),
+# browsed by the staff on /slow-queries.
+
+PROTOCOLE1_SLOW_REQUEST_THRESHOLD = 1
+PROTOCOLE1_SLOW_QUERY_STATEMENTS = 5
+PROTOCOLE1_SLOW_QUERY_LOG = os.environ.get("FEEDBACK_SLOW_QUERY_LOG")
+PROTOCOLE1_SLOW_QUERY_LOG_SIZE = 10 * 1024 * 1024
+PROTOCOLE1_SLOW_QUERY_LOG_BACKUPS = 3
+
+
+# Profiling
+# The staff profile a request of protocole1 with the parameter "profile" or the
+# header X-Profile ("cprofile" or "sampling"), and a fraction
+# PROTOCOLE1_PROFILING_SAMPLE_RATE of the requests is profiled in the background
+# (see protocole1.profiling). The latest PROTOCOLE1_PROFILING_KEEP profiles are
+# kept in PROTOCOLE1_PROFILING_DIR (disabled without it), listed on /profiles/.
+
+PROTOCOLE1_PROFILING_DIR = os.environ.get("FEEDBACK_PROFILING_DIR")
+PROTOCOLE1_PROFILING_SAMPLE_RATE = float(
+    os.environ.get("FEEDBACK_PROFILING_SAMPLE_RATE", "0")
+)
+PROTOCOLE1_PROFILING_BACKGROUND_PROFILER = "sampling"
+PROTOCOLE1_PROFILING_INTERVAL = 0.001
+PROTOCOLE1_PROFILING_KEEP = 200
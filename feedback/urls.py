@@ -25,4 +25,8 @@ urlpatterns = [
     path("protocole1/", include("protocole1.urls")),
     path("accounts/login/", protocole1.views.log_in, name="users.log_in"),
     path("accounts/logout/", protocole1.views.log_out, name="users.log_out"),
+    path("metrics", protocole1.views.metrics_view, name="metrics"),
+    path("slow-queries", protocole1.views.slow_queries_view, name="slow_queries"),
+    path("profiles/", protocole1.views.profiles_view, name="profiles"),
+    path("profiles/<str:name>", protocole1.views.profile_view, name="profile"),
 ]
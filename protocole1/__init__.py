@@ -0,0 +1 @@
+default_app_config = "protocole1.apps.Protocole1Config"
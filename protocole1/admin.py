@@ -8,3 +8,7 @@ admin.site.register(models.Experiment)
 admin.site.register(models.ExperimentGroups)
 admin.site.register(models.Result)
 admin.site.register(models.ResultOnIdea)
+admin.site.register(models.ExperimentSummary)
+admin.site.register(models.IdeaSummary)
+admin.site.register(models.StepSummary)
+admin.site.register(models.ExpansionRateBin)
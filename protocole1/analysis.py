@@ -0,0 +1,240 @@
+"""
+Analysis of the results of the experiments.
+
+The reactions of an experiment are loaded in bulk into columnar NumPy arrays
+(see ``load_experiment_data``) on which the statistics are computed without
+going through model instances.
+"""
+import itertools
+
+from django.core.exceptions import ImproperlyConfigured
+
+from protocole1 import models
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# The columns loaded and their types
+COLUMNS = (
+    ("result_id", "int64"),
+    ("order", "int64"),
+    ("idea_id", "int64"),
+    ("did_expand", "bool"),
+    ("reaction", "int64"),
+    ("expansion_rate", "float64"),
+)
+
+# The reactions of the users (UNDEFINED meaning no reaction yet)
+REACTIONS = [reaction for reaction in models.Reactions if reaction.value > 0]
+
+
+class ExperimentData:
+    """
+    The reactions of an experiment as columnar arrays, sorted by result and order.
+
+    :param columns: the arrays by column name (see ``COLUMNS``), the ideas deleted
+                    having -1 as id
+    :type columns: dict of str to numpy.ndarray
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        for name, array in columns.items():
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.result_id)
+
+    def reacted(self):
+        """
+        Gives the subset of the reactions given by the users (not UNDEFINED nor
+        the default value of the model).
+
+        :rtype: ExperimentData
+        """
+        mask = self.reaction > models.Reactions.UNDEFINED.value
+        return ExperimentData(
+            {name: array[mask] for name, array in self.columns.items()}
+        )
+
+
+def _check_numpy():
+    if np is None:
+        raise ImproperlyConfigured("NumPy is required to analyse the experiments.")
+
+
+def load_experiment_data(experiment, chunk_size=10000):
+    """
+    Loads the reactions of an experiment into arrays, reading them in chunks.
+
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param chunk_size: the number of rows read at once, defaults to 10000
+    :type chunk_size: int, optional
+    :return: the reactions given on the experiment
+    :rtype: ExperimentData
+    """
+    _check_numpy()
+    # the ideas waiting for a reaction are not loaded
+    rows = (
+        models.ResultOnIdea.objects.filter(
+            result__experiment=experiment,
+            reaction__gt=models.Reactions.UNDEFINED.value,
+        )
+        .order_by("result_id", "order")
+        .values_list(*(name for name, _ in COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+    chunks = {name: [] for name, _ in COLUMNS}
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        for (name, dtype), values in zip(COLUMNS, zip(*chunk)):
+            if name == "idea_id":
+                values = [-1 if value is None else value for value in values]
+            chunks[name].append(np.array(values, dtype=dtype))
+    return ExperimentData(
+        {
+            name: np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype)
+            for name, dtype in COLUMNS
+        }
+    )
+
+
+def _reaction_index(reaction):
+    # the reactions (CONTINUE, EXPAND, NEUTRAL) indexed from 0
+    return reaction - 1
+
+
+def reactions_by_idea(data):
+    """
+    Computes the number and the rate of each reaction for each idea.
+
+    :param data: the reactions of an experiment
+    :type data: ExperimentData
+    :return: the ids of the ideas, the counts (one row per idea, one column per
+            reaction of ``REACTIONS``) and the rates
+    :rtype: tuple of numpy.ndarray
+    """
+    data = data.reacted()
+    ideas, inverse = np.unique(data.idea_id, return_inverse=True)
+    counts = np.bincount(
+        inverse * len(REACTIONS) + _reaction_index(data.reaction),
+        minlength=len(ideas) * len(REACTIONS),
+    ).reshape(len(ideas), len(REACTIONS))
+    totals = counts.sum(axis=1, keepdims=True)
+    rates = counts / np.maximum(totals, 1)
+    return ideas, counts, rates
+
+
+def expansion_rate_by_step(data):
+    """
+    Computes the mean and the standard deviation of the expansion rate after
+    the reactions at each step.
+
+    :param data: the reactions of an experiment
+    :type data: ExperimentData
+    :return: the number of reactions, the mean and the standard deviation of the
+            expansion rate by step (index)
+    :rtype: tuple of numpy.ndarray
+    """
+    data = data.reacted()
+    counts = np.bincount(data.order)
+    sums = np.bincount(data.order, weights=data.expansion_rate)
+    squares = np.bincount(data.order, weights=data.expansion_rate**2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means**2, 0))
+    return counts, means, stds
+
+
+def reaction_transitions(data):
+    """
+    Counts the transitions between the successive reactions of the users.
+
+    :param data: the reactions of an experiment
+    :type data: ExperimentData
+    :return: the number of transitions from a reaction (row) to the next one
+            (column), indexed as ``REACTIONS``
+    :rtype: numpy.ndarray
+    """
+    data = data.reacted()
+    # the reactions are sorted by result and order: consecutive reactions of the
+    # same result are transitions
+    same_result = data.result_id[1:] == data.result_id[:-1]
+    previous = _reaction_index(data.reaction[:-1][same_result])
+    following = _reaction_index(data.reaction[1:][same_result])
+    return np.bincount(
+        previous * len(REACTIONS) + following, minlength=len(REACTIONS) ** 2
+    ).reshape(len(REACTIONS), len(REACTIONS))
+
+
+def expansion_contingency(data):
+    """
+    Counts the reactions depending on whether the algorithm did expand.
+
+    :param data: the reactions of an experiment
+    :type data: ExperimentData
+    :return: the number of reactions without (first row) and with (second row)
+            expansion, one column per reaction of ``REACTIONS``
+    :rtype: numpy.ndarray
+    """
+    data = data.reacted()
+    return np.bincount(
+        data.did_expand.astype("int64") * len(REACTIONS)
+        + _reaction_index(data.reaction),
+        minlength=2 * len(REACTIONS),
+    ).reshape(2, len(REACTIONS))
+
+
+def experiment_stats(experiment):
+    """
+    Computes the statistics of an experiment.
+
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :return: the statistics, which can be serialized in JSON
+    :rtype: dict
+    """
+    data = load_experiment_data(experiment)
+    ideas, counts, rates = reactions_by_idea(data)
+    steps_counts, steps_means, steps_stds = expansion_rate_by_step(data)
+    reactions = [reaction.name for reaction in REACTIONS]
+    return {
+        "experiment": experiment.id,
+        "reactions": reactions,
+        "reactions_count": int(counts.sum()),
+        "ideas": [
+            {
+                "idea": int(idea) if idea >= 0 else None,
+                "counts": dict(zip(reactions, idea_counts.tolist())),
+                "rates": dict(zip(reactions, idea_rates.tolist())),
+            }
+            for idea, idea_counts, idea_rates in zip(ideas, counts, rates)
+        ],
+        "steps": [
+            {"order": order, "count": int(count), "mean": mean, "std": std}
+            for order, (count, mean, std) in enumerate(
+                zip(steps_counts, steps_means.tolist(), steps_stds.tolist())
+            )
+            if count
+        ],
+        "transitions": dict(
+            zip(
+                reactions,
+                (
+                    dict(zip(reactions, row))
+                    for row in reaction_transitions(data).tolist()
+                ),
+            )
+        ),
+        "expansion_contingency": {
+            expansion: dict(zip(reactions, row))
+            for expansion, row in zip(
+                ("fixation", "expansion"), expansion_contingency(data).tolist()
+            )
+        },
+    }
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class Protocole1Config(AppConfig):
     name = 'protocole1'
+
+    def ready(self):
+        from protocole1 import database, journal, signals  # noqa: F401
+
+        journal.open_at_startup()
@@ -0,0 +1,306 @@
+"""
+Synthetic load benchmark of the participation to an experiment.
+
+An experiment is created with pools of the requested sizes, then virtual
+participants walk through the participation (first visit, reaction, redirection,
+next idea...) until they finish, with the Django test client in worker threads.
+The homepage and the results page are also requested by each participant once
+finished. The latency and the number of SQL queries of each request are recorded
+by kind of step (see ``STEPS``) to be summed up by ``summarize``.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from protocole1 import models
+
+# The kinds of steps of the participation
+STEPS = ("first", "react", "next", "react_json", "homepage", "results")
+
+# The speculation given to the script of the participation page
+SPECULATION_RE = re.compile(
+    r'<script id="speculation" type="application/json">(.*?)</script>'
+)
+
+
+class Measure:
+    """
+    The measure of a request.
+
+    :param step: the kind of step (see ``STEPS``)
+    :type step: str
+    :param order: the number of ideas proposed to the participant before
+    :type order: int
+    :param duration: the duration of the request in seconds
+    :type duration: float
+    :param queries: the number of SQL queries of the request
+    :type queries: int
+    """
+
+    def __init__(self, step, order, duration, queries):
+        self.step = step
+        self.order = order
+        self.duration = duration
+        self.queries = queries
+
+
+def create_experiment(fixation_ideas, expansion_ideas, limit_ideas_number=-1):
+    """
+    Creates an experiment for the benchmark, with one group of each type.
+
+    :param fixation_ideas: the number of ideas of the fixation group
+    :type fixation_ideas: int
+    :param expansion_ideas: the number of ideas of the expansion group
+    :type expansion_ideas: int
+    :param limit_ideas_number: the number of ideas proposed to each participant,
+                                defaults to -1 (no limit)
+    :type limit_ideas_number: int, optional
+    :return: the experiment
+    :rtype: Experiment
+    """
+    name = "benchmark-%s" % uuid.uuid4().hex[:8]
+    experiment = models.Experiment.objects.create(
+        name=name, running=True, limit_ideas_number=limit_ideas_number
+    )
+    for group_type, count in (
+        (models.GroupType.FIXATION, fixation_ideas),
+        (models.GroupType.EXPANSION, expansion_ideas),
+    ):
+        group = models.IdeasGroup.objects.create(
+            name="%s-%s" % (name, group_type.name.lower())
+        )
+        ideas = models.Idea.objects.bulk_create(
+            models.Idea(value="%s %s" % (group_type.name.lower(), index))
+            for index in range(count)
+        )
+        if not all(idea.pk for idea in ideas):
+            ideas = models.Idea.objects.order_by("-pk")[:count]
+        group.ideas.add(*ideas)
+        models.ExperimentGroups.objects.create(
+            experiment=experiment, group=group, group_type_here=group_type.value
+        )
+    return experiment
+
+
+def create_participants(experiment, count):
+    """
+    Creates the users of the benchmark (without usable password).
+
+    :param experiment: the experiment of the benchmark
+    :type experiment: Experiment
+    :param count: the number of users
+    :type count: int
+    :return: the users
+    :rtype: list of User
+    """
+    usernames = ["%s-%s" % (experiment.name, index) for index in range(count)]
+    User.objects.bulk_create(
+        User(username=username, password=make_password(None)) for username in usernames
+    )
+    return list(User.objects.filter(username__in=usernames))
+
+
+def delete_experiment(experiment):
+    """
+    Deletes an experiment created for the benchmark, with its groups, ideas and
+    users.
+
+    :param experiment: the experiment of the benchmark
+    :type experiment: Experiment
+    """
+    groups = models.IdeasGroup.objects.filter(experimentgroups__experiment=experiment)
+    models.Idea.objects.filter(groups__in=groups).delete()
+    groups.delete()
+    User.objects.filter(username__startswith="%s-" % experiment.name).delete()
+    experiment.delete()
+
+
+def _request(client, method, url, data=None):
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data or {})
+        if getattr(response, "streaming", False):
+            b"".join(response.streaming_content)
+        duration = time.perf_counter() - start
+    return response, duration, len(queries.captured_queries)
+
+
+def participate(user, experiment, use_json=False, rng=random):
+    """
+    Makes a user participate to an experiment until the end.
+
+    :param user: the user participating
+    :type user: User
+    :param experiment: the experiment
+    :type experiment: Experiment
+    :param use_json: whether the reactions are sent to the JSON endpoint (as the
+                    page does) instead of following the links, defaults to False
+    :type use_json: boolean, optional
+    :param rng: the random generator used to pick the reactions
+    :type rng: random.Random, optional
+    :return: the measures of the requests
+    :rtype: list of Measure
+    """
+    client = Client(HTTP_HOST="localhost")
+    client.force_login(user)
+    url = reverse("protocole1.participate_experiment", args=[experiment.id])
+    react_url = reverse("protocole1.react_experiment", args=[experiment.id])
+    reactions = [reaction.value for reaction in models.Reactions if reaction.value > 0]
+    measures = []
+
+    response, duration, queries = _request(client, "get", url)
+    measures.append(Measure("first", 0, duration, queries))
+    speculation = None
+    if use_json and response.status_code == 200:
+        match = SPECULATION_RE.search(response.content.decode("utf-8"))
+        speculation = json.loads(match.group(1)) if match else None
+    for order in itertools.count(1):
+        if response.status_code != 200:
+            break
+        reaction = rng.choice(reactions)
+        if use_json:
+            data = {"reaction": reaction}
+            if speculation:
+                data["speculation"] = speculation["token"]
+            response, duration, queries = _request(client, "post", react_url, data)
+            measures.append(Measure("react_json", order, duration, queries))
+            answer = response.json()
+            if answer.get("finished", True):
+                break
+            speculation = answer.get("speculation")
+        else:
+            response, duration, queries = _request(
+                client, "get", url, {"reaction": reaction}
+            )
+            measures.append(Measure("react", order, duration, queries))
+            response, duration, queries = _request(client, "get", url)
+            measures.append(Measure("next", order, duration, queries))
+
+    for step, step_url in (
+        ("homepage", reverse("protocole1.homepage")),
+        ("results", reverse("protocole1.results_experiment", args=[experiment.id])),
+    ):
+        response, duration, queries = _request(client, "get", step_url)
+        measures.append(Measure(step, order, duration, queries))
+    connection.close()
+    return measures
+
+
+def run(experiment, users, threads=4, use_json=False, seed=None):
+    """
+    Makes users participate to an experiment concurrently.
+
+    :param experiment: the experiment
+    :type experiment: Experiment
+    :param users: the users participating
+    :type users: list of User
+    :param threads: the number of worker threads, defaults to 4
+    :type threads: int, optional
+    :param use_json: whether the reactions are sent to the JSON endpoint,
+                    defaults to False
+    :type use_json: boolean, optional
+    :param seed: the seed of the reactions of the users, defaults to None
+    :type seed: int, optional
+    :return: the measures of the requests, the total duration in seconds and the
+            errors which stopped participants
+    :rtype: tuple of list of Measure, float and list of Exception
+    """
+    queue = list(users)
+    lock = threading.Lock()
+    measures = []
+    errors = []
+
+    def worker(index):
+        rng = random.Random(None if seed is None else seed + index)
+        while True:
+            with lock:
+                if not queue:
+                    return
+                user = queue.pop()
+            try:
+                user_measures = participate(user, experiment, use_json, rng)
+            except Exception as error:  # reported after the run
+                with lock:
+                    errors.append(error)
+                continue
+            with lock:
+                measures.extend(user_measures)
+
+    workers = [
+        threading.Thread(target=worker, args=(index,)) for index in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    duration = time.perf_counter() - start
+    return measures, duration, errors
+
+
+def _percentile(values, percent):
+    # values must be sorted
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def summarize(measures, duration):
+    """
+    Sums the measures up by kind of step.
+
+    :param measures: the measures of the requests
+    :type measures: list of Measure
+    :param duration: the total duration in seconds
+    :type duration: float
+    :return: for each kind of step, the number of requests, the requests per
+            second, the percentiles of the latency (ms), the mean and maximum
+            number of SQL queries, and the mean number of queries and latency
+            in the first and the last quarter of the participation
+    :rtype: dict
+    """
+    by_step = defaultdict(list)
+    for measure in measures:
+        by_step[measure.step].append(measure)
+    summary = {}
+    for step in STEPS:
+        step_measures = by_step.get(step)
+        if not step_measures:
+            continue
+        durations = sorted(measure.duration * 1000 for measure in step_measures)
+        queries = [measure.queries for measure in step_measures]
+        min_order = min(measure.order for measure in step_measures)
+        max_order = max(measure.order for measure in step_measures)
+        quarter = (max_order - min_order) / 4
+        first = [m for m in step_measures if m.order <= min_order + quarter]
+        last = [m for m in step_measures if m.order >= max_order - quarter]
+        summary[step] = {
+            "requests": len(step_measures),
+            "rps": len(step_measures) / duration if duration else 0,
+            "p50": _percentile(durations, 50),
+            "p95": _percentile(durations, 95),
+            "p99": _percentile(durations, 99),
+            "queries": sum(queries) / len(queries),
+            "max_queries": max(queries),
+            "first_quarter": (
+                sum(m.queries for m in first) / len(first),
+                sum(m.duration for m in first) * 1000 / len(first),
+            ),
+            "last_quarter": (
+                sum(m.queries for m in last) / len(last),
+                sum(m.duration for m in last) * 1000 / len(last),
+            ),
+        }
+    return summary
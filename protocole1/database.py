@@ -0,0 +1,38 @@
+"""
+Tuning of the database connections.
+
+The PRAGMA statements of ``SQLITE_PRAGMAS`` (see the database profiles of the
+settings) are run on each new SQLite connection: most of them, such as the busy
+timeout or the cache size, only apply to the connection running them.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def sqlite_pragmas():
+    """
+    Gives the PRAGMA statements to run on a new SQLite connection.
+
+    :return: the statements, in the order of SQLITE_PRAGMAS
+    :rtype: list of str
+    """
+    return [
+        "PRAGMA %s = %s" % (name, value)
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items()
+    ]
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """
+    Runs the PRAGMA statements of SQLITE_PRAGMAS on a new SQLite connection.
+    """
+    if connection.vendor != "sqlite":
+        return
+    statements = sqlite_pragmas()
+    if not statements:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
@@ -0,0 +1,316 @@
+"""
+Export of the results of the experiments.
+
+The reactions of an experiment (with their result, idea and user) are read in
+chunks and written as CSV, JSON lines or a column-chunked binary format, each
+format being a generator of bytes so that the exports can be written to a file
+(see the export_results command) or streamed over HTTP with a constant memory.
+
+The exports are chained by the time of the reactions: an export gives the time
+until which it goes (``export_until``), and the next one takes it as ``since``
+to export the reactions written after. The incremental exports only contain
+reactions given, a reaction being exported once written, even if its idea was
+exported before while waiting for it: the rows of an idea exported again
+replace the previous ones (same id). The reactions of the last
+``EXPORT_DELAY`` are left to the next export, since they may belong to
+transactions not committed yet.
+
+The column-chunked format ("columnar") starts with ``COLUMNAR_MAGIC`` followed by
+the JSON description of the columns. Then, for each chunk, the number of rows
+and, for each column, its encoded data (see ``_encode_column``), each being
+preceded by its length (unsigned 32 bits little-endian integers). A chunk of 0
+rows ends the file.
+"""
+
+import array
+import csv
+import datetime
+import io
+import itertools
+import json
+import struct
+import sys
+import zlib
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from protocole1 import models
+
+# The columns exported: name, field (through ResultOnIdea) and type
+COLUMNS = (
+    ("id", "pk", "int"),
+    ("experiment", "result__experiment_id", "int"),
+    ("result", "result_id", "int"),
+    ("user", "result__user_id", "int"),
+    ("username", "result__user__username", "str"),
+    ("order", "order", "int"),
+    ("idea", "idea_id", "int"),
+    ("idea_value", "idea__value", "str"),
+    ("did_expand", "did_expand", "bool"),
+    ("reaction", "reaction", "int"),
+    ("expansion_rate", "expansion_rate", "float"),
+    ("result_expansion_rate", "result__expansion_rate", "float"),
+    ("finished", "result__finished", "bool"),
+)
+COLUMNS_NAMES = [name for name, _, _ in COLUMNS]
+
+FORMATS = ("csv", "jsonl", "columnar")
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "columnar": "application/octet-stream",
+}
+
+# The reactions written more recently are left to the next export
+EXPORT_DELAY = datetime.timedelta(seconds=60)
+
+COLUMNAR_MAGIC = b"P1COLS\x01\n"
+_LENGTH = struct.Struct("<I")
+_ARRAY_TYPES = {"int": "q", "float": "d", "bool": "b"}
+
+
+def export_until():
+    """
+    Gives the time until which the reactions are exported now: the next export
+    must start from it.
+
+    :rtype: datetime
+    """
+    return timezone.now() - EXPORT_DELAY
+
+
+def parse_since(value):
+    """
+    Reads the time from which an export starts, given as ISO 8601 (in the current
+    time zone when it has none).
+
+    :param value: the time to read
+    :type value: str
+    :raises ValueError: when the time is not valid
+    :rtype: datetime
+    """
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError("Not a valid time: %r" % value)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_rows(experiment, since=None, until=None, chunk_size=2000):
+    """
+    Iterates over the reactions of an experiment: all of them in the order of
+    their ids, or the reactions written in a period in the order they were
+    written.
+
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param since: exports only the reactions written after, defaults to None
+    :type since: datetime, optional
+    :param until: exports only the reactions written until, when since is given,
+        defaults to None (``export_until``)
+    :type until: datetime, optional
+    :param chunk_size: the number of rows read at once, defaults to 2000
+    :type chunk_size: int, optional
+    :return: the values of the columns (see ``COLUMNS``)
+    :rtype: iterator of tuple
+    """
+    reactions_ideas = models.ResultOnIdea.objects.filter(
+        result__experiment=experiment
+    ).order_by("pk")
+    if since is not None:
+        # the ideas waiting for a reaction have no time and are left out
+        reactions_ideas = reactions_ideas.filter(
+            reacted_at__gt=since,
+            reacted_at__lte=until if until is not None else export_until(),
+        ).order_by("reacted_at", "pk")
+    return reactions_ideas.values_list(*(field for _, field, _ in COLUMNS)).iterator(
+        chunk_size=chunk_size
+    )
+
+
+def _batches(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, chunk_size))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_chunks(rows, chunk_size=2000):
+    """
+    Writes rows as CSV (with a header).
+
+    :param rows: the rows to write
+    :type rows: iterable of tuple
+    :param chunk_size: the number of rows by chunk of bytes, defaults to 2000
+    :type chunk_size: int, optional
+    :rtype: generator of bytes
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS_NAMES)
+    for batch in _batches(rows, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def jsonl_chunks(rows, chunk_size=2000):
+    """
+    Writes rows as JSON lines (one object per row).
+
+    :param rows: the rows to write
+    :type rows: iterable of tuple
+    :param chunk_size: the number of rows by chunk of bytes, defaults to 2000
+    :type chunk_size: int, optional
+    :rtype: generator of bytes
+    """
+    for batch in _batches(rows, chunk_size):
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS_NAMES, row)), ensure_ascii=False) + "\n"
+            for row in batch
+        ).encode("utf-8")
+
+
+def _encode_array(typecode, values):
+    data = array.array(typecode, values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _encode_column(column_type, values):
+    """
+    Encodes a column: a validity byte per row (0 for null values), then the
+    values as little-endian 64 bits integers, 64 bits floats or bytes (booleans),
+    or for strings the offsets (unsigned 32 bits) of the values in their UTF-8
+    concatenation followed by this concatenation.
+    """
+    validity = bytes(value is not None for value in values)
+    if column_type == "str":
+        encoded = [(value or "").encode("utf-8") for value in values]
+        offsets = [0]
+        offsets.extend(itertools.accumulate(len(value) for value in encoded))
+        return validity + _encode_array("I", offsets) + b"".join(encoded)
+    default = 0.0 if column_type == "float" else 0
+    return validity + _encode_array(
+        _ARRAY_TYPES[column_type],
+        (default if value is None else value for value in values),
+    )
+
+
+def columnar_chunks(rows, chunk_size=2000):
+    """
+    Writes rows in the column-chunked binary format.
+
+    :param rows: the rows to write
+    :type rows: iterable of tuple
+    :param chunk_size: the number of rows by chunk, defaults to 2000
+    :type chunk_size: int, optional
+    :rtype: generator of bytes
+    """
+    header = json.dumps(
+        [{"name": name, "type": column_type} for name, _, column_type in COLUMNS]
+    ).encode("utf-8")
+    yield COLUMNAR_MAGIC + _LENGTH.pack(len(header)) + header
+    for batch in _batches(rows, chunk_size):
+        parts = [_LENGTH.pack(len(batch))]
+        for (_, _, column_type), values in zip(COLUMNS, zip(*batch)):
+            encoded = _encode_column(column_type, values)
+            parts.append(_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        yield b"".join(parts)
+    yield _LENGTH.pack(0)
+
+
+def _decode_array(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def read_columnar(stream):
+    """
+    Reads a file in the column-chunked binary format.
+
+    :param stream: the binary file to read
+    :type stream: file object
+    :return: the columns of each chunk, by name
+    :rtype: generator of dict
+    """
+    if stream.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar export")
+    (length,) = _LENGTH.unpack(stream.read(_LENGTH.size))
+    columns = json.loads(stream.read(length).decode("utf-8"))
+    while True:
+        (count,) = _LENGTH.unpack(stream.read(_LENGTH.size))
+        if not count:
+            return
+        chunk = {}
+        for column in columns:
+            (length,) = _LENGTH.unpack(stream.read(_LENGTH.size))
+            data = stream.read(length)
+            validity, data = data[:count], data[count:]
+            if column["type"] == "str":
+                offsets_size = (count + 1) * 4
+                offsets = _decode_array("I", data[:offsets_size])
+                data = data[offsets_size:]
+                values = [
+                    data[offsets[index] : offsets[index + 1]].decode("utf-8")
+                    for index in range(count)
+                ]
+            else:
+                values = _decode_array(_ARRAY_TYPES[column["type"]], data).tolist()
+                if column["type"] == "bool":
+                    values = [bool(value) for value in values]
+            chunk[column["name"]] = [
+                value if valid else None for valid, value in zip(validity, values)
+            ]
+        yield chunk
+
+
+WRITERS = {"csv": csv_chunks, "jsonl": jsonl_chunks, "columnar": columnar_chunks}
+
+
+def export_chunks(rows, export_format, chunk_size=2000, compress=False):
+    """
+    Writes rows in a format.
+
+    :param rows: the rows to write (see ``export_rows``)
+    :type rows: iterable of tuple
+    :param export_format: the format, one of ``FORMATS``
+    :type export_format: str
+    :param chunk_size: the number of rows by chunk, defaults to 2000
+    :type chunk_size: int, optional
+    :param compress: whether the export is compressed with gzip, defaults to False
+    :type compress: boolean, optional
+    :rtype: generator of bytes
+    """
+    chunks = WRITERS[export_format](rows, chunk_size)
+    if not compress:
+        return chunks
+    return gzip_chunks(chunks)
+
+
+def gzip_chunks(chunks):
+    """
+    Compresses chunks of bytes with gzip on the fly.
+
+    :param chunks: the chunks to compress
+    :type chunks: iterable of bytes
+    :rtype: generator of bytes
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,375 @@
+"""
+Write-behind journal of the reactions.
+
+When the setting ``PROTOCOLE1_WRITE_BEHIND_LOG`` names a directory, the reactions
+are not written to the database by the requests: ``record_reaction`` appends them
+to a segment of the journal (a JSON line, synced to the disk before answering),
+and a background thread applies them every ``PROTOCOLE1_WRITE_BEHIND_INTERVAL``
+seconds in one transaction, with ``bulk_update``. Until then, the reactions are
+kept in an in-process overlay applied to the participation states loaded (see
+``ReactionJournal.apply``), so that the participants see their own reactions.
+
+The segments are deleted once applied: the segments found when the journal is
+opened (after a crash) are replayed first, when the server starts (see
+``open_at_startup``). Applying a reaction is idempotent (a
+reaction is only written on an idea waiting for one), so a segment replayed
+twice does no harm.
+
+The overlay being local to the process, the write-behind mode requires the
+participation to be served by a single process (with threads). The ideas
+proposed are still written by the requests, since the next requests need their
+primary keys.
+"""
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from protocole1 import models, results_cache, summaries
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".jsonl"
+
+# The number of reactions applied per query
+BATCH_SIZE = 500
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """
+    Gives the journal of the process, opened (and replayed) on the first call.
+
+    :return: the journal, None if the write-behind mode is disabled
+    :rtype: ReactionJournal
+    """
+    global _journal
+    directory = getattr(settings, "PROTOCOLE1_WRITE_BEHIND_LOG", None)
+    if directory is None:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            journal = ReactionJournal(directory)
+            journal.replay()
+            journal.start(getattr(settings, "PROTOCOLE1_WRITE_BEHIND_INTERVAL", 1))
+            atexit.register(journal.stop)
+            _journal = journal
+    return _journal
+
+
+def open_at_startup(argv=None):
+    """
+    Opens the journal when the process serves the application, so that the
+    reactions left by a crashed process are written before the first requests.
+    The other management commands do not open it (the database may not be
+    migrated yet).
+
+    :param argv: the command line of the process, defaults to None (sys.argv)
+    :type argv: list of str, optional
+    :return: the journal, None if the write-behind mode is disabled or the
+        process runs a management command
+    :rtype: ReactionJournal
+    """
+    argv = sys.argv if argv is None else argv
+    program = os.path.basename(argv[0]) if argv else ""
+    if program in ("manage.py", "django-admin", "django-admin.py", "__main__.py"):
+        if argv[1:2] != ["runserver"]:
+            return None
+        # the process of the autoreloader only restarts the server
+        if "--noreload" not in argv and os.environ.get("RUN_MAIN") != "true":
+            return None
+    return get_journal()
+
+
+def reaction_entry(result, result_on_idea, reaction, previous_expansion_rate):
+    """
+    Gives the entry of the journal of a reaction.
+
+    :param result: the result of the user, with its expansion rate updated
+    :type result: Result
+    :param result_on_idea: the idea reacted to
+    :type result_on_idea: ResultOnIdea
+    :param reaction: the reaction of the user
+    :type reaction: Reactions
+    :param previous_expansion_rate: the expansion rate before the reaction
+    :type previous_expansion_rate: float
+    :rtype: dict
+    """
+    return {
+        "experiment": result.experiment_id,
+        "user": result.user_id,
+        "result": result.pk,
+        "result_on_idea": result_on_idea.pk,
+        "idea": result_on_idea.idea_id,
+        "order": result_on_idea.order,
+        "did_expand": result_on_idea.did_expand,
+        "reaction": reaction.value,
+        "expansion_rate": result.expansion_rate,
+        "previous_expansion_rate": previous_expansion_rate,
+    }
+
+
+def apply_entries(entries):
+    """
+    Writes reactions of the journal to the database in one transaction, skipping
+    the ones already written.
+
+    :param entries: the entries of the reactions, in order
+    :type entries: list of dict
+    """
+    # the reactions are only written by the journal: the ideas waiting for one are
+    # read before the transaction, which then starts with a write (SQLite does not
+    # wait for the lock when a transaction reading the database starts writing)
+    waiting = set()
+    for start in range(0, len(entries), BATCH_SIZE):
+        waiting.update(
+            models.ResultOnIdea.objects.filter(
+                pk__in=[
+                    entry["result_on_idea"]
+                    for entry in entries[start : start + BATCH_SIZE]
+                ],
+                reaction=models.Reactions.UNDEFINED.value,
+            ).values_list("pk", flat=True)
+        )
+    experiments = set()
+    # the reactions are dated when written, for the incremental exports
+    reacted_at = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(entries), BATCH_SIZE):
+            batch = entries[start : start + BATCH_SIZE]
+            applied = []
+            reactions_ideas = {}
+            results = {}
+            for entry in batch:
+                # an idea reacted to twice keeps its first reaction
+                if entry["result_on_idea"] not in waiting:
+                    continue
+                waiting.remove(entry["result_on_idea"])
+                applied.append(entry)
+                reactions_ideas[entry["result_on_idea"]] = models.ResultOnIdea(
+                    pk=entry["result_on_idea"],
+                    result_id=entry["result"],
+                    idea_id=entry["idea"],
+                    order=entry["order"],
+                    did_expand=entry["did_expand"],
+                    reaction=entry["reaction"],
+                    expansion_rate=entry["expansion_rate"],
+                    reacted_at=reacted_at,
+                )
+                # the last expansion rate of each result is kept
+                results[entry["result"]] = models.Result(
+                    pk=entry["result"],
+                    experiment_id=entry["experiment"],
+                    expansion_rate=entry["expansion_rate"],
+                )
+            if not applied:
+                continue
+            models.ResultOnIdea.objects.bulk_update(
+                reactions_ideas.values(), ["reaction", "expansion_rate", "reacted_at"]
+            )
+            models.Result.objects.bulk_update(results.values(), ["expansion_rate"])
+            # the results not proposed another idea since do not wait anymore
+            models.Result.objects.filter(pk__in=list(results)).update(
+                pending=Case(
+                    When(
+                        last_result_on_idea_id__in=list(reactions_ideas),
+                        then=Value(False),
+                    ),
+                    default=F("pending"),
+                )
+            )
+            for entry in applied:
+                summaries.count_reaction(
+                    models.Result(
+                        experiment_id=entry["experiment"],
+                        expansion_rate=entry["expansion_rate"],
+                    ),
+                    reactions_ideas[entry["result_on_idea"]],
+                    entry["previous_expansion_rate"],
+                )
+                experiments.add(entry["experiment"])
+        for experiment_id in experiments:
+            results_cache.bump_version(experiment_id)
+
+
+class ReactionJournal:
+    """
+    The journal of the reactions of a process, in the segments of a directory.
+
+    :param directory: the directory of the segments
+    :type directory: str
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # the latest reaction not applied by experiment and user
+        self.overlay = {}
+        # the segment being written with its entries
+        self.segment = None
+        self.entries = []
+        # the segments closed with their entries, waiting to be applied
+        self.closed = []
+        self.sequence = max(self.segment_numbers(), default=0)
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def segment_numbers(self):
+        return [
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[: -len(SEGMENT_SUFFIX)].isdigit()
+        ]
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, "%012d%s" % (number, SEGMENT_SUFFIX))
+
+    def append(self, entry):
+        """
+        Appends a reaction to the journal, synced to the disk.
+
+        :param entry: the entry of the reaction (see ``reaction_entry``)
+        :type entry: dict
+        :return: whether the reaction has been appended (not if the idea already
+            has a reaction in the journal)
+        :rtype: bool
+        """
+        key = (entry["experiment"], entry["user"])
+        with self.lock:
+            latest = self.overlay.get(key)
+            if latest is not None and (
+                latest["result_on_idea"] == entry["result_on_idea"]
+            ):
+                return False
+            if self.segment is None:
+                self.sequence += 1
+                self.segment = open(
+                    self.segment_path(self.sequence), "a", encoding="utf-8"
+                )
+            self.segment.write(json.dumps(entry) + "\n")
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.entries.append(entry)
+            self.overlay[key] = entry
+        return True
+
+    def latest(self, experiment, user):
+        """
+        Gives the latest reaction of a user to an experiment not applied yet. It
+        must be read before the participation state, so that the state is up to
+        date with the reaction if applied meanwhile.
+
+        :param experiment: the experiment considered
+        :type experiment: Experiment
+        :param user: the user considered
+        :type user: User
+        :return: the entry of the reaction, None if there is none
+        :rtype: dict
+        """
+        return self.overlay.get((experiment.id, user.pk))
+
+    @staticmethod
+    def apply(state, entry):
+        """
+        Applies the latest reaction of a user not applied yet to his
+        participation state.
+
+        :param state: the participation state of the user
+        :type state: ParticipationState
+        :param entry: the entry given by ``latest``
+        :type entry: dict
+        """
+        if entry is None or state.result is None:
+            return
+        state.result.expansion_rate = entry["expansion_rate"]
+        last_result = state.last_result
+        if last_result is not None and last_result.pk == entry["result_on_idea"]:
+            last_result.reaction = entry["reaction"]
+            last_result.expansion_rate = entry["expansion_rate"]
+            state.result.pending = False
+
+    def flush(self):
+        """
+        Applies the reactions of the journal to the database, then deletes their
+        segments and removes them from the overlay.
+        """
+        with self.flush_lock:
+            with self.lock:
+                if self.segment is not None:
+                    self.segment.close()
+                    self.closed.append((self.segment.name, self.entries))
+                    self.segment, self.entries = None, []
+                closed = list(self.closed)
+            if not closed:
+                return
+            apply_entries([entry for _, entries in closed for entry in entries])
+            with self.lock:
+                for path, entries in closed:
+                    os.remove(path)
+                    for entry in entries:
+                        key = (entry["experiment"], entry["user"])
+                        if self.overlay.get(key) is entry:
+                            del self.overlay[key]
+                del self.closed[: len(closed)]
+
+    def replay(self):
+        """
+        Applies the segments left by a previous process, the last line of a
+        segment being ignored if it was not written completely.
+        """
+        for number in sorted(self.segment_numbers()):
+            path = self.segment_path(number)
+            entries = []
+            with open(path, encoding="utf-8") as segment:
+                for line in segment:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        logger.warning("Incomplete entry ignored in %s", path)
+            apply_entries(entries)
+            os.remove(path)
+            logger.info("%s reactions replayed from %s", len(entries), path)
+
+    def start(self, interval):
+        """
+        Starts the thread flushing the journal every interval.
+
+        :param interval: the number of seconds between the flushes
+        :type interval: float
+        """
+        self.thread = threading.Thread(
+            target=self.run, args=(interval,), name="reaction-journal", daemon=True
+        )
+        self.thread.start()
+
+    def run(self, interval):
+        while not self.stopping.wait(interval):
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                # the reactions are kept to be applied by the next flush
+                logger.exception("Failed to flush the reaction journal")
+
+    def stop(self):
+        """
+        Stops the flushing thread and flushes the journal a last time.
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush the reaction journal")
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PROFILES = ("default", "sqlite", "postgresql")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the database profiles (see FEEDBACK_DB_PROFILE in the settings) "
+        "under concurrent participations: runs benchmark_participation with each "
+        "profile in a new process. The SQLite profiles use a new database "
+        "(migrated in a temporary directory) so that they start from the same "
+        "state; the postgresql profile uses the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profiles",
+            default="default,sqlite",
+            help="The profiles compared, separated by commas "
+            '(defaults to "default,sqlite")',
+        )
+        parser.add_argument("--participants", type=int, default=50)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--fixation-ideas", type=int, default=50)
+        parser.add_argument("--expansion-ideas", type=int, default=50)
+        parser.add_argument("--limit", type=int, default=-1)
+        parser.add_argument("--json", action="store_true")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        profiles = [
+            profile.strip()
+            for profile in options["profiles"].split(",")
+            if profile.strip()
+        ]
+        for profile in profiles:
+            if profile not in PROFILES:
+                raise CommandError(
+                    "Unknown profile %r, choose among %s"
+                    % (profile, ", ".join(PROFILES))
+                )
+        arguments = [
+            "--participants=%s" % options["participants"],
+            "--threads=%s" % options["threads"],
+            "--fixation-ideas=%s" % options["fixation_ideas"],
+            "--expansion-ideas=%s" % options["expansion_ideas"],
+            "--limit=%s" % options["limit"],
+            "--seed=%s" % options["seed"],
+        ]
+        if options["json"]:
+            arguments.append("--json")
+        for profile in profiles:
+            self.stdout.write(self.style.MIGRATE_HEADING("Profile %s" % profile))
+            with tempfile.TemporaryDirectory() as directory:
+                environment = dict(os.environ, FEEDBACK_DB_PROFILE=profile)
+                if profile != "postgresql":
+                    environment["FEEDBACK_DB_NAME"] = os.path.join(
+                        directory, "db.sqlite3"
+                    )
+                    self.manage(environment, "migrate", "--verbosity=0")
+                self.manage(environment, "benchmark_participation", *arguments)
+
+    def manage(self, environment, *arguments):
+        """
+        Runs a command of manage.py in a new process with the given environment.
+        """
+        self.stdout.flush()
+        completed = subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, "manage.py")]
+            + list(arguments),
+            env=environment,
+        )
+        if completed.returncode:
+            raise CommandError(
+                "%s failed with the code %s" % (arguments[0], completed.returncode)
+            )
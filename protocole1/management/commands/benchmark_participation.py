@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+
+from protocole1 import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the participation to an experiment: creates an experiment "
+        "with pools of the given sizes and makes virtual participants walk "
+        "through it concurrently until they finish, then reports the requests "
+        "per second, the latency percentiles and the SQL queries of each step. "
+        "The data is written to the configured database and deleted afterwards "
+        "(unless --keep), so use a copy of the production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--participants", type=int, default=20)
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--fixation-ideas", type=int, default=50)
+        parser.add_argument("--expansion-ideas", type=int, default=50)
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=-1,
+            help="The number of ideas proposed to each participant (no limit by "
+            "default, the participants finish when the pool is exhausted)",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Sends the reactions to the JSON endpoint (as the page does) "
+            "instead of following the links",
+        )
+        parser.add_argument("--seed", type=int, help="The seed of the reactions")
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keeps the experiment, its ideas and its participants",
+        )
+
+    def handle(self, *args, **options):
+        experiment = benchmark.create_experiment(
+            options["fixation_ideas"], options["expansion_ideas"], options["limit"]
+        )
+        try:
+            users = benchmark.create_participants(experiment, options["participants"])
+            measures, duration, errors = benchmark.run(
+                experiment, users, options["threads"], options["json"], options["seed"]
+            )
+        finally:
+            if not options["keep"]:
+                benchmark.delete_experiment(experiment)
+
+        self.stdout.write(
+            "%s participants, %s requests in %.2f s (%.1f requests/s)"
+            % (
+                len(users),
+                len(measures),
+                duration,
+                len(measures) / duration if duration else 0,
+            )
+        )
+        self.stdout.write(
+            "%-10s %8s %8s %8s %8s %8s %8s %8s %14s %14s"
+            % (
+                "step",
+                "requests",
+                "req/s",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+                "queries",
+                "max",
+                "first 1/4",
+                "last 1/4",
+            )
+        )
+        for step, summary in benchmark.summarize(measures, duration).items():
+            self.stdout.write(
+                "%-10s %8d %8.1f %8.2f %8.2f %8.2f %8.2f %8d %6.2f/%5.2fms %6.2f/%5.2fms"
+                % (
+                    (step, summary["requests"], summary["rps"])
+                    + (summary["p50"], summary["p95"], summary["p99"])
+                    + (summary["queries"], summary["max_queries"])
+                    + summary["first_quarter"]
+                    + summary["last_quarter"]
+                )
+            )
+        if errors:
+            self.stderr.write(
+                "%s participants stopped by an error, the first one: %r"
+                % (len(errors), errors[0])
+            )
+        if options["keep"]:
+            self.stdout.write(self.style.SUCCESS("Experiment %s kept" % experiment.id))
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+
+from protocole1 import models
+
+PROGRESS_FIELDS = ["reactions_count", "last_result_on_idea", "pending"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the progress maintained on the results (number of ideas "
+        "proposed, last idea proposed, pending reaction) matches their ideas, "
+        "and repairs it with --repair."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "experiments",
+            nargs="*",
+            type=int,
+            help="The ids of the experiments to check (all by default)",
+        )
+        parser.add_argument(
+            "--repair", action="store_true", help="Repairs the results inconsistent"
+        )
+
+    def handle(self, *args, **options):
+        last = models.ResultOnIdea.objects.filter(result=OuterRef("pk")).order_by(
+            "-order"
+        )
+        results = models.Result.objects.annotate(
+            actual_count=Count("resultonidea"),
+            actual_last_id=Subquery(last.values("pk")[:1]),
+            actual_last_reaction=Subquery(last.values("reaction")[:1]),
+        ).order_by("pk")
+        if options["experiments"]:
+            results = results.filter(experiment__in=options["experiments"])
+
+        checked = 0
+        inconsistent = []
+        for result in results.iterator():
+            checked += 1
+            actual = (
+                result.actual_count,
+                result.actual_last_id,
+                result.actual_last_reaction == models.Reactions.UNDEFINED.value,
+            )
+            stored = (
+                result.reactions_count,
+                result.last_result_on_idea_id,
+                result.pending,
+            )
+            if actual != stored:
+                self.stdout.write("%s: stored %s, actual %s" % (result, stored, actual))
+                (
+                    result.reactions_count,
+                    result.last_result_on_idea_id,
+                    result.pending,
+                ) = actual
+                inconsistent.append(result)
+
+        if options["repair"] and inconsistent:
+            models.Result.objects.bulk_update(
+                inconsistent, PROGRESS_FIELDS, batch_size=1000
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "%s results checked, %s repaired" % (checked, len(inconsistent))
+                )
+            )
+        elif inconsistent:
+            self.stdout.write(
+                self.style.WARNING(
+                    "%s results checked, %s inconsistent (use --repair)"
+                    % (checked, len(inconsistent))
+                )
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("%s results checked" % checked))
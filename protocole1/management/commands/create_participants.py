@@ -0,0 +1,141 @@
+import csv
+import multiprocessing
+import os
+import secrets
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from protocole1 import models, views
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates participant accounts in bulk: the passwords are hashed by a pool "
+        "of processes and the users are written by batches. Writes the username, "
+        "the password and, with --experiment, the signed participation link "
+        "(which logs the participant in without password) of each new user in "
+        "CSV. The existing usernames are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, help="The number of participants")
+        parser.add_argument(
+            "--prefix",
+            default="participant",
+            help='The usernames are the prefix and a number, such as "participant-1"',
+        )
+        parser.add_argument(
+            "--start", type=int, default=1, help="The number of the first participant"
+        )
+        parser.add_argument(
+            "--no-password",
+            action="store_true",
+            help="Creates the participants without password, to use the "
+            "participation links only",
+        )
+        parser.add_argument(
+            "--experiment",
+            type=int,
+            help="Writes the participation link of each participant to this "
+            "experiment",
+        )
+        parser.add_argument(
+            "--base-url",
+            default="",
+            help='The URL prefixed to the links, such as "https://example.com"',
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of processes hashing the passwords (the number of "
+            "CPUs by default)",
+        )
+        parser.add_argument(
+            "--output", help="The CSV file written (the standard output by default)"
+        )
+
+    def handle(self, *args, **options):
+        experiment = None
+        if options["experiment"] is not None:
+            try:
+                experiment = models.Experiment.objects.get(pk=options["experiment"])
+            except models.Experiment.DoesNotExist:
+                raise CommandError(
+                    "Experiment %s does not exist" % options["experiment"]
+                )
+
+        usernames = [
+            "%s-%s" % (options["prefix"], index)
+            for index in range(options["start"], options["start"] + options["count"])
+        ]
+        # filtering by prefix avoids the limit of parameters of SQLite
+        existing = set(
+            User.objects.filter(
+                username__startswith="%s-" % options["prefix"]
+            ).values_list("username", flat=True)
+        ).intersection(usernames)
+        usernames = [username for username in usernames if username not in existing]
+
+        if options["no_password"]:
+            passwords = [None] * len(usernames)
+            hashes = [make_password(None)] * len(usernames)
+        else:
+            passwords = [secrets.token_urlsafe(9) for _ in usernames]
+            if options["processes"] > 1 and len(passwords) > 1:
+                # the processes are only forked on some platforms, the others
+                # start a new interpreter (with the DJANGO_SETTINGS_MODULE of
+                # the command) where Django must be set up
+                with multiprocessing.Pool(
+                    options["processes"], initializer=django.setup
+                ) as pool:
+                    hashes = pool.map(make_password, passwords, chunksize=16)
+            else:
+                hashes = [make_password(password) for password in passwords]
+
+        User.objects.bulk_create(
+            User(username=username, password=password_hash)
+            for username, password_hash in zip(usernames, hashes)
+        )
+
+        rows = zip(usernames, passwords)
+        header = ["username", "password"]
+        if experiment is not None:
+            users = User.objects.filter(
+                username__startswith="%s-" % options["prefix"]
+            ).in_bulk(field_name="username")
+            header.append("link")
+            rows = (
+                (
+                    username,
+                    password,
+                    options["base_url"]
+                    + reverse(
+                        "protocole1.participate_with_token",
+                        args=[views.participation_token(users[username], experiment)],
+                    ),
+                )
+                for username, password in rows
+            )
+        stream = (
+            open(options["output"], "w", encoding="utf-8", newline="")
+            if options["output"]
+            else self.stdout
+        )
+        try:
+            writer = csv.writer(stream)
+            writer.writerow(header)
+            writer.writerows(rows)
+        finally:
+            if options["output"]:
+                stream.close()
+
+        if existing:
+            self.stderr.write("%s existing participants skipped" % len(existing))
+        self.stderr.write(
+            self.style.SUCCESS("%s participants created" % len(usernames))
+        )
@@ -0,0 +1,80 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from protocole1 import export, models
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the reactions of an experiment (with their result, idea and user) "
+        "as CSV, JSON lines or a column-chunked binary format, in constant memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("experiment", type=int, help="The id of the experiment")
+        parser.add_argument(
+            "--format", choices=export.FORMATS, default="csv", help="Defaults to csv"
+        )
+        parser.add_argument(
+            "--output",
+            help="The file to write (the standard output by default), compressed "
+            "with gzip if its name ends with .gz",
+        )
+        parser.add_argument(
+            "--gzip", action="store_true", help="Compresses the export with gzip"
+        )
+        parser.add_argument(
+            "--since",
+            help="Exports only the reactions written after this time (ISO 8601), "
+            "the time to give to the next export is written on the error output",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="The number of reactions read and written at once",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            experiment = models.Experiment.objects.get(pk=options["experiment"])
+        except models.Experiment.DoesNotExist:
+            raise CommandError("Experiment %s does not exist" % options["experiment"])
+        if options["chunk_size"] <= 0:
+            raise CommandError("The chunk size must be positive")
+
+        since = None
+        if options["since"] is not None:
+            try:
+                since = export.parse_since(options["since"])
+            except ValueError as error:
+                raise CommandError(error)
+        until = export.export_until()
+        count = 0
+
+        def rows():
+            nonlocal count
+            for row in export.export_rows(
+                experiment, since, until, options["chunk_size"]
+            ):
+                count += 1
+                yield row
+
+        output = options["output"]
+        compress = options["gzip"] or (output or "").endswith(".gz")
+        chunks = export.export_chunks(
+            rows(), options["format"], options["chunk_size"], compress
+        )
+        stream = open(output, "wb") if output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+            stream.flush()
+        finally:
+            if output:
+                stream.close()
+
+        self.stderr.write(
+            "%s reactions exported, next export since: %s" % (count, until.isoformat())
+        )
@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from protocole1 import models, pools
+
+FILE_FORMATS = ("json", "csv", "yaml")
+
+
+def read_groups(path, file_format):
+    """
+    Reads the groups of ideas of a file.
+
+    The JSON and YAML files contain a list of groups (or an object whose "groups"
+    entry is this list), each group having a name, a description (optional) and
+    a list of ideas. The CSV files have a group, a description (optional) and an
+    idea column, one row per idea.
+
+    :param path: the path of the file
+    :type path: str
+    :param file_format: the format of the file, one of ``FILE_FORMATS``
+    :type file_format: str
+    :return: the groups, with their name, description and ideas
+    :rtype: list of dict
+    """
+    with open(path, encoding="utf-8", newline="") as stream:
+        if file_format == "csv":
+            groups = {}
+            for row in csv.DictReader(stream):
+                group = groups.setdefault(
+                    row["group"], {"name": row["group"], "ideas": []}
+                )
+                if row.get("description"):
+                    group["description"] = row["description"]
+                group["ideas"].append(row["idea"])
+            return list(groups.values())
+        if file_format == "yaml":
+            try:
+                import yaml
+            except ImportError:
+                raise CommandError("PyYAML is required to import YAML files")
+            data = yaml.safe_load(stream)
+        else:
+            data = json.load(stream)
+    if isinstance(data, dict):
+        data = data["groups"]
+    return data
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports groups of ideas from a JSON, CSV or YAML file. The groups are "
+        "identified by their name and the ideas by their value in their group, "
+        "so importing a file again only adds what is missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The file to import")
+        parser.add_argument(
+            "--format",
+            choices=FILE_FORMATS,
+            help="The format of the file (guessed from its extension by default)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="The number of objects created per query (the maximum allowed by "
+            "the database by default)",
+        )
+
+    def handle(self, *args, **options):
+        file_format = options["format"]
+        if file_format is None:
+            extension = os.path.splitext(options["path"])[1].lower().lstrip(".")
+            file_format = "yaml" if extension == "yml" else extension
+            if file_format not in FILE_FORMATS:
+                raise CommandError("Unknown format, use --format")
+        groups = read_groups(options["path"], file_format)
+
+        created = self.import_groups(groups, options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%s groups created, %s groups updated, %s ideas created" % created
+            )
+        )
+
+    @transaction.atomic
+    def import_groups(self, groups, batch_size):
+        """
+        Creates the groups and the ideas missing, in bulk.
+
+        :param groups: the groups, with their name, description and ideas
+        :type groups: list of dict
+        :param batch_size: the number of objects created per query (None for the
+                            maximum allowed by the database)
+        :type batch_size: int
+        :return: the number of groups created, of groups updated and of ideas
+                created
+        :rtype: tuple of int
+        """
+        # Merges the groups with the same name
+        descriptions = {}
+        values = {}
+        for group in groups:
+            name = group["name"]
+            if group.get("description") is not None or name not in descriptions:
+                descriptions[name] = group.get("description") or ""
+            group_values = values.setdefault(name, {})
+            for value in group["ideas"]:
+                group_values[value] = None
+
+        # Upserts the groups
+        existing_groups = {}
+        for group in models.IdeasGroup.objects.filter(name__in=values).order_by("pk"):
+            existing_groups.setdefault(group.name, group)
+        updated_groups = []
+        for name, group in existing_groups.items():
+            if group.description != descriptions[name]:
+                group.description = descriptions[name]
+                updated_groups.append(group)
+        models.IdeasGroup.objects.bulk_update(
+            updated_groups, ["description"], batch_size=batch_size
+        )
+        new_groups = [
+            models.IdeasGroup(name=name, description=descriptions[name])
+            for name in values
+            if name not in existing_groups
+        ]
+        models.IdeasGroup.objects.bulk_create(new_groups, batch_size=batch_size)
+        if new_groups:
+            for group in models.IdeasGroup.objects.filter(
+                name__in=[group.name for group in new_groups]
+            ).order_by("pk"):
+                existing_groups.setdefault(group.name, group)
+        groups_ids = {name: group.pk for name, group in existing_groups.items()}
+
+        # Finds the ideas already in the groups
+        through = models.IdeasGroup.ideas.through
+        existing_ideas = set(
+            through.objects.filter(ideasgroup_id__in=groups_ids.values()).values_list(
+                "ideasgroup_id", "idea__value"
+            )
+        )
+        missing = [
+            (groups_ids[name], value)
+            for name, group_values in values.items()
+            for value in group_values
+            if (groups_ids[name], value) not in existing_ideas
+        ]
+
+        # Creates the ideas missing
+        last_pk = (
+            models.Idea.objects.order_by("-pk").values_list("pk", flat=True).first()
+        )
+        ideas = [models.Idea(value=value) for _, value in missing]
+        models.Idea.objects.bulk_create(ideas, batch_size=batch_size)
+        if ideas and not connection.features.can_return_rows_from_bulk_insert:
+            # the ids are given in the order of the creation
+            created_pks = models.Idea.objects.filter(pk__gt=last_pk or 0).order_by("pk")
+            for idea, pk in zip(ideas, created_pks.values_list("pk", flat=True)):
+                idea.pk = pk
+
+        # Adds them to their group
+        through.objects.bulk_create(
+            (
+                through(ideasgroup_id=group_id, idea_id=idea.pk)
+                for (group_id, _), idea in zip(missing, ideas)
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+        # The signals are not sent by the bulk operations
+        transaction.on_commit(pools.invalidate_pool)
+        return len(new_groups), len(updated_groups), len(ideas)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from protocole1 import models, summaries
+
+
+class Command(BaseCommand):
+    help = "Computes again the summaries of the experiments from the reactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "experiments",
+            nargs="*",
+            type=int,
+            help="The ids of the experiments to rebuild (all by default)",
+        )
+
+    def handle(self, *args, **options):
+        experiments = models.Experiment.objects.order_by("pk")
+        if options["experiments"]:
+            experiments = experiments.filter(pk__in=options["experiments"])
+
+        for experiment in experiments:
+            summaries.rebuild_summaries(experiment)
+            self.stdout.write("Rebuilt the summaries of %s" % experiment)
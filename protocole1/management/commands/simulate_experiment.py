@@ -0,0 +1,149 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from protocole1 import models, pools, simulation
+
+
+def probabilities(value):
+    """
+    Parses the probabilities of the reactions (CONTINUE, EXPAND and NEUTRAL)
+    after a fixation and after an expansion, such as "0.2,0.6,0.2;0.6,0.2,0.2".
+    """
+    return [
+        [float(probability) for probability in row.split(",")]
+        for row in value.split(";")
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates the participation of virtual users to an experiment (with "
+        "NumPy) to tune the starting expansion rate, the limit of ideas and the "
+        "groups: gives the distributions of the final expansion rates, of the "
+        "number of ideas seen before the end and of the ideas seen."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--participants", type=int, default=100000)
+        parser.add_argument(
+            "--experiment",
+            type=int,
+            help="Simulates an existing experiment (its pool of ideas, its starting "
+            "expansion rate and its limit of ideas unless given)",
+        )
+        parser.add_argument("--fixation-ideas", type=int, default=50)
+        parser.add_argument("--expansion-ideas", type=int, default=50)
+        parser.add_argument("--starting-expansion-rate", type=float)
+        parser.add_argument("--limit", type=int)
+        parser.add_argument(
+            "--policy",
+            choices=sorted(simulation.POLICIES),
+            default="uniform",
+            help="The reactions of the users, defaults to uniform",
+        )
+        parser.add_argument(
+            "--probabilities",
+            type=probabilities,
+            help="The probabilities of CONTINUE, EXPAND and NEUTRAL after a "
+            "fixation, then after an expansion (instead of --policy), "
+            'such as "0.2,0.6,0.2;0.6,0.2,0.2"',
+        )
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--chunk-size", type=int, default=100000)
+        parser.add_argument(
+            "--json", action="store_true", help="Writes all the distributions in JSON"
+        )
+
+    def handle(self, *args, **options):
+        starting_expansion_rate = 0.2
+        limit = -1
+        fixation_ideas = options["fixation_ideas"]
+        expansion_ideas = options["expansion_ideas"]
+        ideas_ids = None
+        if options["experiment"] is not None:
+            try:
+                experiment = models.Experiment.objects.get(pk=options["experiment"])
+            except models.Experiment.DoesNotExist:
+                raise CommandError(
+                    "Experiment %s does not exist" % options["experiment"]
+                )
+            starting_expansion_rate = experiment.starting_expansion_rate
+            limit = experiment.limit_ideas_number
+            # the ideas shared by groups of both types are counted in each
+            ideas_ids = pools.get_pool(experiment.id).ideas
+            fixation_ideas = len(ideas_ids[models.GroupType.FIXATION])
+            expansion_ideas = len(ideas_ids[models.GroupType.EXPANSION])
+        if options["starting_expansion_rate"] is not None:
+            starting_expansion_rate = options["starting_expansion_rate"]
+        if options["limit"] is not None:
+            limit = options["limit"]
+
+        try:
+            if options["probabilities"]:
+                policy = simulation.ReactionPolicy(*options["probabilities"])
+            else:
+                policy = simulation.get_policy(options["policy"])
+            start = time.perf_counter()
+            result = simulation.simulate(
+                options["participants"],
+                fixation_ideas,
+                expansion_ideas,
+                starting_expansion_rate,
+                limit,
+                policy,
+                options["seed"],
+                options["chunk_size"],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        duration = time.perf_counter() - start
+
+        if options["json"]:
+            self.stdout.write(json.dumps(result.to_dict(ideas_ids)))
+            return
+        self.stdout.write(
+            "%s participants simulated in %.2f s (%s fixation and %s expansion "
+            "ideas, starting expansion rate %s, limit %s)"
+            % (
+                result.participants,
+                duration,
+                fixation_ideas,
+                expansion_ideas,
+                starting_expansion_rate,
+                limit,
+            )
+        )
+        self.stdout.write(
+            "Ideas seen: mean %.2f, p50 %s, p95 %s, p99 %s, %.1f %% finished by "
+            "exhaustion of a group type"
+            % (
+                result.mean_length,
+                result.length_percentile(50),
+                result.length_percentile(95),
+                result.length_percentile(99),
+                100 * result.exhausted / result.participants,
+            )
+        )
+        self.stdout.write("Final expansion rates (mean %.3f):" % result.mean_rate)
+        for index, count in enumerate(result.rate_bins):
+            if count:
+                share = count / result.participants
+                self.stdout.write(
+                    "  %.2f %7.2f %% %s"
+                    % (
+                        index * models.EXPANSION_RATE_STEP,
+                        100 * share,
+                        "#" * int(round(50 * share)),
+                    )
+                )
+        for group_type, seen in result.ideas_seen.items():
+            self.stdout.write(
+                "%s ideas seen by %.1f %% to %.1f %% of the participants"
+                % (
+                    group_type.name.capitalize(),
+                    100 * seen.min() / result.participants,
+                    100 * seen.max() / result.participants,
+                )
+            )
@@ -0,0 +1,281 @@
+"""
+Metrics of the hot paths, exposed in the text format of Prometheus.
+
+``MetricsMiddleware`` measures each request (wall time, number and time of the
+SQL queries) by view, and ``stage`` measures the stages of the participation
+(loading the state and the pool, selecting and creating the next idea...). The
+sizes of the pools and the lengths of the histories are observed with
+``observe``. Everything is aggregated in histograms in the process.
+
+With several workers, set ``PROTOCOLE1_METRICS_DIR`` to a directory shared by the
+processes: each process writes its histograms there (every
+``PROTOCOLE1_METRICS_DUMP_INTERVAL`` seconds at most) and the metrics view sums
+the histograms of all the processes.
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+# The buckets of the histograms by unit
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000)
+
+# The help and the buckets of each metric
+METRICS = {
+    "protocole1_request_seconds": ("Duration of the requests", SECONDS_BUCKETS),
+    "protocole1_request_queries": ("SQL queries of the requests", COUNT_BUCKETS),
+    "protocole1_request_sql_seconds": (
+        "Time spent in SQL by the requests",
+        SECONDS_BUCKETS,
+    ),
+    "protocole1_stage_seconds": ("Duration of the stages", SECONDS_BUCKETS),
+    "protocole1_stage_queries": ("SQL queries of the stages", COUNT_BUCKETS),
+    "protocole1_stage_sql_seconds": (
+        "Time spent in SQL by the stages",
+        SECONDS_BUCKETS,
+    ),
+    "protocole1_pool_ideas": ("Ideas of the pools loaded", SIZE_BUCKETS),
+    "protocole1_history_length": (
+        "Ideas already proposed to the participants",
+        SIZE_BUCKETS,
+    ),
+}
+
+# The histograms of the process: the counts of the buckets (and of the values
+# above the last one), the sum and the count by metric and labels
+_histograms = {}
+_lock = threading.Lock()
+_process = "%s-%s" % (os.getpid(), time.time_ns())
+_dumped = 0
+
+
+def observe(metric, value, **labels):
+    """
+    Observes a value of a metric.
+
+    :param metric: the name of the metric, a key of ``METRICS``
+    :type metric: str
+    :param value: the value observed
+    :type value: float
+    :param labels: the labels of the value
+    :type labels: dict of str to str
+    """
+    buckets = METRICS[metric][1]
+    key = (metric, tuple(sorted((name, str(value)) for name, value in labels.items())))
+    index = len(buckets)
+    for position, bound in enumerate(buckets):
+        if value <= bound:
+            index = position
+            break
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(buckets) + 1), 0, 0]
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+class QueriesMeasure:
+    """
+    Counts the SQL queries and their time (as a wrapper of ``execute_wrapper``).
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+class stage:
+    """
+    Measures a stage of a view, as a context manager or a decorator.
+
+    :param name: the name of the stage
+    :type name: str
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.measure = QueriesMeasure()
+        self.wrapper = connection.execute_wrapper(self.measure)
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        self.wrapper.__exit__(*exc_info)
+        observe("protocole1_stage_seconds", duration, stage=self.name)
+        observe("protocole1_stage_queries", self.measure.queries, stage=self.name)
+        observe("protocole1_stage_sql_seconds", self.measure.seconds, stage=self.name)
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(self.name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Measures the requests by view. The streamed responses are measured until
+    their content is consumed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        measure = QueriesMeasure()
+        start = time.perf_counter()
+        with connection.execute_wrapper(measure):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response.streaming_content, measure, start
+            )
+        else:
+            self.record(request, measure, start)
+        return response
+
+    def stream(self, request, content, measure, start):
+        with connection.execute_wrapper(measure):
+            yield from content
+        self.record(request, measure, start)
+
+    def record(self, request, measure, start):
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else "none"
+        observe("protocole1_request_seconds", time.perf_counter() - start, view=view)
+        observe("protocole1_request_queries", measure.queries, view=view)
+        observe("protocole1_request_sql_seconds", measure.seconds, view=view)
+        dump(force=False)
+
+
+def _directory():
+    return getattr(settings, "PROTOCOLE1_METRICS_DIR", None)
+
+
+def dump(force=True):
+    """
+    Writes the histograms of the process to the directory shared by the
+    processes, if any.
+
+    :param force: writes them even if written less than
+        PROTOCOLE1_METRICS_DUMP_INTERVAL seconds ago, defaults to True
+    :type force: bool, optional
+    """
+    global _dumped
+    directory = _directory()
+    if directory is None:
+        return
+    now = time.monotonic()
+    if not force and now - _dumped < getattr(
+        settings, "PROTOCOLE1_METRICS_DUMP_INTERVAL", 5
+    ):
+        return
+    _dumped = now
+    with _lock:
+        data = [
+            [metric, labels, histogram]
+            for (metric, labels), histogram in _histograms.items()
+        ]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "%s.json" % _process)
+    with open(path + ".tmp", "w") as stream:
+        json.dump(data, stream)
+    os.replace(path + ".tmp", path)
+
+
+def collect():
+    """
+    Gives the histograms of the process, summed with the ones of the other
+    processes written in the shared directory.
+
+    :return: the counts of the buckets, the sum and the count by metric and
+        labels
+    :rtype: dict
+    """
+    directory = _directory()
+    if directory is None:
+        with _lock:
+            return {
+                key: [list(counts), total, count]
+                for key, (counts, total, count) in _histograms.items()
+            }
+    dump()
+    histograms = {}
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as stream:
+                data = json.load(stream)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, (counts, total, count) in data:
+            key = (metric, tuple(tuple(label) for label in labels))
+            if metric not in METRICS or len(counts) != len(METRICS[metric][1]) + 1:
+                continue
+            if key not in histograms:
+                histograms[key] = [[0] * len(counts), 0, 0]
+            histogram = histograms[key]
+            histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+            histogram[1] += total
+            histogram[2] += count
+    return histograms
+
+
+def _labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"'
+        % (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+
+
+def render():
+    """
+    Renders the histograms in the text format of Prometheus.
+
+    :rtype: str
+    """
+    histograms = collect()
+    lines = []
+    for metric, (description, buckets) in METRICS.items():
+        lines.append("# HELP %s %s" % (metric, description))
+        lines.append("# TYPE %s histogram" % metric)
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulated = 0
+            for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                cumulated += bucket_count
+                lines.append(
+                    "%s_bucket%s %s"
+                    % (metric, _labels(labels, le=str(bound)), cumulated)
+                )
+            lines.append("%s_sum%s %r" % (metric, _labels(labels), float(total)))
+            lines.append("%s_count%s %s" % (metric, _labels(labels), count))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,58 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:21
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_progress(apps, schema_editor):
+    Result = apps.get_model("protocole1", "Result")
+    ResultOnIdea = apps.get_model("protocole1", "ResultOnIdea")
+
+    last = ResultOnIdea.objects.filter(result=OuterRef("pk")).order_by("-order")
+    results = Result.objects.annotate(
+        count=Count("resultonidea"),
+        last_id=Subquery(last.values("pk")[:1]),
+        last_reaction=Subquery(last.values("reaction")[:1]),
+    ).order_by()
+    batch = []
+    for result in results.iterator():
+        result.reactions_count = result.count
+        result.last_result_on_idea_id = result.last_id
+        # the reaction of an idea proposed is UNDEFINED (0) until the user reacts
+        result.pending = result.last_reaction == 0
+        batch.append(result)
+        if len(batch) >= 1000:
+            Result.objects.bulk_update(
+                batch, ["reactions_count", "last_result_on_idea", "pending"]
+            )
+            batch = []
+    Result.objects.bulk_update(
+        batch, ["reactions_count", "last_result_on_idea", "pending"]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocole1', '0007_auto_20200408_2010'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='last_result_on_idea',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='protocole1.ResultOnIdea'),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='reactions_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_progress, migrations.RunPython.noop),
+    ]
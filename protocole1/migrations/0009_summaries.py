@@ -0,0 +1,176 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:23
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+# The models of the migrations do not have the methods of the current ones: the
+# names of the reactions and the width of the bins are copied here.
+REACTIONS = {1: "continue", 2: "expand", 3: "neutral"}
+EXPANSION_RATE_STEP = 0.05
+
+
+def count_field(did_expand, reaction):
+    return "%s_%s" % (REACTIONS[reaction], "expansion" if did_expand else "fixation")
+
+
+def rebuild_summaries(apps, experiments_ids):
+    """
+    Computes again the summaries of some experiments from the reactions, with the
+    models of the migration calling it (see also summaries.rebuild_summaries).
+    """
+    Result = apps.get_model("protocole1", "Result")
+    ResultOnIdea = apps.get_model("protocole1", "ResultOnIdea")
+    ExperimentSummary = apps.get_model("protocole1", "ExperimentSummary")
+    IdeaSummary = apps.get_model("protocole1", "IdeaSummary")
+    StepSummary = apps.get_model("protocole1", "StepSummary")
+    ExpansionRateBin = apps.get_model("protocole1", "ExpansionRateBin")
+
+    for experiment_id in experiments_ids:
+        ExperimentSummary.objects.filter(experiment_id=experiment_id).delete()
+        IdeaSummary.objects.filter(experiment_id=experiment_id).delete()
+        StepSummary.objects.filter(experiment_id=experiment_id).delete()
+        ExpansionRateBin.objects.filter(experiment_id=experiment_id).delete()
+
+        # the ideas waiting for a reaction are not counted
+        reactions_ideas = ResultOnIdea.objects.filter(
+            result__experiment_id=experiment_id, reaction__gt=0
+        ).order_by()
+
+        ExperimentSummary.objects.create(
+            experiment_id=experiment_id,
+            results_count=Result.objects.filter(experiment_id=experiment_id).count(),
+        )
+
+        ideas_summaries = {}
+        for idea_id, did_expand, reaction, count in reactions_ideas.values_list(
+            "idea_id", "did_expand", "reaction"
+        ).annotate(count=Count("pk")):
+            if idea_id is None:
+                continue
+            if idea_id not in ideas_summaries:
+                ideas_summaries[idea_id] = IdeaSummary(
+                    experiment_id=experiment_id, idea_id=idea_id
+                )
+            setattr(ideas_summaries[idea_id], count_field(did_expand, reaction), count)
+        IdeaSummary.objects.bulk_create(ideas_summaries.values())
+
+        steps_summaries = {}
+        for (
+            order,
+            did_expand,
+            reaction,
+            count,
+            expansion_rate_sum,
+        ) in reactions_ideas.values_list("order", "did_expand", "reaction").annotate(
+            count=Count("pk"), expansion_rate_sum=Sum("expansion_rate")
+        ):
+            if order not in steps_summaries:
+                steps_summaries[order] = StepSummary(
+                    experiment_id=experiment_id, order=order
+                )
+            setattr(steps_summaries[order], count_field(did_expand, reaction), count)
+            steps_summaries[order].expansion_rate_sum += expansion_rate_sum
+        StepSummary.objects.bulk_create(steps_summaries.values())
+
+        bins = Counter(
+            round(min(max(expansion_rate, 0), 1) / EXPANSION_RATE_STEP)
+            for expansion_rate in Result.objects.filter(
+                experiment_id=experiment_id
+            ).values_list("expansion_rate", flat=True)
+        )
+        ExpansionRateBin.objects.bulk_create(
+            ExpansionRateBin(experiment_id=experiment_id, bin=bin, results_count=count)
+            for bin, count in bins.items()
+        )
+
+
+def compute_summaries(apps, schema_editor):
+    """
+    Computes the summaries of the existing experiments.
+    """
+    Experiment = apps.get_model("protocole1", "Experiment")
+    rebuild_summaries(
+        apps, Experiment.objects.order_by("pk").values_list("pk", flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocole1', '0008_result_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results_count', models.PositiveIntegerField(default=0)),
+                ('experiment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='protocole1.Experiment')),
+            ],
+            options={
+                'verbose_name': 'ExperimentSummary',
+                'verbose_name_plural': 'ExperimentSummaries',
+            },
+        ),
+        migrations.CreateModel(
+            name='StepSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('continue_fixation', models.PositiveIntegerField(default=0)),
+                ('continue_expansion', models.PositiveIntegerField(default=0)),
+                ('expand_fixation', models.PositiveIntegerField(default=0)),
+                ('expand_expansion', models.PositiveIntegerField(default=0)),
+                ('neutral_fixation', models.PositiveIntegerField(default=0)),
+                ('neutral_expansion', models.PositiveIntegerField(default=0)),
+                ('order', models.PositiveIntegerField()),
+                ('expansion_rate_sum', models.FloatField(default=0)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='steps_summaries', to='protocole1.Experiment')),
+            ],
+            options={
+                'verbose_name': 'StepSummary',
+                'verbose_name_plural': 'StepSummaries',
+                'ordering': ['experiment', 'order'],
+                'unique_together': {('experiment', 'order')},
+            },
+        ),
+        migrations.CreateModel(
+            name='IdeaSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('continue_fixation', models.PositiveIntegerField(default=0)),
+                ('continue_expansion', models.PositiveIntegerField(default=0)),
+                ('expand_fixation', models.PositiveIntegerField(default=0)),
+                ('expand_expansion', models.PositiveIntegerField(default=0)),
+                ('neutral_fixation', models.PositiveIntegerField(default=0)),
+                ('neutral_expansion', models.PositiveIntegerField(default=0)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ideas_summaries', to='protocole1.Experiment')),
+                ('idea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='protocole1.Idea')),
+            ],
+            options={
+                'verbose_name': 'IdeaSummary',
+                'verbose_name_plural': 'IdeaSummaries',
+                'ordering': ['experiment', 'idea'],
+                'unique_together': {('experiment', 'idea')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ExpansionRateBin',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bin', models.IntegerField()),
+                ('results_count', models.PositiveIntegerField(default=0)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expansion_rate_bins', to='protocole1.Experiment')),
+            ],
+            options={
+                'verbose_name': 'ExpansionRateBin',
+                'verbose_name_plural': 'ExpansionRateBins',
+                'ordering': ['experiment', 'bin'],
+                'unique_together': {('experiment', 'bin')},
+            },
+        ),
+        migrations.RunPython(compute_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:36
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocole1', '0009_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='selection_strategy',
+            field=models.CharField(choices=[('uniform', 'Uniform over the ideas'), ('stratified', 'Stratified by group'), ('weighted', 'Weighted by group'), ('bandit', 'Bandit over the groups')], default='uniform', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='experimentgroups',
+            name='weight',
+            field=models.FloatField(default=1, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:37
+
+import importlib
+
+from django.db import migrations
+from django.db.models import Count
+
+summaries = importlib.import_module("protocole1.migrations.0009_summaries")
+
+
+def remove_duplicate_results(apps, schema_editor):
+    """
+    Keeps one result per experiment and user before the unique constraint is
+    added: the most advanced one (finished, then with the most ideas proposed),
+    then the oldest one. The summaries of the experiments concerned are then
+    rebuilt.
+    """
+    Result = apps.get_model("protocole1", "Result")
+
+    duplicates = (
+        Result.objects.values("experiment_id", "user_id")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    experiments_ids = set()
+    for duplicate in list(duplicates):
+        results = (
+            Result.objects.filter(
+                experiment_id=duplicate["experiment_id"],
+                user_id=duplicate["user_id"],
+            )
+            .annotate(progress=Count("resultonidea"))
+            .order_by("-finished", "-progress", "pk")
+            .values_list("pk", flat=True)
+        )
+        Result.objects.filter(pk__in=list(results)[1:]).delete()
+        experiments_ids.add(duplicate["experiment_id"])
+    summaries.rebuild_summaries(apps, sorted(experiments_ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocole1', '0010_selection_strategies'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_results, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:38
+
+import importlib
+
+from django.db import migrations, models
+from django.db.models import Count
+
+summaries = importlib.import_module("protocole1.migrations.0009_summaries")
+
+
+def remove_duplicate_steps(apps, schema_editor):
+    """
+    Keeps one idea per step of the participations before the unique constraint is
+    added: the last idea proposed to the user (which gets the reaction), else the
+    oldest one. The steps of the results concerned are then numbered again, and
+    the summaries of their experiments rebuilt.
+    """
+    Result = apps.get_model("protocole1", "Result")
+    ResultOnIdea = apps.get_model("protocole1", "ResultOnIdea")
+    Experiment = apps.get_model("protocole1", "Experiment")
+
+    duplicates = (
+        ResultOnIdea.objects.values("result_id", "order")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    results = set()
+    for duplicate in list(duplicates):
+        steps = ResultOnIdea.objects.filter(
+            result_id=duplicate["result_id"], order=duplicate["order"]
+        )
+        last_id = (
+            Result.objects.filter(pk=duplicate["result_id"])
+            .values_list("last_result_on_idea_id", flat=True)
+            .get()
+        )
+        kept = min(
+            steps.values_list("pk", flat=True), key=lambda pk: (pk != last_id, pk)
+        )
+        steps.exclude(pk=kept).delete()
+        results.add(duplicate["result_id"])
+
+    for result in Result.objects.filter(pk__in=results).order_by("pk"):
+        steps = list(
+            ResultOnIdea.objects.filter(result=result).order_by("order", "pk")
+        )
+        for order, step in enumerate(steps):
+            step.order = order
+        ResultOnIdea.objects.bulk_update(steps, ["order"])
+        result.reactions_count = len(steps)
+        result.last_result_on_idea = steps[-1]
+        result.pending = steps[-1].reaction == 0
+        result.save(
+            update_fields=["reactions_count", "last_result_on_idea", "pending"]
+        )
+    summaries.rebuild_summaries(
+        apps,
+        Experiment.objects.filter(result__in=results)
+        .distinct()
+        .values_list("pk", flat=True),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocole1', '0011_remove_duplicate_results'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='experimentgroups',
+            index=models.Index(fields=['experiment', 'group_type_here'], name='protocole1_expgroups_type_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='result',
+            constraint=models.UniqueConstraint(fields=('experiment', 'user'), name='protocole1_unique_result'),
+        ),
+        migrations.RunPython(remove_duplicate_steps, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='resultonidea',
+            constraint=models.UniqueConstraint(fields=('result', 'order'), name='protocole1_unique_step'),
+        ),
+    ]
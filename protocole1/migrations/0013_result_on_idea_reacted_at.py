@@ -0,0 +1,29 @@
+# Generated by Django 3.0.14 on 2026-10-18 11:22
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def date_reactions(apps, schema_editor):
+    """
+    Dates the reactions already given with the time of the migration, so that
+    the next incremental export gives them all.
+    """
+    ResultOnIdea = apps.get_model("protocole1", "ResultOnIdea")
+    ResultOnIdea.objects.filter(reaction__gt=0).update(reacted_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('protocole1', '0012_participation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultonidea',
+            name='reacted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(date_reactions, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from enum import Enum
 
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -82,6 +83,15 @@ def validate_expansion_rate(value):
         )
 
 
+# The strategies selecting the ideas proposed (see protocole1.strategies)
+SELECTION_STRATEGIES = [
+    ("uniform", "Uniform over the ideas"),
+    ("stratified", "Stratified by group"),
+    ("weighted", "Weighted by group"),
+    ("bandit", "Bandit over the groups"),
+]
+
+
 class Experiment(models.Model):
     """
     A group of ideas (gathered to be easier to manipulate)
@@ -101,6 +111,9 @@ class Experiment(models.Model):
     :type limit_ideas_number: int field, default -1
     :param starting_expansion_rate: the starting expansion rate of the experiment
     :type starting_expansion_rate: float field between 0 and 1 (included)
+    :param selection_strategy: the strategy selecting the ideas proposed in the
+                                group type chosen (see ``SELECTION_STRATEGIES``)
+    :type selection_strategy: str
     """
 
     name = models.CharField(max_length=150, default="experiment")
@@ -112,6 +125,9 @@ class Experiment(models.Model):
     starting_expansion_rate = models.FloatField(
         default=0.2, validators=[validate_expansion_rate]
     )
+    selection_strategy = models.CharField(
+        max_length=20, choices=SELECTION_STRATEGIES, default="uniform"
+    )
 
     def __str__(self):
         return "Experiment #%s : %s" % (self.id, self.name)
@@ -131,6 +147,8 @@ class ExperimentGroups(models.Model):
     :type group: IdeasGroup ForeignKey
     :param group_type_here: the type of the group in this experiment
     :type group_type_here: GroupType
+    :param weight: the weight of the group for the weighted selection strategy
+    :type weight: positive float, default 1
     """
 
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE)
@@ -138,6 +156,7 @@ class ExperimentGroups(models.Model):
     group_type_here = models.PositiveIntegerField(
         choices=[(group_type.value, group_type) for group_type in GroupType]
     )
+    weight = models.FloatField(default=1, validators=[MinValueValidator(0)])
 
     def __str__(self):
         return "ExperimentGroups for group %s in experiment %s" % (
@@ -149,9 +168,52 @@ class ExperimentGroups(models.Model):
         verbose_name = "ExperimentGroup"
         verbose_name_plural = "ExperimentGroups"
         ordering = ["experiment"]
+        indexes = [
+            models.Index(
+                fields=["experiment", "group_type_here"],
+                name="protocole1_expgroups_type_idx",
+            )
+        ]
         unique_together = ("experiment", "group")
 
 
+# The change of the expansion rate after a reaction
+EXPANSION_RATE_STEP = 0.05
+
+# The direction of the change of the expansion rate depending on whether expansion
+# did occurr and on the reaction of the user (unchanged otherwise)
+EXPANSION_RATE_RULES = {
+    (True, Reactions.CONTINUE): 1,
+    (True, Reactions.EXPAND): -1,
+    (False, Reactions.EXPAND): 1,
+    (False, Reactions.CONTINUE): -1,
+}
+
+
+def next_expansion_rate(expansion_rate, did_expand, reaction):
+    """
+    Applies the algorithm to an expansion rate based on user's reaction and on
+    whether expansion did or did not occurr: the expansion rate increases when 
+    the user wants to continue after an expansion or to expand after a fixation,
+    and decreases in the opposite cases.
+    
+    :param expansion_rate: the expansion rate before the reaction
+    :type expansion_rate: float
+    :param did_expand: did or did not expand
+    :type did_expand: boolean
+    :param reaction: the reaction of the user
+    :type reaction: Reactions
+    :return: the expansion rate after the reaction
+    :rtype: float
+    """
+    direction = EXPANSION_RATE_RULES.get((bool(did_expand), reaction), 0)
+    if direction > 0 and expansion_rate < 1:
+        expansion_rate += EXPANSION_RATE_STEP
+    elif direction < 0 and expansion_rate > 0:
+        expansion_rate -= EXPANSION_RATE_STEP
+    return expansion_rate
+
+
 class Result(models.Model):
     """
     The result of a user on an experiment
@@ -166,6 +228,15 @@ class Result(models.Model):
     :type reactions_ideas: Idea ManyToMany
     :param finished: whether the user has finished or not
     :type finished: boolean
+    :param reactions_count: the number of ideas proposed to the user (maintained 
+                            along the ResultOnIdea objects)
+    :type reactions_count: positive integer
+    :param last_result_on_idea: the last idea proposed to the user (maintained 
+                                along the ResultOnIdea objects)
+    :type last_result_on_idea: ResultOnIdea ForeignKey
+    :param pending: whether the last idea proposed is waiting for a reaction 
+                    (maintained along the ResultOnIdea objects)
+    :type pending: boolean
     """
 
     user = models.ForeignKey(
@@ -177,6 +248,15 @@ class Result(models.Model):
     )
     reactions_ideas = models.ManyToManyField(Idea, through="ResultOnIdea")
     finished = models.BooleanField(default=False)
+    reactions_count = models.PositiveIntegerField(default=0)
+    last_result_on_idea = models.ForeignKey(
+        "ResultOnIdea",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    pending = models.BooleanField(default=False)
 
     def update_expansion_rate(self, did_expand, reaction):
         """
@@ -190,22 +270,9 @@ class Result(models.Model):
         :return: the expansion rate
         :rtype: float between 0 and 1 (included)
         """
-        if did_expand:
-            if reaction == Reactions.CONTINUE:
-                if self.expansion_rate < 1:
-                    self.expansion_rate += 0.05
-
-            if reaction == Reactions.EXPAND:
-                if self.expansion_rate > 0:
-                    self.expansion_rate -= 0.05
-        else:
-            if reaction == Reactions.EXPAND:
-                if self.expansion_rate < 1:
-                    self.expansion_rate += 0.05
-
-            if reaction == Reactions.CONTINUE:
-                if self.expansion_rate > 0:
-                    self.expansion_rate -= 0.05
+        self.expansion_rate = next_expansion_rate(
+            self.expansion_rate, did_expand, reaction
+        )
         return min(max(self.expansion_rate, 0), 1)
 
     def __str__(self):
@@ -215,6 +282,11 @@ class Result(models.Model):
         verbose_name = "Result"
         verbose_name_plural = "Results"
         ordering = ["experiment", "user"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["experiment", "user"], name="protocole1_unique_result"
+            )
+        ]
 
 
 class ResultOnIdea(models.Model):
@@ -233,6 +305,9 @@ class ResultOnIdea(models.Model):
     :type expansion_rate: float
     :param reaction: the user's reaction
     :type reaction: Reactions
+    :param reacted_at: when the reaction was written (None while waiting for it),
+                        the cutoff of the incremental exports
+    :type reacted_at: datetime
     """
 
     idea = models.ForeignKey(Idea, on_delete=models.SET_NULL, null=True)
@@ -245,6 +320,7 @@ class ResultOnIdea(models.Model):
     reaction = models.PositiveIntegerField(
         choices=[(reaction.value, reaction) for reaction in Reactions], default=-1
     )
+    reacted_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return "Result #%s on idea %s (%s)" % (self.order, self.idea, self.result)
@@ -253,3 +329,206 @@ class ResultOnIdea(models.Model):
         verbose_name = "ResultOnIdea"
         verbose_name_plural = "ResultOnIdeas"
         ordering = ["result", "order", "idea"]
+        # one idea per step: a concurrent request cannot propose another one
+        constraints = [
+            models.UniqueConstraint(
+                fields=["result", "order"], name="protocole1_unique_step"
+            )
+        ]
+
+
+class ReactionsCounts(models.Model):
+    """
+    Counts of the reactions of the users, split by whether the algorithm did 
+    expand on the ideas reacted to.
+    
+    :param continue_fixation: the number of CONTINUE reactions without expansion
+    :type continue_fixation: positive integer
+    :param continue_expansion: the number of CONTINUE reactions with expansion
+    :type continue_expansion: positive integer
+    :param expand_fixation: the number of EXPAND reactions without expansion
+    :type expand_fixation: positive integer
+    :param expand_expansion: the number of EXPAND reactions with expansion
+    :type expand_expansion: positive integer
+    :param neutral_fixation: the number of NEUTRAL reactions without expansion
+    :type neutral_fixation: positive integer
+    :param neutral_expansion: the number of NEUTRAL reactions with expansion
+    :type neutral_expansion: positive integer
+    """
+
+    continue_fixation = models.PositiveIntegerField(default=0)
+    continue_expansion = models.PositiveIntegerField(default=0)
+    expand_fixation = models.PositiveIntegerField(default=0)
+    expand_expansion = models.PositiveIntegerField(default=0)
+    neutral_fixation = models.PositiveIntegerField(default=0)
+    neutral_expansion = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def count_field(did_expand, reaction):
+        """
+        Gives the name of the field counting a reaction.
+        
+        :param did_expand: did or did not expand
+        :type did_expand: boolean
+        :param reaction: the reaction of the user
+        :type reaction: Reactions
+        :rtype: str
+        """
+        return "%s_%s" % (
+            reaction.name.lower(),
+            "expansion" if did_expand else "fixation",
+        )
+
+    @staticmethod
+    def count_fields():
+        """
+        Gives the names of the fields counting the reactions.
+        
+        :rtype: list of str
+        """
+        return [
+            ReactionsCounts.count_field(did_expand, reaction)
+            for reaction in Reactions
+            if reaction.value > 0
+            for did_expand in (False, True)
+        ]
+
+    @property
+    def reactions_count(self):
+        return sum(getattr(self, field) for field in self.count_fields())
+
+    class Meta:
+        abstract = True
+
+
+class ExperimentSummary(models.Model):
+    """
+    The participation to an experiment, maintained along the participation of 
+    the users. Its reactions are summed from its steps when read (see 
+    ``summaries.experiment_summary``), so that the reactions do not all update 
+    this row.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment OneToOne
+    :param results_count: the number of users participating
+    :type results_count: positive integer
+    """
+
+    experiment = models.OneToOneField(
+        Experiment, on_delete=models.CASCADE, related_name="summary"
+    )
+    results_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "Summary of %s" % self.experiment
+
+    class Meta:
+        verbose_name = "ExperimentSummary"
+        verbose_name_plural = "ExperimentSummaries"
+
+
+class IdeaSummary(ReactionsCounts):
+    """
+    The reactions on an idea in an experiment, maintained along the reactions of 
+    the users.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment ForeignKey
+    :param idea: the idea considered
+    :type idea: Idea ForeignKey
+    """
+
+    experiment = models.ForeignKey(
+        Experiment, on_delete=models.CASCADE, related_name="ideas_summaries"
+    )
+    idea = models.ForeignKey(Idea, on_delete=models.CASCADE, related_name="+")
+
+    def __str__(self):
+        return "Summary of %s in %s" % (self.idea, self.experiment)
+
+    class Meta:
+        verbose_name = "IdeaSummary"
+        verbose_name_plural = "IdeaSummaries"
+        ordering = ["experiment", "idea"]
+        unique_together = ("experiment", "idea")
+
+
+class StepSummary(ReactionsCounts):
+    """
+    The reactions at a step of an experiment, maintained along the reactions of 
+    the users.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment ForeignKey
+    :param order: the step considered
+    :type order: positive integer
+    :param expansion_rate_sum: the sum of the expansion rates after the reactions
+                                at this step
+    :type expansion_rate_sum: float
+    """
+
+    experiment = models.ForeignKey(
+        Experiment, on_delete=models.CASCADE, related_name="steps_summaries"
+    )
+    order = models.PositiveIntegerField()
+    expansion_rate_sum = models.FloatField(default=0)
+
+    @property
+    def expansion_rate_mean(self):
+        if not self.reactions_count:
+            return None
+        return self.expansion_rate_sum / self.reactions_count
+
+    def __str__(self):
+        return "Summary of step #%s in %s" % (self.order, self.experiment)
+
+    class Meta:
+        verbose_name = "StepSummary"
+        verbose_name_plural = "StepSummaries"
+        ordering = ["experiment", "order"]
+        unique_together = ("experiment", "order")
+
+
+class ExpansionRateBin(models.Model):
+    """
+    A bin of the histogram of the (current or final) expansion rates of the users 
+    of an experiment, maintained along the reactions of the users.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment ForeignKey
+    :param bin: the index of the bin (the expansion rate divided by the step of 
+                the algorithm, rounded)
+    :type bin: integer
+    :param results_count: the number of users whose expansion rate is in the bin
+    :type results_count: positive integer
+    """
+
+    experiment = models.ForeignKey(
+        Experiment, on_delete=models.CASCADE, related_name="expansion_rate_bins"
+    )
+    bin = models.IntegerField()
+    results_count = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def bin_of(expansion_rate):
+        """
+        Gives the index of the bin of an expansion rate.
+        
+        :param expansion_rate: the expansion rate
+        :type expansion_rate: float
+        :rtype: int
+        """
+        return round(min(max(expansion_rate, 0), 1) / EXPANSION_RATE_STEP)
+
+    @property
+    def expansion_rate(self):
+        return self.bin * EXPANSION_RATE_STEP
+
+    def __str__(self):
+        return "Bin %s of %s" % (self.bin, self.experiment)
+
+    class Meta:
+        verbose_name = "ExpansionRateBin"
+        verbose_name_plural = "ExpansionRateBins"
+        ordering = ["experiment", "bin"]
+        unique_together = ("experiment", "bin")
@@ -0,0 +1,372 @@
+"""
+Cache of the pools of ideas of the experiments.
+
+The pool of an experiment (i.e. the ideas of its groups, gathered by group type)
+is loaded in one query and kept in a process-local cache. If the setting
+``PROTOCOLE1_POOL_CACHE`` names a cache of ``CACHES``, this cache is used as a
+shared tier: it stores the pools and their versions so that every process sees
+the invalidations. Pools are invalidated by the signals of ``protocole1.signals``.
+
+The pool also keeps the groups of the experiment and the selection strategies
+built on it (see ``protocole1.strategies``).
+"""
+import random
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from protocole1 import metrics, models, strategies
+
+# the format of the pools changes with the number at the end
+POOL_KEY = "protocole1:pool:%s:%s:%s:2"
+VERSION_KEY = "protocole1:pool-version:%s"
+GLOBAL_VERSION_KEY = "protocole1:pool-version"
+
+_pools = {}
+_versions = {}
+_global_version = 0
+_lock = threading.Lock()
+
+# A group of an experiment: the id of the group, its weight in the experiment and
+# the ids of its ideas
+PoolGroup = namedtuple("PoolGroup", ["id", "weight", "ideas"])
+
+
+class IdeaPool:
+    """
+    The ideas of an experiment gathered by group type.
+
+    :param ideas: the ids of the ideas of the experiment by group type
+    :type ideas: dict of GroupType to tuple of int
+    :param values: the content of the ideas by id
+    :type values: dict of int to str
+    :param version: the version of the pool in the cache
+    :type version: tuple of int
+    :param groups: the groups of the experiment by group type, defaults to None
+                    (one group of weight 1 by group type)
+    :type groups: dict of GroupType to tuple of PoolGroup, optional
+    :param experiment_id: the id of the experiment, defaults to None
+    :type experiment_id: int, optional
+    """
+
+    def __init__(self, ideas, values, version=None, groups=None, experiment_id=None):
+        self.ideas = ideas
+        self.values = values
+        self.version = version
+        self.experiment_id = experiment_id
+        if groups is None:
+            groups = {
+                group_type: (PoolGroup(None, 1, group_ideas),) if group_ideas else ()
+                for group_type, group_ideas in ideas.items()
+            }
+        self.groups = groups
+        self.sets = {
+            group_type: frozenset(group_ideas)
+            for group_type, group_ideas in ideas.items()
+        }
+        self._strategies = {}
+
+    def strategy(self, name):
+        """
+        Gives a selection strategy on the pool, built once.
+
+        :param name: the name of the strategy (see ``protocole1.strategies``)
+        :type name: str
+        :rtype: SelectionStrategy
+        """
+        strategy = self._strategies.get(name)
+        if strategy is None:
+            strategy = self._strategies[name] = strategies.get_strategy(name)(self)
+        return strategy
+
+    def idea(self, idea_id):
+        """
+        Builds an idea of the pool without querying the database.
+
+        :param idea_id: the id of the idea
+        :type idea_id: int
+        :return: the idea
+        :rtype: Idea
+        """
+        return models.Idea(id=idea_id, value=self.values[idea_id])
+
+    def to_cache(self):
+        """
+        Gives a picklable representation of the pool.
+
+        :rtype: dict
+        """
+        return {
+            "ideas": {
+                group_type.value: ideas for group_type, ideas in self.ideas.items()
+            },
+            "values": self.values,
+            "groups": {
+                group_type.value: [tuple(group) for group in groups]
+                for group_type, groups in self.groups.items()
+            },
+            "experiment_id": self.experiment_id,
+        }
+
+    @classmethod
+    def from_cache(cls, data, version=None):
+        """
+        Builds a pool from its representation in the shared cache.
+
+        :param data: the representation given by ``to_cache``
+        :type data: dict
+        :param version: the version of the pool in the cache
+        :type version: tuple of int
+        :rtype: IdeaPool
+        """
+        return cls(
+            {
+                models.GroupType(group_type): ideas
+                for group_type, ideas in data["ideas"].items()
+            },
+            data["values"],
+            version,
+            {
+                models.GroupType(group_type): tuple(
+                    PoolGroup(*group) for group in groups
+                )
+                for group_type, groups in data["groups"].items()
+            },
+            data["experiment_id"],
+        )
+
+
+class RemainingIdeas:
+    """
+    The ideas of a pool which have not been used yet by a participant, by group
+    type. The ideas are drawn by a selection strategy without listing the ideas
+    remaining, so drawing an idea and checking whether the pool is exhausted are
+    O(1) on average.
+
+    :param pool: the pool of the experiment
+    :type pool: IdeaPool
+    :param used_ideas: the ids of the ideas already used
+    :type used_ideas: set of int
+    :param rng: the random generator used to draw the ideas, defaults to the
+                ``random`` module
+    :type rng: random.Random, optional
+    :param strategy: the name of the selection strategy, defaults to "uniform"
+    :type strategy: str, optional
+    """
+
+    def __init__(self, pool, used_ideas, rng=random, strategy="uniform"):
+        self.pool = pool
+        self.rng = rng
+        self.strategy = pool.strategy(strategy)
+        self.used_ideas = used_ideas
+        # the ideas drawn since, used_ideas being left unchanged
+        self.drawn_ideas = set()
+        self.counts = {
+            group_type: len(ideas)
+            - sum(1 for idea_id in used_ideas if idea_id in pool.sets[group_type])
+            for group_type, ideas in pool.ideas.items()
+        }
+
+    def __getitem__(self, group_type):
+        return [
+            idea_id
+            for idea_id in self.pool.ideas[group_type]
+            if self.is_available(idea_id)
+        ]
+
+    def is_available(self, idea_id):
+        """
+        Checks whether an idea has not been used yet.
+
+        :param idea_id: the id of the idea
+        :type idea_id: int
+        :rtype: boolean
+        """
+        return idea_id not in self.used_ideas and idea_id not in self.drawn_ideas
+
+    def is_exhausted(self):
+        """
+        Checks whether there is no idea remaining in one of the group types.
+
+        :rtype: boolean
+        """
+        return any(count <= 0 for count in self.counts.values())
+
+    def draw(self, group_type, consume=True):
+        """
+        Draws an idea not used yet in a group type with the selection strategy and
+        marks it as used.
+
+        :param group_type: the group type to draw the idea from
+        :type group_type: GroupType
+        :param consume: whether the idea is marked as used, defaults to True
+        :type consume: boolean, optional
+        :raises IndexError: when there is no idea remaining in the group type
+        :return: the idea drawn
+        :rtype: Idea
+        """
+        if self.counts[group_type] <= 0:
+            raise IndexError("No idea remaining in %s" % group_type)
+        idea_id = self.strategy.draw(group_type, self.is_available, self.rng)
+        if consume:
+            self.use(idea_id)
+        return self.pool.idea(idea_id)
+
+    def use(self, idea_id):
+        """
+        Marks an idea selected without drawing it (see
+        ``views.speculate_next_steps``) as used.
+
+        :param idea_id: the id of the idea
+        :type idea_id: int
+        """
+        self.drawn_ideas.add(idea_id)
+        # an idea shared by groups of both types (seldom) is used in both
+        for group_type, ideas in self.pool.sets.items():
+            if idea_id in ideas:
+                self.counts[group_type] -= 1
+
+
+@metrics.stage("load_pool")
+def load_pool(experiment_id):
+    """
+    Loads the pool of an experiment from the database in one query.
+
+    :param experiment_id: the id of the experiment
+    :type experiment_id: int
+    :return: the pool of the experiment
+    :rtype: IdeaPool
+    """
+    rows = (
+        models.ExperimentGroups.objects.filter(
+            experiment_id=experiment_id, group__ideas__isnull=False
+        )
+        .order_by("pk", "group__ideas__id")
+        .values_list(
+            "group_type_here",
+            "group_id",
+            "weight",
+            "group__ideas__id",
+            "group__ideas__value",
+        )
+    )
+    ideas = {group_type: {} for group_type in models.GroupType}
+    groups = {group_type: {} for group_type in models.GroupType}
+    values = {}
+    for group_type, group_id, weight, idea_id, value in rows:
+        group_type = models.GroupType(group_type)
+        # an idea may belong to several groups of the same type (dicts keep the
+        # order of the ideas but only once)
+        ideas[group_type][idea_id] = None
+        groups[group_type].setdefault((group_id, weight), []).append(idea_id)
+        values[idea_id] = value
+    for group_type, group_ideas in ideas.items():
+        metrics.observe(
+            "protocole1_pool_ideas",
+            len(group_ideas),
+            experiment=experiment_id,
+            group_type=group_type.name.lower(),
+        )
+    return IdeaPool(
+        {group_type: tuple(group_ideas) for group_type, group_ideas in ideas.items()},
+        values,
+        groups={
+            group_type: tuple(
+                PoolGroup(group_id, weight, tuple(group_ideas))
+                for (group_id, weight), group_ideas in type_groups.items()
+            )
+            for group_type, type_groups in groups.items()
+        },
+        experiment_id=experiment_id,
+    )
+
+
+def _shared_cache():
+    alias = getattr(settings, "PROTOCOLE1_POOL_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _version(experiment_id, shared):
+    if shared is None:
+        return (_global_version, _versions.get(experiment_id, 0))
+    versions = shared.get_many([GLOBAL_VERSION_KEY, VERSION_KEY % experiment_id])
+    return (
+        versions.get(GLOBAL_VERSION_KEY, 0),
+        versions.get(VERSION_KEY % experiment_id, 0),
+    )
+
+
+def get_pool(experiment_id):
+    """
+    Gives the pool of an experiment, from the cache if possible.
+
+    :param experiment_id: the id of the experiment
+    :type experiment_id: int
+    :return: the pool of the experiment
+    :rtype: IdeaPool
+    """
+    shared = _shared_cache()
+    version = _version(experiment_id, shared)
+    pool = _pools.get(experiment_id)
+    if pool is not None and pool.version == version:
+        return pool
+
+    data = None
+    if shared is not None:
+        key = POOL_KEY % ((experiment_id,) + version)
+        data = shared.get(key)
+    if data is not None:
+        pool = IdeaPool.from_cache(data, version)
+    else:
+        pool = load_pool(experiment_id)
+        pool.version = version
+        if shared is not None:
+            shared.set(key, pool.to_cache(), None)
+
+    with _lock:
+        # does not store a pool that has been invalidated while being loaded
+        if shared is not None or _version(experiment_id, None) == version:
+            _pools[experiment_id] = pool
+    return pool
+
+
+def _bump(shared, key):
+    try:
+        shared.incr(key)
+    except ValueError:
+        if not shared.add(key, 1, None):
+            shared.incr(key)
+
+
+def invalidate_pool(experiment_id=None):
+    """
+    Invalidates the pool of an experiment, or of every experiment.
+
+    :param experiment_id: the id of the experiment, defaults to None (every
+                            experiment)
+    :type experiment_id: int, optional
+    """
+    global _global_version
+
+    with _lock:
+        if experiment_id is None:
+            _global_version += 1
+            _pools.clear()
+        else:
+            _versions[experiment_id] = _versions.get(experiment_id, 0) + 1
+            _pools.pop(experiment_id, None)
+
+    shared = _shared_cache()
+    if shared is not None:
+        _bump(
+            shared,
+            (
+                GLOBAL_VERSION_KEY
+                if experiment_id is None
+                else VERSION_KEY % experiment_id
+            ),
+        )
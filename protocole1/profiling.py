@@ -0,0 +1,308 @@
+"""
+Profiling of the requests on demand.
+
+When ``PROTOCOLE1_PROFILING_DIR`` names a directory, a staff member profiles a
+request of protocole1 by adding the parameter ``profile`` to its query string or
+the header ``X-Profile``, whose value chooses the profiler:
+
+- ``cprofile`` (the default): the deterministic profiler of Python, saved in the
+  pstats format (to read with ``pstats``, snakeviz...);
+- ``sampling``: the stack of the thread serving the request sampled every
+  ``PROTOCOLE1_PROFILING_INTERVAL`` seconds (or every switch interval of the
+  interpreter, 5 ms by default, if longer), saved in the format of speedscope
+  (https://www.speedscope.app), cheaper on the long requests.
+
+The response links to the profile in the header ``X-Profile-Url`` (a streamed
+response is profiled until its content is consumed, its profile is written
+then). Besides, a fraction ``PROTOCOLE1_PROFILING_SAMPLE_RATE`` of the requests
+of protocole1 is profiled in the background with
+``PROTOCOLE1_PROFILING_BACKGROUND_PROFILER``. Only the latest
+``PROTOCOLE1_PROFILING_KEEP`` profiles are kept, listed to the staff on
+/profiles/.
+"""
+import cProfile
+import datetime
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.urls import Resolver404, resolve, reverse
+
+# The extension of the profiles by profiler
+EXTENSIONS = {"cprofile": ".prof", "sampling": ".speedscope.json"}
+
+PROFILE_NAME = re.compile(r"^[\w.-]+(\.prof|\.speedscope\.json)$")
+
+
+def _directory():
+    return getattr(settings, "PROTOCOLE1_PROFILING_DIR", None)
+
+
+class CProfiler:
+    """
+    Profiles a request with cProfile.
+    """
+
+    extension = EXTENSIONS["cprofile"]
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path, name):
+        self.profile.dump_stats(path)
+
+
+class StackSampler:
+    """
+    Profiles a request by sampling the stack of its thread from another thread,
+    which runs from ``start`` to ``stop``.
+
+    :param interval: the number of seconds between the samples
+    :type interval: float
+    """
+
+    extension = EXTENSIONS["sampling"]
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.frames = {}
+        self.samples = []
+        self.weights = []
+        self.stopping = threading.Event()
+        self.thread = None
+        self.start_time = None
+        self.duration = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(
+            target=self.run, name="profiling-sampler", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        # a streamed response is sampled while its chunks are produced: the
+        # sampler is started and stopped for each chunk
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.duration += time.perf_counter() - self.start_time
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                if key not in self.frames:
+                    self.frames[key] = len(self.frames)
+                stack.append(self.frames[key])
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+
+    def save(self, path, name):
+        self.stop()
+        data = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "protocole1",
+            "name": name,
+            "shared": {
+                "frames": [
+                    {"name": function, "file": file, "line": line}
+                    for function, file, line in self.frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": self.samples,
+                    "weights": self.weights,
+                }
+            ],
+        }
+        with open(path, "w", encoding="utf-8") as stream:
+            json.dump(data, stream)
+
+
+def get_profiler(name):
+    """
+    Gives a new profiler.
+
+    :param name: the name of the profiler, "cprofile" or "sampling" (cprofile
+        if unknown)
+    :type name: str
+    :rtype: CProfiler or StackSampler
+    """
+    if name == "sampling":
+        return StackSampler(getattr(settings, "PROTOCOLE1_PROFILING_INTERVAL", 0.001))
+    return CProfiler()
+
+
+def requested_profiler(request):
+    """
+    Gives the profiler requested for a request, by a staff member or in the
+    background.
+
+    :param request: the request considered
+    :type request: HttpRequest
+    :return: the name of the profiler and whether a staff member requested it,
+        None if the request is not profiled
+    :rtype: tuple of str and bool
+    """
+    value = request.GET.get("profile", request.headers.get("X-Profile"))
+    user = getattr(request, "user", None)
+    if value is not None and user is not None and user.is_staff:
+        return value, True
+    rate = getattr(settings, "PROTOCOLE1_PROFILING_SAMPLE_RATE", 0)
+    if rate and random.random() < rate:
+        return (
+            getattr(settings, "PROTOCOLE1_PROFILING_BACKGROUND_PROFILER", "sampling"),
+            False,
+        )
+    return None
+
+
+def list_profiles():
+    """
+    Lists the profiles saved.
+
+    :return: the names of the profiles, the latest first
+    :rtype: list of str
+    """
+    directory = _directory()
+    if directory is None or not os.path.isdir(directory):
+        return []
+    return sorted(
+        (name for name in os.listdir(directory) if PROFILE_NAME.match(name)),
+        reverse=True,
+    )
+
+
+def profile_path(name):
+    """
+    Gives the path of a profile saved.
+
+    :param name: the name of the profile
+    :type name: str
+    :return: the path, None if there is no such profile
+    :rtype: str
+    """
+    directory = _directory()
+    if directory is None or not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+
+def save(profiler, name):
+    """
+    Saves a profile, and deletes the oldest ones beyond PROTOCOLE1_PROFILING_KEEP.
+
+    :param profiler: the profiler of the request
+    :type profiler: CProfiler or StackSampler
+    :param name: the name of the profile
+    :type name: str
+    """
+    directory = _directory()
+    os.makedirs(directory, exist_ok=True)
+    profiler.save(os.path.join(directory, name), name)
+    for old in list_profiles()[getattr(settings, "PROTOCOLE1_PROFILING_KEEP", 200) :]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            # removed by another process
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests of protocole1 asked by the staff or sampled (disabled
+    without PROTOCOLE1_PROFILING_DIR).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if _directory() is None:
+            return self.get_response(request)
+        try:
+            url_name = resolve(request.path_info).url_name or ""
+        except Resolver404:
+            return self.get_response(request)
+        requested = (
+            requested_profiler(request) if url_name.startswith("protocole1.") else None
+        )
+        if requested is None:
+            return self.get_response(request)
+
+        profiler = get_profiler(requested[0])
+        name = "%s-%s-%s%s" % (
+            datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+            url_name,
+            uuid.uuid4().hex[:8],
+            profiler.extension,
+        )
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        if requested[1]:
+            response["X-Profile-Url"] = request.build_absolute_uri(
+                reverse("profile", args=[name])
+            )
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, profiler, name
+            )
+        else:
+            save(profiler, name)
+        return response
+
+    def stream(self, content, profiler, name):
+        iterator = iter(content)
+        try:
+            while True:
+                profiler.start()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    profiler.stop()
+                yield chunk
+        finally:
+            # also when the response is closed before the end (the client
+            # disconnected) or its content failed
+            save(profiler, name)
@@ -0,0 +1,192 @@
+"""
+Cache of the results pages.
+
+Each experiment has a version in the cache named by the setting
+``PROTOCOLE1_RESULTS_CACHE``, bumped whenever its results change (a participant
+starts, is proposed an idea or reacts, see ``bump_version``). The results page is
+cached under the version read before rendering it, so that it is served as is
+until the results change. The page is made of the fragment of each participant,
+cached under the state of his result (its number of ideas proposed and whether
+one waits for a reaction): a new version of the page only renders the fragments
+of the participants who progressed.
+
+The pages and the fragments are kept ``PROTOCOLE1_RESULTS_CACHE_TIMEOUT``
+seconds, which bounds the staleness of the results changed without going through
+the views (in the admin for instance). The pages larger than
+``PROTOCOLE1_RESULTS_CACHE_MAX_PAGE_SIZE`` characters are not cached, only their
+fragments: rendering a page keeps at most this size in memory.
+
+The versions are only seen by the processes sharing the cache, so the cache must
+be shared by all the processes serving protocole1 (memcached, database...): there
+is no cache by default.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = "protocole1:results:version:%s"
+PAGE_KEY = "protocole1:results:page:%s:%s"
+FRAGMENT_KEY = "protocole1:results:fragment:%s:%s:%s"
+
+# The number of fragments read from the cache at once
+BATCH_SIZE = 100
+
+
+def _cache():
+    alias = getattr(settings, "PROTOCOLE1_RESULTS_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _timeout():
+    return getattr(settings, "PROTOCOLE1_RESULTS_CACHE_TIMEOUT", 3600)
+
+
+def get_version(experiment_id):
+    """
+    Gives the version of the results of an experiment.
+
+    :param experiment_id: the id of the experiment
+    :type experiment_id: int
+    :return: the version, None if the cache is disabled
+    :rtype: int
+    """
+    cache = _cache()
+    if cache is None:
+        return None
+    key = VERSION_KEY % experiment_id
+    version = cache.get(key)
+    if version is None:
+        # a version greater than the lost one, whose pages may still be cached
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(experiment_id):
+    """
+    Bumps the version of the results of an experiment, now and once the current
+    transaction is committed since a page may be rendered meanwhile without the
+    change.
+
+    :param experiment_id: the id of the experiment
+    :type experiment_id: int
+    """
+    cache = _cache()
+    if cache is None:
+        return
+
+    def bump():
+        try:
+            cache.incr(VERSION_KEY % experiment_id)
+        except ValueError:
+            # no version: the next one is new anyway
+            pass
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_page(experiment_id):
+    """
+    Gives the results page of an experiment cached for its current version.
+
+    :param experiment_id: the id of the experiment
+    :type experiment_id: int
+    :return: the key of the page (None if the cache is disabled) and the page
+        (None if it is not cached)
+    :rtype: tuple of str and str
+    """
+    version = get_version(experiment_id)
+    if version is None:
+        return None, None
+    key = PAGE_KEY % (experiment_id, version)
+    return key, _cache().get(key)
+
+
+class PageWriter:
+    """
+    Gathers the chunks of a results page while it is rendered to cache it, unless
+    it gets larger than ``PROTOCOLE1_RESULTS_CACHE_MAX_PAGE_SIZE`` characters.
+
+    :param key: the key given by ``get_page`` (None to not cache the page)
+    :type key: str
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.max_size = getattr(
+            settings, "PROTOCOLE1_RESULTS_CACHE_MAX_PAGE_SIZE", 1024 * 1024
+        )
+        self.chunks = []
+        self.size = 0
+
+    def write(self, chunk):
+        """
+        Adds a chunk to the page.
+
+        :param chunk: the chunk rendered
+        :type chunk: str
+        """
+        if self.key is None:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            # too large to be cached, the chunks gathered are dropped
+            self.key = None
+            self.chunks = []
+        else:
+            self.chunks.append(chunk)
+
+    def save(self):
+        """
+        Caches the page, once rendered.
+        """
+        if self.key is not None:
+            _cache().set(self.key, "".join(self.chunks), _timeout())
+
+
+def fragment_key(result):
+    """
+    Gives the key of the fragment of a result, which changes with its progress.
+
+    :param result: the result considered
+    :type result: Result
+    :rtype: str
+    """
+    return FRAGMENT_KEY % (result.pk, result.reactions_count, result.pending)
+
+
+def get_fragments(results):
+    """
+    Gives the fragments of the results page cached for results.
+
+    :param results: the results considered
+    :type results: iterable of Result
+    :return: the fragments by result id
+    :rtype: dict of int to str
+    """
+    cache = _cache()
+    if cache is None:
+        return {}
+    keys = {fragment_key(result): result.pk for result in results}
+    return {keys[key]: fragment for key, fragment in cache.get_many(keys).items()}
+
+
+def set_fragments(fragments):
+    """
+    Caches fragments of the results page.
+
+    :param fragments: the fragments by result
+    :type fragments: dict of Result to str
+    """
+    cache = _cache()
+    if cache is not None and fragments:
+        cache.set_many(
+            {fragment_key(result): fragment for result, fragment in fragments.items()},
+            _timeout(),
+        )
@@ -0,0 +1,106 @@
+"""
+Signal receivers keeping the caches of the application up to date.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from protocole1 import models, pools, results_cache, statuses
+
+
+@receiver(pre_save, sender=models.ExperimentGroups)
+def remember_experiment_groups_experiment(sender, instance, **kwargs):
+    """
+    Remembers the experiment of a group of an experiment before it is saved, which
+    may move it to another experiment.
+    """
+    instance._previous_experiment_id = (
+        models.ExperimentGroups.objects.filter(pk=instance.pk)
+        .values_list("experiment_id", flat=True)
+        .first()
+        if instance.pk is not None
+        else None
+    )
+
+
+@receiver(post_save, sender=models.ExperimentGroups)
+@receiver(post_delete, sender=models.ExperimentGroups)
+def invalidate_experiment_groups_pool(sender, instance, **kwargs):
+    """
+    Invalidates the pool of an experiment when its groups change, and the pool of
+    the experiment a group is moved from.
+    """
+    pools.invalidate_pool(instance.experiment_id)
+    previous_experiment_id = getattr(instance, "_previous_experiment_id", None)
+    if previous_experiment_id not in (None, instance.experiment_id):
+        pools.invalidate_pool(previous_experiment_id)
+
+
+@receiver(m2m_changed, sender=models.IdeasGroup.ideas.through)
+def invalidate_ideas_group_pools(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the pools of the experiments using a group when its ideas change.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        groups = [instance.pk]
+    elif pk_set is not None:
+        groups = pk_set
+    else:
+        # the groups of an idea are cleared: they are not known anymore
+        pools.invalidate_pool()
+        return
+    experiments = (
+        models.ExperimentGroups.objects.filter(group__in=groups)
+        .values_list("experiment_id", flat=True)
+        .distinct()
+    )
+    for experiment_id in experiments:
+        pools.invalidate_pool(experiment_id)
+
+
+@receiver(post_save, sender=models.Idea)
+@receiver(post_delete, sender=models.Idea)
+def invalidate_idea_pools(sender, instance, created=False, **kwargs):
+    """
+    Invalidates every pool when an idea is changed or deleted (a new idea does not
+    belong to any group yet).
+    """
+    if not created:
+        pools.invalidate_pool()
+
+
+@receiver(post_save, sender=models.Result)
+def invalidate_result_statuses(sender, instance, created, update_fields, **kwargs):
+    """
+    Invalidates the status of a user when one of his results is created or
+    finished.
+    """
+    if created or update_fields is None or "finished" in update_fields:
+        statuses.invalidate_statuses(instance.user_id)
+
+
+@receiver(post_delete, sender=models.Result)
+def invalidate_deleted_result_statuses(sender, instance, **kwargs):
+    """
+    Invalidates the status of a user when one of his results is deleted.
+    """
+    statuses.invalidate_statuses(instance.user_id)
+
+
+@receiver(post_save, sender=models.Result)
+@receiver(post_delete, sender=models.Result)
+@receiver(post_save, sender=models.ResultOnIdea)
+def bump_results_version(sender, instance, **kwargs):
+    """
+    Bumps the version of the results of an experiment when a participant starts,
+    is proposed an idea or finishes (the reactions are recorded by updates, see
+    ``views.record_reaction``). The deletions of the steps are not followed: the
+    steps are deleted with their result, which bumps the version once instead of
+    querying the experiment of every step (a step deleted alone from the admin
+    is only seen once the cached pages expire).
+    """
+    if sender is models.Result:
+        results_cache.bump_version(instance.experiment_id)
+    else:
+        results_cache.bump_version(instance.result.experiment_id)
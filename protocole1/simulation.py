@@ -0,0 +1,355 @@
+"""
+Monte Carlo simulation of the participation to an experiment.
+
+Virtual participants are simulated by chunks, each participant of a chunk being
+an element of NumPy arrays, so that millions of participants take seconds. Each
+step reproduces ``get_next_step`` (expansion when a uniform draw is lower than or
+equal to the expansion rate, then an idea drawn uniformly among the ideas of the
+group type not seen yet), draws the reaction from a reaction policy (see
+``ReactionPolicy``) and updates the expansion rate with the rules of the models
+(``EXPANSION_RATE_RULES`` and ``EXPANSION_RATE_STEP``, see
+``next_expansion_rates``). A participant finishes when one group type is
+exhausted or when the limit of ideas is reached, as in ``pick_next_idea``.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+from protocole1 import models
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# The reactions of the users, indexing the probabilities of the policies
+REACTIONS = [reaction for reaction in models.Reactions if reaction.value > 0]
+
+
+def _check_numpy():
+    if np is None:
+        raise ImproperlyConfigured("NumPy is required to simulate the experiments.")
+
+
+def expansion_rate_rules():
+    """
+    Gives the rules of the models as an array of the direction of the change of
+    the expansion rate (1, -1 or 0), indexed by whether expansion did occur and
+    by the value of the reaction.
+
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    rules = np.zeros((2, max(reaction.value for reaction in models.Reactions) + 1))
+    for (did_expand, reaction), direction in models.EXPANSION_RATE_RULES.items():
+        rules[int(did_expand), reaction.value] = direction
+    return rules
+
+
+def next_expansion_rates(expansion_rates, did_expand, reactions, rules=None):
+    """
+    Applies the algorithm of ``models.next_expansion_rate`` to arrays.
+
+    :param expansion_rates: the expansion rates before the reactions
+    :type expansion_rates: numpy.ndarray of float
+    :param did_expand: did or did not expand
+    :type did_expand: numpy.ndarray of bool
+    :param reactions: the values of the reactions
+    :type reactions: numpy.ndarray of int
+    :param rules: the rules (see ``expansion_rate_rules``), defaults to None
+                (computed)
+    :type rules: numpy.ndarray, optional
+    :return: the expansion rates after the reactions (not clamped, as stored)
+    :rtype: numpy.ndarray of float
+    """
+    if rules is None:
+        rules = expansion_rate_rules()
+    directions = rules[did_expand.astype("int64"), reactions]
+    increase = (directions > 0) & (expansion_rates < 1)
+    decrease = (directions < 0) & (expansion_rates > 0)
+    return np.where(
+        increase,
+        expansion_rates + models.EXPANSION_RATE_STEP,
+        np.where(
+            decrease, expansion_rates - models.EXPANSION_RATE_STEP, expansion_rates
+        ),
+    )
+
+
+class ReactionPolicy:
+    """
+    A model of the reactions of the users: the probabilities of each reaction
+    (CONTINUE, EXPAND, NEUTRAL) after a fixation and after an expansion.
+
+    :param after_fixation: the probabilities of the reactions after a fixation
+    :type after_fixation: sequence of 3 floats
+    :param after_expansion: the probabilities of the reactions after an expansion,
+                            defaults to None (the same as after a fixation)
+    :type after_expansion: sequence of 3 floats, optional
+    """
+
+    def __init__(self, after_fixation, after_expansion=None):
+        _check_numpy()
+        if after_expansion is None:
+            after_expansion = after_fixation
+        probabilities = np.array([after_fixation, after_expansion], dtype="float64")
+        if probabilities.shape != (2, len(REACTIONS)) or (probabilities < 0).any():
+            raise ValueError("Invalid probabilities of reactions")
+        self.probabilities = probabilities / probabilities.sum(axis=1, keepdims=True)
+        self._cumulated = np.cumsum(self.probabilities, axis=1)
+        self._values = np.array([reaction.value for reaction in REACTIONS])
+
+    def draw(self, rng, did_expand):
+        """
+        Draws the reactions of participants.
+
+        :param rng: the random generator
+        :type rng: numpy.random.Generator
+        :param did_expand: did or did not expand, by participant
+        :type did_expand: numpy.ndarray of bool
+        :return: the values of the reactions
+        :rtype: numpy.ndarray of int
+        """
+        cumulated = self._cumulated[did_expand.astype("int64")]
+        draws = rng.random(len(did_expand))[:, None]
+        indexes = np.minimum((draws >= cumulated).sum(axis=1), len(REACTIONS) - 1)
+        return self._values[indexes]
+
+
+# The predefined policies: the probabilities of CONTINUE, EXPAND and NEUTRAL after
+# a fixation and after an expansion
+POLICIES = {
+    # reacts at random
+    "uniform": ((1, 1, 1), (1, 1, 1)),
+    # likes the expansions: the expansion rate tends to increase
+    "explorer": ((0.2, 0.6, 0.2), (0.6, 0.2, 0.2)),
+    # likes the fixations: the expansion rate tends to decrease
+    "focused": ((0.6, 0.2, 0.2), (0.2, 0.6, 0.2)),
+    # mostly neutral
+    "indifferent": ((0.1, 0.1, 0.8), (0.1, 0.1, 0.8)),
+}
+
+
+def get_policy(name):
+    """
+    Gives a predefined reaction policy.
+
+    :param name: the name of the policy, one of ``POLICIES``
+    :type name: str
+    :rtype: ReactionPolicy
+    """
+    return ReactionPolicy(*POLICIES[name])
+
+
+class SimulationResult:
+    """
+    The distributions obtained by a simulation.
+
+    :param participants: the number of participants simulated
+    :type participants: int
+    :param rate_bins: the number of participants by final expansion rate bin (of
+                    ``EXPANSION_RATE_STEP``, the rate being clamped)
+    :type rate_bins: numpy.ndarray of int
+    :param lengths: the number of participants by number of ideas seen when they
+                    finished
+    :type lengths: numpy.ndarray of int
+    :param exhausted: the number of participants who finished because a group
+                    type was exhausted (the others reached the limit of ideas)
+    :type exhausted: int
+    :param ideas_seen: the number of participants who saw each idea, by group type
+    :type ideas_seen: dict of GroupType to numpy.ndarray of int
+    :param steps_rates: the sum of the expansion rates (clamped) after each step
+                        and the number of participants who reached it
+    :type steps_rates: tuple of numpy.ndarray
+    """
+
+    def __init__(
+        self, participants, rate_bins, lengths, exhausted, ideas_seen, steps_rates
+    ):
+        self.participants = participants
+        self.rate_bins = rate_bins
+        self.lengths = lengths
+        self.exhausted = exhausted
+        self.ideas_seen = ideas_seen
+        self.steps_rates = steps_rates
+
+    @property
+    def mean_rate(self):
+        rates = np.arange(len(self.rate_bins)) * models.EXPANSION_RATE_STEP
+        return float((rates * self.rate_bins).sum() / self.participants)
+
+    @property
+    def mean_length(self):
+        return float(
+            (np.arange(len(self.lengths)) * self.lengths).sum() / self.participants
+        )
+
+    def length_percentile(self, percent):
+        """
+        Gives a percentile of the number of ideas seen by the participants.
+
+        :param percent: the percentile, between 0 and 100
+        :type percent: float
+        :rtype: int
+        """
+        cumulated = np.cumsum(self.lengths)
+        return int(np.searchsorted(cumulated, percent / 100 * self.participants))
+
+    def to_dict(self, ideas_ids=None):
+        """
+        Gives the distributions in a form which can be serialized in JSON.
+
+        :param ideas_ids: the ids of the ideas by group type, defaults to None
+                        (ideas numbered from 0)
+        :type ideas_ids: dict of GroupType to sequence of int, optional
+        :rtype: dict
+        """
+        sums, counts = self.steps_rates
+        return {
+            "participants": self.participants,
+            "mean_expansion_rate": self.mean_rate,
+            "expansion_rates": {
+                "%.2f" % (index * models.EXPANSION_RATE_STEP): int(count)
+                for index, count in enumerate(self.rate_bins)
+                if count
+            },
+            "mean_ideas_seen": self.mean_length,
+            "ideas_seen_percentiles": {
+                percent: self.length_percentile(percent) for percent in (50, 95, 99)
+            },
+            "lengths": {
+                length: int(count) for length, count in enumerate(self.lengths) if count
+            },
+            "exhausted": self.exhausted,
+            "ideas": {
+                group_type.name: dict(
+                    zip(
+                        (ideas_ids[group_type] if ideas_ids else range(len(seen))),
+                        (int(count) for count in seen),
+                    )
+                )
+                for group_type, seen in self.ideas_seen.items()
+            },
+            "steps": [
+                {"order": order, "count": int(count), "mean": float(total / count)}
+                for order, (total, count) in enumerate(zip(sums, counts))
+                if count
+            ],
+        }
+
+
+def _seen_counts(rng, seen_by_participant, ideas_count):
+    # each participant saw a uniform random subset of the ideas, of the size
+    # given: the first ones of a random permutation
+    counts = np.zeros(ideas_count, dtype="int64")
+    # limits the size of the permutations computed at once
+    batch_size = max(1, 2**22 // max(ideas_count, 1))
+    for start in range(0, len(seen_by_participant), batch_size):
+        batch = seen_by_participant[start : start + batch_size]
+        permutations = np.argsort(rng.random((len(batch), ideas_count)), axis=1)
+        seen = np.arange(ideas_count)[None, :] < batch[:, None]
+        counts += np.bincount(permutations[seen], minlength=ideas_count)
+    return counts
+
+
+def simulate(
+    participants,
+    fixation_ideas,
+    expansion_ideas,
+    starting_expansion_rate=0.2,
+    limit_ideas_number=-1,
+    policy=None,
+    seed=None,
+    chunk_size=100000,
+):
+    """
+    Simulates the participation of users to an experiment.
+
+    :param participants: the number of participants
+    :type participants: int
+    :param fixation_ideas: the number of ideas of the fixation groups
+    :type fixation_ideas: int
+    :param expansion_ideas: the number of ideas of the expansion groups
+    :type expansion_ideas: int
+    :param starting_expansion_rate: the expansion rate of the new participants,
+                                    defaults to 0.2
+    :type starting_expansion_rate: float, optional
+    :param limit_ideas_number: the number of ideas proposed to each participant,
+                                defaults to -1 (no limit)
+    :type limit_ideas_number: int, optional
+    :param policy: the reactions of the participants, defaults to None (uniform)
+    :type policy: ReactionPolicy, optional
+    :param seed: the seed of the random generator, defaults to None
+    :type seed: int, optional
+    :param chunk_size: the number of participants simulated at once, defaults to
+                        100000
+    :type chunk_size: int, optional
+    :rtype: SimulationResult
+    """
+    _check_numpy()
+    if fixation_ideas < 1 or expansion_ideas < 1:
+        raise ValueError("Both group types need ideas")
+    if policy is None:
+        policy = get_policy("uniform")
+    rng = np.random.default_rng(seed)
+    rules = expansion_rate_rules()
+    max_length = fixation_ideas + expansion_ideas
+    if limit_ideas_number > 0:
+        max_length = min(max_length, limit_ideas_number)
+
+    rate_bins = np.zeros(int(round(1 / models.EXPANSION_RATE_STEP)) + 1, "int64")
+    lengths = np.zeros(max_length + 1, "int64")
+    exhausted = 0
+    ideas_seen = {
+        models.GroupType.FIXATION: np.zeros(fixation_ideas, "int64"),
+        models.GroupType.EXPANSION: np.zeros(expansion_ideas, "int64"),
+    }
+    steps_sums = np.zeros(max_length)
+    steps_counts = np.zeros(max_length, "int64")
+
+    for start in range(0, participants, chunk_size):
+        count = min(chunk_size, participants - start)
+        rates = np.full(count, float(starting_expansion_rate))
+        fixation_seen = np.zeros(count, "int64")
+        expansion_seen = np.zeros(count, "int64")
+        active = np.arange(count)
+        step = 0
+        while len(active):
+            did_expand = rng.random(len(active)) <= rates[active]
+            fixation_seen[active] += ~did_expand
+            expansion_seen[active] += did_expand
+            reactions = policy.draw(rng, did_expand)
+            rates[active] = next_expansion_rates(
+                rates[active], did_expand, reactions, rules
+            )
+            steps_sums[step] += np.clip(rates[active], 0, 1).sum()
+            steps_counts[step] += len(active)
+            step += 1
+
+            # the participants who come back find a group type exhausted or reach
+            # the limit of ideas
+            exhausted_now = (fixation_seen[active] >= fixation_ideas) | (
+                expansion_seen[active] >= expansion_ideas
+            )
+            finished = exhausted_now | (step >= max_length)
+            exhausted += int(exhausted_now.sum())
+            lengths[step] += int(finished.sum())
+            active = active[~finished]
+
+        rate_bins += np.bincount(
+            np.rint(np.clip(rates, 0, 1) / models.EXPANSION_RATE_STEP).astype("int64"),
+            minlength=len(rate_bins),
+        )
+        ideas_seen[models.GroupType.FIXATION] += _seen_counts(
+            rng, fixation_seen, fixation_ideas
+        )
+        ideas_seen[models.GroupType.EXPANSION] += _seen_counts(
+            rng, expansion_seen, expansion_ideas
+        )
+
+    return SimulationResult(
+        participants,
+        rate_bins,
+        lengths,
+        exhausted,
+        ideas_seen,
+        (steps_sums, steps_counts),
+    )
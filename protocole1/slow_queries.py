@@ -0,0 +1,264 @@
+"""
+Log of the slow requests with the plans of their queries.
+
+``SlowQueryMiddleware`` records the SQL statements of the requests of protocole1
+(with ``execute_wrapper``). When a request takes more than
+``PROTOCOLE1_SLOW_REQUEST_THRESHOLD`` seconds, its slowest statements are
+explained (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` otherwise) and written
+with the path, the view and the size of the experiment to the rotating log
+``PROTOCOLE1_SLOW_QUERY_LOG`` (a JSON line per request), which the staff browse
+with ``views.slow_queries_view``. The statements scanning a whole table are
+flagged, to spot the missing indexes.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from protocole1 import models, pools
+
+# The maximal number of statements recorded per request
+MAX_STATEMENTS = 1000
+
+# The statements not explained
+UNEXPLAINED = ("SAVEPOINT", "RELEASE", "ROLLBACK", "BEGIN", "COMMIT")
+
+_handler = None
+_handler_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+
+def _threshold():
+    return getattr(settings, "PROTOCOLE1_SLOW_REQUEST_THRESHOLD", None)
+
+
+def _path():
+    return getattr(settings, "PROTOCOLE1_SLOW_QUERY_LOG", None)
+
+
+def get_logger():
+    """
+    Gives the logger writing to the rotating log, whose handler is created on the
+    first call (and again if the log changes).
+
+    :rtype: logging.Logger
+    """
+    global _handler
+    path = _path()
+    with _handler_lock:
+        if _handler is None or _handler.baseFilename != os.path.abspath(path):
+            if _handler is not None:
+                logger.removeHandler(_handler)
+                _handler.close()
+            _handler = RotatingFileHandler(
+                path,
+                maxBytes=getattr(settings, "PROTOCOLE1_SLOW_QUERY_LOG_SIZE", 10**7),
+                backupCount=getattr(settings, "PROTOCOLE1_SLOW_QUERY_LOG_BACKUPS", 3),
+                encoding="utf-8",
+            )
+            logger.addHandler(_handler)
+    return logger
+
+
+class StatementsRecorder:
+    """
+    Records the statements run with their duration (as a wrapper of
+    ``execute_wrapper``).
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            if len(self.statements) < MAX_STATEMENTS:
+                self.statements.append(
+                    (time.perf_counter() - start, sql, None if many else params)
+                )
+
+
+def explain(sql, params):
+    """
+    Gives the plan of a statement.
+
+    :param sql: the statement
+    :type sql: str
+    :param params: the parameters of the statement
+    :type params: sequence
+    :return: the lines of the plan, and whether it scans a whole table
+    :rtype: tuple of list of str and bool
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            # the rows are the id, the parent, an unused column and the detail
+            depths = {0: -1}
+            lines = []
+            for node, parent, _, detail in cursor.fetchall():
+                depths[node] = depths.get(parent, -1) + 1
+                lines.append("  " * depths[node] + detail)
+            full_scan = any(
+                line.strip().startswith("SCAN ") and "INDEX" not in line
+                for line in lines
+            )
+            return lines, full_scan
+        cursor.execute("EXPLAIN " + sql, params)
+        lines = [row[0] for row in cursor.fetchall()]
+        return lines, any("Seq Scan" in line for line in lines)
+
+
+def experiment_size(experiment_id):
+    """
+    Gives the size of an experiment: its number of results and of ideas.
+
+    :param experiment_id: the id of the experiment
+    :type experiment_id: int
+    :rtype: dict
+    """
+    pool = pools.get_pool(experiment_id)
+    return {
+        "id": experiment_id,
+        "results": models.Result.objects.filter(experiment_id=experiment_id).count(),
+        "ideas": {
+            group_type.name.lower(): len(ideas)
+            for group_type, ideas in pool.ideas.items()
+        },
+    }
+
+
+def record(request, recorder, duration):
+    """
+    Writes a slow request with the plans of its slowest statements to the log.
+
+    :param request: the request
+    :type request: HttpRequest
+    :param recorder: the statements of the request
+    :type recorder: StatementsRecorder
+    :param duration: the duration of the request in seconds
+    :type duration: float
+    """
+    match = request.resolver_match
+    statements = []
+    slowest = sorted(recorder.statements, key=lambda statement: -statement[0])
+    for seconds, sql, params in slowest[
+        : getattr(settings, "PROTOCOLE1_SLOW_QUERY_STATEMENTS", 5)
+    ]:
+        statement = {
+            "sql": sql,
+            "params": repr(params),
+            "seconds": seconds,
+            "plan": None,
+            "full_scan": False,
+        }
+        if params is not None and not sql.lstrip().upper().startswith(UNEXPLAINED):
+            try:
+                statement["plan"], statement["full_scan"] = explain(sql, params)
+            except DatabaseError as error:
+                statement["plan"] = ["EXPLAIN failed: %s" % error]
+        statements.append(statement)
+    entry = {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "method": request.method,
+        "path": request.get_full_path(),
+        "view": match.url_name if match is not None else None,
+        "seconds": duration,
+        "queries": recorder.queries,
+        "sql_seconds": sum(statement[0] for statement in recorder.statements),
+        "experiment": None,
+        "statements": statements,
+    }
+    if match is not None and "experiment_id" in match.kwargs:
+        try:
+            entry["experiment"] = experiment_size(int(match.kwargs["experiment_id"]))
+        except DatabaseError:
+            pass
+    get_logger().info(json.dumps(entry))
+
+
+def read_entries(limit=100):
+    """
+    Reads the latest slow requests of the log (with its rotated files).
+
+    :param limit: the maximal number of requests, defaults to 100
+    :type limit: int, optional
+    :return: the requests, the latest first
+    :rtype: list of dict
+    """
+    path = _path()
+    if path is None:
+        return []
+    entries = []
+    paths = [path] + [
+        "%s.%s" % (path, index)
+        for index in range(
+            1, getattr(settings, "PROTOCOLE1_SLOW_QUERY_LOG_BACKUPS", 3) + 1
+        )
+    ]
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, encoding="utf-8") as stream:
+            lines = stream.readlines()
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+            if len(entries) >= limit:
+                return entries
+    return entries
+
+
+class SlowQueryMiddleware:
+    """
+    Logs the requests of protocole1 slower than
+    PROTOCOLE1_SLOW_REQUEST_THRESHOLD seconds (disabled when None or without
+    PROTOCOLE1_SLOW_QUERY_LOG). The streamed responses are measured until their
+    content is consumed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if _threshold() is None or _path() is None:
+            return self.get_response(request)
+        recorder = StatementsRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response.streaming_content, recorder, start
+            )
+        else:
+            self.check(request, recorder, start)
+        return response
+
+    def stream(self, request, content, recorder, start):
+        with connection.execute_wrapper(recorder):
+            yield from content
+        self.check(request, recorder, start)
+
+    def check(self, request, recorder, start):
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        if (
+            duration > _threshold()
+            and match is not None
+            and (match.url_name or "").startswith("protocole1.")
+        ):
+            record(request, recorder, duration)
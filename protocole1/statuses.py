@@ -0,0 +1,83 @@
+"""
+Cache of the participation status of the users.
+
+The status of a user on the experiments (not participated, participating or
+finished) is read with the experiments in one annotated query, then kept in the
+cache named by the setting ``PROTOCOLE1_STATUS_CACHE`` (for
+``PROTOCOLE1_STATUS_CACHE_TIMEOUT`` seconds) so that the homepage only reads the
+experiments running. This cache must be shared by the processes which serve the
+participations, else they would not see the invalidations of each other: there
+is no cache by default. The status of a user is invalidated by the signals of
+``protocole1.signals`` when one of his results is created, finished or deleted.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from protocole1 import models
+
+STATUS_KEY = "protocole1:statuses:%s"
+
+
+def _cache():
+    alias = getattr(settings, "PROTOCOLE1_STATUS_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def running_experiments(user):
+    """
+    Gives the experiments running with the status of a user on each (``finished``
+    attribute: None if the user never participated, else whether the user
+    finished).
+
+    :param user: the user considered
+    :type user: User
+    :return: the experiments running
+    :rtype: list of Experiment
+    """
+    cache = _cache()
+    statuses = cache.get(STATUS_KEY % user.pk) if cache is not None else None
+    if statuses is not None:
+        experiments = list(models.Experiment.objects.filter(running=True))
+        for experiment in experiments:
+            experiment.finished = statuses.get(experiment.id)
+        return experiments
+
+    # the status on every experiment is cached, for the experiments which will run
+    experiments = models.Experiment.objects.annotate(
+        finished=Subquery(
+            models.Result.objects.filter(experiment=OuterRef("pk"), user=user).values(
+                "finished"
+            )[:1]
+        )
+    )
+    if cache is None:
+        return list(experiments.filter(running=True))
+    experiments = list(experiments)
+    cache.set(
+        STATUS_KEY % user.pk,
+        {
+            experiment.id: experiment.finished
+            for experiment in experiments
+            if experiment.finished is not None
+        },
+        getattr(settings, "PROTOCOLE1_STATUS_CACHE_TIMEOUT", 300),
+    )
+    return [experiment for experiment in experiments if experiment.running]
+
+
+def invalidate_statuses(user_id):
+    """
+    Invalidates the status of a user on the experiments.
+
+    :param user_id: the id of the user
+    :type user_id: int
+    """
+    cache = _cache()
+    if cache is not None:
+        cache.delete(STATUS_KEY % user_id)
+        # a request may cache the status again before the change is committed
+        transaction.on_commit(lambda: cache.delete(STATUS_KEY % user_id))
@@ -0,0 +1,350 @@
+"""
+Strategies selecting the ideas proposed to the participants.
+
+Once the group type of the next idea is chosen from the expansion rate (see
+``get_next_step``), the selection strategy of the experiment draws the idea among
+the ideas of this type not used yet by the participant. A strategy is built once
+per pool (see ``IdeaPool.strategy``) with its sampling tables, so that an idea is
+drawn in O(1) from the whole pool and drawn again if already used. The ideas
+remaining are only listed when a participant used most of them (after
+``MAX_REJECTIONS`` draws of used ideas).
+
+The strategies are registered by name in ``STRATEGIES`` (see ``register``), the
+names being the choices of ``Experiment.selection_strategy``.
+"""
+import time
+
+from django.db.models import F
+
+from protocole1 import models
+
+STRATEGIES = {}
+
+# The number of ideas drawn from the whole pool before drawing among the ideas
+# remaining
+MAX_REJECTIONS = 16
+
+# The number of seconds the statistics of the bandit strategy are kept
+BANDIT_REFRESH = 60
+
+
+def register(name):
+    """
+    Registers a strategy under a name (class decorator).
+
+    :param name: the name of the strategy
+    :type name: str
+    """
+
+    def decorator(cls):
+        cls.name = name
+        STRATEGIES[name] = cls
+        return cls
+
+    return decorator
+
+
+def get_strategy(name):
+    """
+    Gives a strategy by name.
+
+    :param name: the name of the strategy
+    :type name: str
+    :raises ValueError: when the strategy does not exist
+    :rtype: SelectionStrategy class
+    """
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise ValueError("Unknown selection strategy %r" % name)
+
+
+class AliasTable:
+    """
+    Draws indexes with given weights in O(1) (alias method of Walker, built in
+    linear time as described by Vose).
+
+    :param weights: the weight of each index
+    :type weights: sequence of float
+    """
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        if total <= 0:
+            weights, total = [1] * count, count
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            index, alias = small.pop(), large.pop()
+            self.probabilities[index] = scaled[index]
+            self.aliases[index] = alias
+            scaled[alias] += scaled[index] - 1
+            (small if scaled[alias] < 1 else large).append(alias)
+
+    def draw(self, rng):
+        """
+        Draws an index.
+
+        :param rng: the random generator
+        :type rng: random.Random
+        :rtype: int
+        """
+        index = rng.randrange(len(self.probabilities))
+        if rng.random() < self.probabilities[index]:
+            return index
+        return self.aliases[index]
+
+
+class SelectionStrategy:
+    """
+    The base of the strategies: draws from the whole pool with ``sample`` and
+    falls back on the ``weights`` of the ideas remaining.
+
+    :param pool: the pool of ideas of the experiment
+    :type pool: IdeaPool
+    """
+
+    name = None
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def sample(self, group_type, rng):
+        """
+        Draws an idea of a group type from the whole pool, in O(1).
+
+        :param group_type: the group type to draw the idea from
+        :type group_type: GroupType
+        :param rng: the random generator
+        :type rng: random.Random
+        :return: the id of the idea
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def weights(self, group_type):
+        """
+        Gives the weight of each idea of a group type, the probability of an idea
+        being proportional to its weight.
+
+        :param group_type: the group type considered
+        :type group_type: GroupType
+        :return: the weights by idea id
+        :rtype: dict of int to float
+        """
+        raise NotImplementedError
+
+    def draw(self, group_type, is_available, rng):
+        """
+        Draws an idea of a group type among the ideas available.
+
+        :param group_type: the group type to draw the idea from
+        :type group_type: GroupType
+        :param is_available: tells whether an idea (id) can be drawn
+        :type is_available: callable
+        :param rng: the random generator
+        :type rng: random.Random
+        :raises IndexError: when there is no idea available in the group type
+        :return: the id of the idea
+        :rtype: int
+        """
+        if self.pool.ideas[group_type]:
+            for _ in range(MAX_REJECTIONS):
+                idea_id = self.sample(group_type, rng)
+                if is_available(idea_id):
+                    return idea_id
+        # most of the ideas are used: draws among the ones remaining
+        remaining = [
+            (idea_id, weight)
+            for idea_id, weight in self.weights(group_type).items()
+            if is_available(idea_id)
+        ]
+        if not remaining:
+            raise IndexError("No idea remaining in %s" % group_type)
+        ideas, weights = zip(*remaining)
+        if sum(weights) <= 0:
+            return rng.choice(ideas)
+        return rng.choices(ideas, weights)[0]
+
+
+@register("uniform")
+class UniformStrategy(SelectionStrategy):
+    """
+    Draws the ideas of the group type uniformly, whatever their group (so the
+    large groups are selected more often).
+    """
+
+    def sample(self, group_type, rng):
+        ideas = self.pool.ideas[group_type]
+        return ideas[rng.randrange(len(ideas))]
+
+    def weights(self, group_type):
+        return dict.fromkeys(self.pool.ideas[group_type], 1)
+
+
+class GroupsStrategy(SelectionStrategy):
+    """
+    The base of the strategies drawing a group of the group type (with the
+    probability given by ``group_weight``), then an idea of this group uniformly.
+    """
+
+    def __init__(self, pool):
+        super().__init__(pool)
+        self._tables = {}
+        self._weights = {}
+
+    def group_weight(self, group):
+        """
+        Gives the weight of a group, the probability of a group being
+        proportional to its weight.
+
+        :param group: the group considered
+        :type group: PoolGroup
+        :rtype: float
+        """
+        raise NotImplementedError
+
+    def table(self, group_type):
+        """
+        Gives the alias table of the groups of a group type (built once).
+
+        :param group_type: the group type considered
+        :type group_type: GroupType
+        :rtype: AliasTable
+        """
+        if group_type not in self._tables:
+            self._tables[group_type] = AliasTable(
+                [self.group_weight(group) for group in self.pool.groups[group_type]]
+            )
+        return self._tables[group_type]
+
+    def sample(self, group_type, rng):
+        group = self.pool.groups[group_type][self.table(group_type).draw(rng)]
+        return group.ideas[rng.randrange(len(group.ideas))]
+
+    def weights(self, group_type):
+        if group_type not in self._weights:
+            self._weights[group_type] = self.ideas_weights(
+                self.pool.groups[group_type],
+                [self.group_weight(group) for group in self.pool.groups[group_type]],
+            )
+        return self._weights[group_type]
+
+    @staticmethod
+    def ideas_weights(groups, groups_weights):
+        # an idea of several groups gets a share of the weight of each
+        weights = {}
+        total = sum(groups_weights) or 1
+        for group, group_weight in zip(groups, groups_weights):
+            share = group_weight / total / len(group.ideas)
+            for idea_id in group.ideas:
+                weights[idea_id] = weights.get(idea_id, 0) + share
+        return weights
+
+
+@register("stratified")
+class StratifiedStrategy(GroupsStrategy):
+    """
+    Draws a group of the group type uniformly, then one of its ideas, so that
+    every group is selected as often whatever its size.
+    """
+
+    def group_weight(self, group):
+        return 1
+
+
+@register("weighted")
+class WeightedStrategy(GroupsStrategy):
+    """
+    Draws a group of the group type with a probability proportional to its weight
+    in the experiment (``ExperimentGroups.weight``), then one of its ideas.
+    """
+
+    def group_weight(self, group):
+        return group.weight
+
+
+@register("bandit")
+class BanditStrategy(GroupsStrategy):
+    """
+    Draws the group of the group type by Thompson sampling, the reward of a group
+    being the CONTINUE reactions on its ideas (read from the summaries of the
+    experiment every ``BANDIT_REFRESH`` seconds): the groups inspiring the
+    participants are selected more often while the others keep being explored.
+    """
+
+    def __init__(self, pool):
+        self._statistics = {}
+        self._statistics_time = None
+        super().__init__(pool)
+
+    def statistics(self):
+        """
+        Gives the number of CONTINUE reactions and of other reactions on the
+        ideas of each group.
+
+        :return: the successes and failures by group id
+        :rtype: dict of int to tuple of int
+        """
+        now = time.monotonic()
+        if self._statistics_time is not None and (
+            now - self._statistics_time < BANDIT_REFRESH
+        ):
+            return self._statistics
+        ideas = {}
+        if self.pool.experiment_id is not None:
+            ideas = {
+                idea_id: (successes, total - successes)
+                for idea_id, successes, total in models.IdeaSummary.objects.filter(
+                    experiment_id=self.pool.experiment_id
+                )
+                .annotate(
+                    successes=F("continue_fixation") + F("continue_expansion"),
+                    total=F("continue_fixation")
+                    + F("continue_expansion")
+                    + F("expand_fixation")
+                    + F("expand_expansion")
+                    + F("neutral_fixation")
+                    + F("neutral_expansion"),
+                )
+                .values_list("idea_id", "successes", "total")
+            }
+        statistics = {}
+        for groups in self.pool.groups.values():
+            for group in groups:
+                successes = failures = 0
+                for idea_id in group.ideas:
+                    idea_successes, idea_failures = ideas.get(idea_id, (0, 0))
+                    successes += idea_successes
+                    failures += idea_failures
+                statistics[group.id] = (successes, failures)
+        self._statistics, self._statistics_time = statistics, now
+        return statistics
+
+    def group_weight(self, group):
+        # the mean of the posterior, used when drawing among the ideas remaining
+        successes, failures = self.statistics().get(group.id, (0, 0))
+        return (successes + 1) / (successes + failures + 2)
+
+    def sample(self, group_type, rng):
+        statistics = self.statistics()
+        groups = self.pool.groups[group_type]
+        scores = [
+            rng.betavariate(successes + 1, failures + 1)
+            for successes, failures in (
+                statistics.get(group.id, (0, 0)) for group in groups
+            )
+        ]
+        group = groups[scores.index(max(scores))]
+        return group.ideas[rng.randrange(len(group.ideas))]
+
+    def weights(self, group_type):
+        # the statistics change: the weights are not kept
+        groups = self.pool.groups[group_type]
+        return self.ideas_weights(
+            groups, [self.group_weight(group) for group in groups]
+        )
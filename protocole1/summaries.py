@@ -0,0 +1,211 @@
+"""
+Summaries of the reactions on the experiments.
+
+The summaries (ExperimentSummary, IdeaSummary, StepSummary and ExpansionRateBin)
+are updated incrementally along the participation of the users, so that the
+results pages do not need to go through all the reactions. ``rebuild_summaries``
+computes them again from the reactions (see the rebuild_summaries command).
+
+The reactions of an experiment are not counted on its ExperimentSummary, which
+every participant would update, but summed from its steps when read.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from protocole1 import models, results_cache
+
+
+def _increment(model, lookup, **deltas):
+    """
+    Increments fields of a summary, creating it if it does not exist yet.
+
+    :param model: the model of the summary
+    :type model: Model class
+    :param lookup: the fields identifying the summary
+    :type lookup: dict
+    :param deltas: the increments by field
+    :type deltas: dict
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # created meanwhile by another request
+        model.objects.filter(**lookup).update(**updates)
+
+
+def count_result(result):
+    """
+    Counts a new participation to an experiment.
+
+    :param result: the result created
+    :type result: Result
+    """
+    _increment(
+        models.ExperimentSummary,
+        {"experiment_id": result.experiment_id},
+        results_count=1,
+    )
+    _increment(
+        models.ExpansionRateBin,
+        {
+            "experiment_id": result.experiment_id,
+            "bin": models.ExpansionRateBin.bin_of(result.expansion_rate),
+        },
+        results_count=1,
+    )
+
+
+def count_reaction(result, result_on_idea, previous_expansion_rate):
+    """
+    Counts a reaction of a user.
+
+    :param result: the result of the user, with its expansion rate updated
+    :type result: Result
+    :param result_on_idea: the idea reacted to, with the reaction
+    :type result_on_idea: ResultOnIdea
+    :param previous_expansion_rate: the expansion rate before the reaction
+    :type previous_expansion_rate: float
+    """
+    field = models.ReactionsCounts.count_field(
+        result_on_idea.did_expand, models.Reactions(result_on_idea.reaction)
+    )
+    # the reactions of the experiment are summed from its steps, rather than
+    # counted on one row updated by all the participants
+    _increment(
+        models.IdeaSummary,
+        {"experiment_id": result.experiment_id, "idea_id": result_on_idea.idea_id},
+        **{field: 1}
+    )
+    _increment(
+        models.StepSummary,
+        {"experiment_id": result.experiment_id, "order": result_on_idea.order},
+        expansion_rate_sum=result_on_idea.expansion_rate,
+        **{field: 1}
+    )
+
+    previous_bin = models.ExpansionRateBin.bin_of(previous_expansion_rate)
+    new_bin = models.ExpansionRateBin.bin_of(result.expansion_rate)
+    if previous_bin != new_bin:
+        models.ExpansionRateBin.objects.filter(
+            experiment_id=result.experiment_id, bin=previous_bin, results_count__gt=0
+        ).update(results_count=F("results_count") - 1)
+        _increment(
+            models.ExpansionRateBin,
+            {"experiment_id": result.experiment_id, "bin": new_bin},
+            results_count=1,
+        )
+
+
+@transaction.atomic
+def rebuild_summaries(experiment):
+    """
+    Computes again the summaries of an experiment from the reactions.
+
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    """
+    models.ExperimentSummary.objects.filter(experiment=experiment).delete()
+    models.IdeaSummary.objects.filter(experiment=experiment).delete()
+    models.StepSummary.objects.filter(experiment=experiment).delete()
+    models.ExpansionRateBin.objects.filter(experiment=experiment).delete()
+
+    # the ideas waiting for a reaction are not counted
+    reactions_ideas = models.ResultOnIdea.objects.filter(
+        result__experiment=experiment,
+        reaction__gt=models.Reactions.UNDEFINED.value,
+    ).order_by()
+
+    models.ExperimentSummary.objects.create(
+        experiment=experiment,
+        results_count=models.Result.objects.filter(experiment=experiment).count(),
+    )
+
+    ideas_summaries = {}
+    for idea_id, did_expand, reaction, count in reactions_ideas.values_list(
+        "idea_id", "did_expand", "reaction"
+    ).annotate(count=Count("pk")):
+        if idea_id is None:
+            continue
+        if idea_id not in ideas_summaries:
+            ideas_summaries[idea_id] = models.IdeaSummary(
+                experiment=experiment, idea_id=idea_id
+            )
+        field = models.ReactionsCounts.count_field(
+            did_expand, models.Reactions(reaction)
+        )
+        setattr(ideas_summaries[idea_id], field, count)
+    models.IdeaSummary.objects.bulk_create(ideas_summaries.values())
+
+    steps_summaries = {}
+    for (
+        order,
+        did_expand,
+        reaction,
+        count,
+        expansion_rate_sum,
+    ) in reactions_ideas.values_list("order", "did_expand", "reaction").annotate(
+        count=Count("pk"), expansion_rate_sum=Sum("expansion_rate")
+    ):
+        if order not in steps_summaries:
+            steps_summaries[order] = models.StepSummary(
+                experiment=experiment, order=order
+            )
+        field = models.ReactionsCounts.count_field(
+            did_expand, models.Reactions(reaction)
+        )
+        setattr(steps_summaries[order], field, count)
+        steps_summaries[order].expansion_rate_sum += expansion_rate_sum
+    models.StepSummary.objects.bulk_create(steps_summaries.values())
+
+    bins = Counter(
+        models.ExpansionRateBin.bin_of(expansion_rate)
+        for expansion_rate in models.Result.objects.filter(experiment=experiment)
+        .values_list("expansion_rate", flat=True)
+        .iterator()
+    )
+    models.ExpansionRateBin.objects.bulk_create(
+        models.ExpansionRateBin(experiment=experiment, bin=bin, results_count=count)
+        for bin, count in bins.items()
+    )
+    results_cache.bump_version(experiment.pk)
+
+
+def experiment_summary(experiment):
+    """
+    Gives the summaries of an experiment.
+
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :return: the summary of the experiment (None if no one participated yet: its
+            number of participants and its reactions, summed from its steps),
+            the summaries of its ideas, its steps and its expansion rate bins
+    :rtype: dict
+    """
+    summary = models.ExperimentSummary.objects.filter(experiment=experiment).first()
+    steps_summaries = list(models.StepSummary.objects.filter(experiment=experiment))
+    if summary is not None:
+        counts = {
+            field: sum(getattr(step, field) for step in steps_summaries)
+            for field in models.ReactionsCounts.count_fields()
+        }
+        summary = dict(
+            counts,
+            results_count=summary.results_count,
+            reactions_count=sum(counts.values()),
+        )
+    return {
+        "summary": summary,
+        "ideas_summaries": models.IdeaSummary.objects.select_related("idea").filter(
+            experiment=experiment
+        ),
+        "steps_summaries": steps_summaries,
+        "expansion_rate_bins": models.ExpansionRateBin.objects.filter(
+            experiment=experiment, results_count__gt=0
+        ),
+    }
@@ -4,6 +4,9 @@ from protocole1.models import Reactions
 
 register = template.Library()
 
+# The names of the reactions by value
+REACTION_NAMES = {reaction.value: reaction.name for reaction in Reactions}
+
 
 @register.filter
 def get_item(dictionary, key):
@@ -15,4 +18,4 @@ def get_item(dictionary, key):
 
 @register.filter
 def conv_reaction(reaction):
-    return str(Reactions(reaction).name)
+    return REACTION_NAMES[reaction]
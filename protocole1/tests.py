@@ -1,3 +1,1555 @@
-from django.test import TestCase
+"""
+Query budgets of the views.
 
-# Create your tests here.
+The views are requested on fixtures of increasing size (10, 100 and 1000 ideas,
+participants and experiments, with histories as long as half the pool) which
+all have the same shape, so the number of SQL queries of each view must be the
+same whatever the size: ``QUERY_BUDGETS`` pins it down.
+
+The simulation of the experiments must follow the algorithm of the models and
+the selection strategies must draw the ideas not used with their distribution.
+The concurrent participations run on a SQLite database file in another process,
+the test database being in memory.
+"""
+
+import csv
+import gzip
+import os
+import io
+import json
+import multiprocessing
+import pstats
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core import signing
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from protocole1 import (
+    analysis,
+    export,
+    journal,
+    metrics,
+    models,
+    pools,
+    profiling,
+    results_cache,
+    simulation,
+    slow_queries,
+    strategies,
+    summaries,
+    views,
+)
+
+# The number of queries of each view (and branch of the participation), with a
+# logged in user (2 queries for the session and the user)
+QUERY_BUDGETS = {
+    "homepage": 3,
+    "participate_first_visit": 13,
+    "participate_pending": 5,
+    "participate_react": 13,
+    "participate_next": 9,
+    "participate_finish": 6,
+    "participate_finished": 4,
+    "react": 18,
+    "react_speculated": 18,
+    "results": 9,
+    "results_cached": 3,
+    "results_stats": 4,
+}
+
+
+class ExperimentFixtureMixin:
+    """
+    A running experiment with one group of ``ideas_count`` ideas by group type,
+    the caches being cleared before each test.
+    """
+
+    ideas_count = 3
+    idea_value = "%s %s"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+        for group_type in models.GroupType:
+            name = group_type.name.lower()
+            group = models.IdeasGroup.objects.create(name=name)
+            group.ideas.add(
+                *(
+                    models.Idea.objects.create(value=cls.idea_value % (name, index))
+                    for index in range(cls.ideas_count)
+                )
+            )
+            models.ExperimentGroups.objects.create(
+                experiment=cls.experiment,
+                group=group,
+                group_type_here=group_type.value,
+            )
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        pools.invalidate_pool()
+
+
+class QueryBudgetMixin:
+    """
+    The tests of the query budgets, on a fixture of ``size`` ideas, participants
+    and experiments.
+
+    The user "user" participated to every experiment, his participation to the
+    main experiment being half-way (an idea waiting for his reaction), "exhausted"
+    saw every idea of the fixation group and "newcomer" never participated.
+    """
+
+    size = None
+
+    @classmethod
+    def setUpTestData(cls):
+        fixation_count = cls.size // 2
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+        models.Experiment.objects.bulk_create(
+            models.Experiment(name="Experiment %s" % index, running=True)
+            for index in range(cls.size - 1)
+        )
+
+        # The pool of ideas
+        ideas = {}
+        for group_type, count in (
+            (models.GroupType.FIXATION, fixation_count),
+            (models.GroupType.EXPANSION, cls.size - fixation_count),
+        ):
+            name = group_type.name.lower()
+            models.Idea.objects.bulk_create(
+                models.Idea(value="%s %s" % (name, index)) for index in range(count)
+            )
+            ideas[group_type] = list(
+                models.Idea.objects.filter(value__startswith=name).order_by("pk")
+            )
+            group = models.IdeasGroup.objects.create(name=name)
+            group.ideas.add(*ideas[group_type])
+            models.ExperimentGroups.objects.create(
+                experiment=cls.experiment,
+                group=group,
+                group_type_here=group_type.value,
+            )
+        fixation = ideas[models.GroupType.FIXATION]
+        expansion = ideas[models.GroupType.EXPANSION]
+
+        # The users
+        User.objects.bulk_create(
+            User(username=username, password=make_password(None))
+            for username in ["user", "exhausted", "newcomer"]
+            + ["participant %s" % index for index in range(cls.size)]
+        )
+        cls.user = User.objects.get(username="user")
+        cls.exhausted = User.objects.get(username="exhausted")
+        cls.newcomer = User.objects.get(username="newcomer")
+
+        # The results of the users
+        models.Result.objects.bulk_create(
+            [
+                models.Result(
+                    user=cls.user,
+                    experiment=cls.experiment,
+                    expansion_rate=0.5,
+                    reactions_count=fixation_count,
+                    pending=True,
+                ),
+                models.Result(
+                    user=cls.exhausted,
+                    experiment=cls.experiment,
+                    reactions_count=fixation_count,
+                ),
+            ]
+            + [
+                models.Result(user=user, experiment=cls.experiment, reactions_count=2)
+                for user in User.objects.filter(username__startswith="participant")
+            ]
+            + [
+                models.Result(user=cls.user, experiment=experiment, finished=True)
+                for experiment in models.Experiment.objects.exclude(
+                    pk=cls.experiment.pk
+                )
+            ]
+        )
+        results = {
+            result.user.username: result
+            for result in models.Result.objects.select_related("user").filter(
+                experiment=cls.experiment
+            )
+        }
+
+        # The histories of the users
+        reactions_ideas = [
+            models.ResultOnIdea(
+                result=results["user"],
+                idea=idea,
+                order=order,
+                reaction=models.Reactions.NEUTRAL.value,
+                expansion_rate=0.5,
+            )
+            for order, idea in enumerate(fixation[:-1])
+        ]
+        reactions_ideas.append(
+            models.ResultOnIdea(
+                result=results["user"],
+                idea=expansion[0],
+                order=fixation_count - 1,
+                did_expand=True,
+                reaction=models.Reactions.UNDEFINED.value,
+            )
+        )
+        reactions_ideas.extend(
+            models.ResultOnIdea(
+                result=results["exhausted"],
+                idea=idea,
+                order=order,
+                reaction=models.Reactions.NEUTRAL.value,
+            )
+            for order, idea in enumerate(fixation)
+        )
+        for index in range(cls.size):
+            result = results["participant %s" % index]
+            reactions_ideas.append(
+                models.ResultOnIdea(
+                    result=result,
+                    idea=expansion[index % len(expansion)],
+                    order=0,
+                    did_expand=True,
+                    reaction=models.Reactions.CONTINUE.value,
+                    expansion_rate=0.25,
+                )
+            )
+            reactions_ideas.append(
+                models.ResultOnIdea(
+                    result=result,
+                    idea=fixation[index % len(fixation)],
+                    order=1,
+                    reaction=models.Reactions.UNDEFINED.value,
+                )
+            )
+        models.ResultOnIdea.objects.bulk_create(reactions_ideas)
+        models.Result.objects.filter(experiment=cls.experiment).update(
+            last_result_on_idea=Subquery(
+                models.ResultOnIdea.objects.filter(result=OuterRef("pk"))
+                .order_by("-order")
+                .values("pk")[:1]
+            )
+        )
+        summaries.rebuild_summaries(cls.experiment)
+
+    def setUp(self):
+        cache.clear()
+        # the pool is loaded by the first request of a process
+        pools.invalidate_pool()
+        pools.get_pool(self.experiment.id)
+
+    def assertBudget(self, budget, method, url, data=None, user=None):
+        self.client.force_login(user or self.user)
+        with self.assertNumQueries(QUERY_BUDGETS[budget]):
+            response = getattr(self.client, method)(url, data or {})
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return response
+
+    @property
+    def participate_url(self):
+        return reverse("protocole1.participate_experiment", args=[self.experiment.id])
+
+    def test_homepage(self):
+        response = self.assertBudget("homepage", "get", reverse("protocole1.homepage"))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(PROTOCOLE1_STATUS_CACHE="default")
+    def test_homepage_cached(self):
+        self.assertBudget("homepage", "get", reverse("protocole1.homepage"))
+        # the status of the user is cached
+        self.assertBudget("homepage", "get", reverse("protocole1.homepage"))
+        self.test_homepage_statuses()
+
+    def test_homepage_statuses(self):
+        self.client.force_login(self.exhausted)
+        response = self.client.get(reverse("protocole1.homepage"))
+        self.assertContains(response, self.participate_url)
+        self.client.get(self.participate_url)
+        response = self.client.get(reverse("protocole1.homepage"))
+        self.assertNotContains(response, self.participate_url)
+
+    def test_participate_first_visit(self):
+        response = self.assertBudget(
+            "participate_first_visit", "get", self.participate_url, user=self.newcomer
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_participation_twice(self):
+        state = views.create_participation(self.experiment, self.user)
+        self.assertEqual(state.reactions_count, self.size // 2)
+        self.assertEqual(
+            models.Result.objects.filter(
+                experiment=self.experiment, user=self.user
+            ).count(),
+            1,
+        )
+
+    def test_create_next_idea_twice(self):
+        pool = pools.get_pool(self.experiment.id)
+        state = views.create_participation(self.experiment, self.newcomer)
+        concurrent = views.load_participation_state(self.experiment, self.newcomer)
+        next_idea = views.pick_next_idea(self.experiment, pool, state)
+        # the idea proposed by the concurrent request is used
+        self.assertEqual(
+            views.pick_next_idea(self.experiment, pool, concurrent), next_idea
+        )
+        self.assertEqual(concurrent.last_result.pk, state.last_result.pk)
+        self.assertEqual(
+            models.Result.objects.get(pk=state.result.pk).reactions_count, 1
+        )
+
+    def test_participate_pending(self):
+        response = self.assertBudget("participate_pending", "get", self.participate_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "expansion 0")
+
+    def test_participate_react(self):
+        response = self.assertBudget(
+            "participate_react", "get", self.participate_url, {"reaction": 1}
+        )
+        self.assertRedirects(response, self.participate_url, target_status_code=200)
+
+    def test_participate_next(self):
+        result = models.Result.objects.get(experiment=self.experiment, user=self.user)
+        models.ResultOnIdea.objects.filter(pk=result.last_result_on_idea_id).update(
+            reaction=models.Reactions.CONTINUE.value
+        )
+        models.Result.objects.filter(pk=result.pk).update(pending=False)
+        response = self.assertBudget("participate_next", "get", self.participate_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            models.ResultOnIdea.objects.filter(result=result).count(),
+            self.size // 2 + 1,
+        )
+
+    def test_participate_finish(self):
+        response = self.assertBudget(
+            "participate_finish", "get", self.participate_url, user=self.exhausted
+        )
+        self.assertRedirects(response, reverse("protocole1.homepage"))
+        self.assertTrue(
+            models.Result.objects.get(
+                experiment=self.experiment, user=self.exhausted
+            ).finished
+        )
+
+    def test_participate_finished(self):
+        models.Result.objects.filter(
+            experiment=self.experiment, user=self.exhausted
+        ).update(finished=True)
+        response = self.assertBudget(
+            "participate_finished", "get", self.participate_url, user=self.exhausted
+        )
+        self.assertRedirects(response, reverse("protocole1.homepage"))
+
+    def test_react(self):
+        response = self.assertBudget(
+            "react",
+            "post",
+            reverse("protocole1.react_experiment", args=[self.experiment.id]),
+            {"reaction": 1},
+        )
+        self.assertFalse(response.json()["finished"])
+        # one request instead of the reaction and the reload of the page
+        self.assertLess(
+            QUERY_BUDGETS["react"],
+            QUERY_BUDGETS["participate_react"] + QUERY_BUDGETS["participate_next"],
+        )
+
+    def test_react_speculated(self):
+        state = views.load_participation_state(self.experiment, self.user)
+        speculation = views.speculate_next_steps(
+            self.experiment, pools.get_pool(self.experiment.id), state
+        )
+        response = self.assertBudget(
+            "react_speculated",
+            "post",
+            reverse("protocole1.react_experiment", args=[self.experiment.id]),
+            {"reaction": 1, "speculation": speculation["token"]},
+        )
+        steps = signing.loads(speculation["token"], salt=views.SPECULATION_SALT)
+        self.assertEqual(response.json()["idea"]["id"], steps["steps"]["1"][0])
+
+    def test_results(self):
+        response = self.assertBudget(
+            "results",
+            "get",
+            reverse("protocole1.results_experiment", args=[self.experiment.id]),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(PROTOCOLE1_RESULTS_CACHE="default")
+    def test_results_cached(self):
+        url = reverse("protocole1.results_experiment", args=[self.experiment.id])
+        self.assertBudget("results", "get", url)
+        page = self.assertBudget("results_cached", "get", url).content
+        self.assertContains(self.client.get(url), "Experiment")
+        # a reaction changes the version of the results
+        self.client.get(self.participate_url, {"reaction": 1})
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertNotEqual(b"".join(response.streaming_content), page)
+
+    @override_settings(
+        PROTOCOLE1_RESULTS_CACHE="default", PROTOCOLE1_RESULTS_CACHE_MAX_PAGE_SIZE=100
+    )
+    def test_results_too_large(self):
+        url = reverse("protocole1.results_experiment", args=[self.experiment.id])
+        self.client.force_login(self.user)
+        page = b"".join(self.client.get(url).streaming_content)
+        # only the fragments are cached
+        self.assertIsNone(results_cache.get_page(self.experiment.id)[1])
+        self.assertTrue(results_cache.get_fragments(models.Result.objects.all()))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content), page)
+
+    @unittest.skipIf(analysis.np is None, "NumPy is not installed")
+    def test_results_stats(self):
+        response = self.assertBudget(
+            "results_stats",
+            "get",
+            reverse("protocole1.results_experiment_stats", args=[self.experiment.id]),
+        )
+        self.assertEqual(
+            response.json()["reactions_count"], self.size // 2 * 2 - 1 + self.size
+        )
+
+
+class QueryBudget10Tests(QueryBudgetMixin, TestCase):
+    size = 10
+
+
+class QueryBudget100Tests(QueryBudgetMixin, TestCase):
+    size = 100
+
+
+class QueryBudget1000Tests(QueryBudgetMixin, TestCase):
+    size = 1000
+
+
+@unittest.skipIf(simulation.np is None, "NumPy is not installed")
+class SimulationTests(SimpleTestCase):
+    def test_next_expansion_rates(self):
+        np = simulation.np
+        rates = np.repeat(np.linspace(-0.05, 1.05, 23), 2 * len(models.Reactions))
+        did_expand = np.tile(np.repeat([False, True], len(models.Reactions)), 23)
+        reactions = np.tile([reaction.value for reaction in models.Reactions], 46)
+        expected = [
+            models.next_expansion_rate(rate, expand, models.Reactions(reaction))
+            for rate, expand, reaction in zip(rates, did_expand, reactions)
+        ]
+        np.testing.assert_array_equal(
+            simulation.next_expansion_rates(rates, did_expand, reactions), expected
+        )
+
+    def test_simulate(self):
+        result = simulation.simulate(
+            1000, 10, 5, limit_ideas_number=8, seed=0, chunk_size=300
+        )
+        self.assertEqual(result.rate_bins.sum(), 1000)
+        self.assertEqual(result.lengths.sum(), 1000)
+        self.assertEqual(len(result.lengths), 9)
+        self.assertEqual(result.lengths[:5].sum(), 0)
+        self.assertEqual(
+            sum(seen.sum() for seen in result.ideas_seen.values()),
+            (result.lengths * range(9)).sum(),
+        )
+
+
+class StrategiesTests(SimpleTestCase):
+    def setUp(self):
+        fixation = models.GroupType.FIXATION
+        expansion = models.GroupType.EXPANSION
+        # a fixation group of 1 idea (weight 3) and one of 9 ideas (weight 1)
+        self.pool = pools.IdeaPool(
+            {fixation: tuple(range(10)), expansion: (10, 11)},
+            {idea_id: str(idea_id) for idea_id in range(12)},
+            groups={
+                fixation: (
+                    pools.PoolGroup(1, 3, (0,)),
+                    pools.PoolGroup(2, 1, tuple(range(1, 10))),
+                ),
+                expansion: (pools.PoolGroup(3, 1, (10, 11)),),
+            },
+        )
+        self.rng = random.Random(0)
+
+    def draw_first_group(self, strategy, draws=4000):
+        remaining = pools.RemainingIdeas(self.pool, set(), self.rng, strategy)
+        return (
+            sum(
+                remaining.draw(models.GroupType.FIXATION, consume=False).id == 0
+                for _ in range(draws)
+            )
+            / draws
+        )
+
+    def test_alias_table(self):
+        table = strategies.AliasTable([1, 0, 3])
+        counts = Counter(table.draw(self.rng) for _ in range(4000))
+        self.assertEqual(counts[1], 0)
+        self.assertAlmostEqual(counts[2] / 4000, 0.75, delta=0.03)
+
+    def test_strategies_distributions(self):
+        self.assertAlmostEqual(self.draw_first_group("uniform"), 0.1, delta=0.03)
+        self.assertAlmostEqual(self.draw_first_group("stratified"), 0.5, delta=0.03)
+        self.assertAlmostEqual(self.draw_first_group("weighted"), 0.75, delta=0.03)
+        self.assertAlmostEqual(self.draw_first_group("bandit"), 0.5, delta=0.03)
+
+    def test_draw_until_exhausted(self):
+        for name in strategies.STRATEGIES:
+            remaining = pools.RemainingIdeas(self.pool, {0, 1}, self.rng, name)
+            drawn = {remaining.draw(models.GroupType.FIXATION).id for _ in range(8)}
+            self.assertEqual(drawn, set(range(2, 10)))
+            self.assertTrue(remaining.is_exhausted())
+            with self.assertRaises(IndexError):
+                remaining.draw(models.GroupType.FIXATION)
+
+
+class RemainingIdeasTests(SimpleTestCase):
+    def setUp(self):
+        fixation = models.GroupType.FIXATION
+        expansion = models.GroupType.EXPANSION
+        # the idea 2 is shared by the groups of both types
+        self.pool = pools.IdeaPool(
+            {fixation: (0, 1, 2), expansion: (2, 3)},
+            {idea_id: str(idea_id) for idea_id in range(4)},
+        )
+        self.rng = random.Random(0)
+
+    def remaining(self, used_ideas):
+        return pools.RemainingIdeas(self.pool, set(used_ideas), self.rng)
+
+    def test_counts(self):
+        fixation = models.GroupType.FIXATION
+        expansion = models.GroupType.EXPANSION
+        self.assertEqual(self.remaining([]).counts, {fixation: 3, expansion: 2})
+        self.assertEqual(self.remaining([0]).counts, {fixation: 2, expansion: 2})
+        # the shared idea used is not available in both types anymore
+        remaining = self.remaining([2])
+        self.assertEqual(remaining.counts, {fixation: 2, expansion: 1})
+        self.assertEqual(remaining[fixation], [0, 1])
+        self.assertEqual(remaining[expansion], [3])
+        # and the same when it is drawn
+        remaining = self.remaining([0, 1])
+        self.assertEqual(remaining.draw(fixation).id, 2)
+        self.assertEqual(remaining.counts, {fixation: 0, expansion: 1})
+        # an idea selected in advance is used without being drawn
+        remaining.use(3)
+        self.assertEqual(remaining.counts, {fixation: 0, expansion: 0})
+
+    def test_is_exhausted(self):
+        self.assertFalse(self.remaining([]).is_exhausted())
+        self.assertFalse(self.remaining([0, 1]).is_exhausted())
+        self.assertTrue(self.remaining([2, 3]).is_exhausted())
+        self.assertTrue(self.remaining([0, 1, 2]).is_exhausted())
+
+    def test_draw_without_consuming(self):
+        remaining = self.remaining([0])
+        counts = dict(remaining.counts)
+        for _ in range(20):
+            self.assertIn(
+                remaining.draw(models.GroupType.FIXATION, consume=False).id, (1, 2)
+            )
+        self.assertEqual(remaining.counts, counts)
+        self.assertEqual(remaining.drawn_ideas, set())
+
+    def test_draw_when_exhausted(self):
+        remaining = self.remaining([2])
+        self.assertEqual(remaining.draw(models.GroupType.EXPANSION).id, 3)
+        self.assertTrue(remaining.is_exhausted())
+        with self.assertRaises(IndexError):
+            remaining.draw(models.GroupType.EXPANSION)
+        with self.assertRaises(IndexError):
+            self.remaining([2, 3]).draw(models.GroupType.EXPANSION, consume=False)
+
+
+class PoolInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        pools.invalidate_pool()
+        self.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+        self.other_experiment = models.Experiment.objects.create(
+            name="Other", running=True
+        )
+        self.group = models.IdeasGroup.objects.create(name="fixation")
+        self.idea = models.Idea.objects.create(value="idea")
+        self.other_idea = models.Idea.objects.create(value="other idea")
+        self.group.ideas.add(self.idea)
+        self.experiment_group = models.ExperimentGroups.objects.create(
+            experiment=self.experiment,
+            group=self.group,
+            group_type_here=models.GroupType.FIXATION.value,
+        )
+
+    def pool_ideas(self, experiment=None):
+        pool = pools.get_pool((experiment or self.experiment).id)
+        return {
+            pool.values[idea_id] for idea_id in pool.ideas[models.GroupType.FIXATION]
+        }
+
+    def test_group_ideas(self):
+        self.assertEqual(self.pool_ideas(), {"idea"})
+        self.group.ideas.add(self.other_idea)
+        self.assertEqual(self.pool_ideas(), {"idea", "other idea"})
+        self.group.ideas.remove(self.idea)
+        self.assertEqual(self.pool_ideas(), {"other idea"})
+        self.group.ideas.clear()
+        self.assertEqual(self.pool_ideas(), set())
+
+    def test_idea_groups(self):
+        self.assertEqual(self.pool_ideas(), {"idea"})
+        self.other_idea.groups.add(self.group)
+        self.assertEqual(self.pool_ideas(), {"idea", "other idea"})
+        self.idea.groups.remove(self.group)
+        self.assertEqual(self.pool_ideas(), {"other idea"})
+        self.other_idea.groups.clear()
+        self.assertEqual(self.pool_ideas(), set())
+
+    def test_experiment_groups(self):
+        self.assertEqual(self.pool_ideas(), {"idea"})
+        self.assertEqual(self.pool_ideas(self.other_experiment), set())
+        # the group is moved to another experiment
+        self.experiment_group.experiment = self.other_experiment
+        self.experiment_group.save()
+        self.assertEqual(self.pool_ideas(), set())
+        self.assertEqual(self.pool_ideas(self.other_experiment), {"idea"})
+        self.experiment_group.delete()
+        self.assertEqual(self.pool_ideas(self.other_experiment), set())
+
+    def test_idea(self):
+        self.assertEqual(self.pool_ideas(), {"idea"})
+        self.idea.value = "renamed idea"
+        self.idea.save()
+        self.assertEqual(self.pool_ideas(), {"renamed idea"})
+        self.idea.delete()
+        self.assertEqual(self.pool_ideas(), set())
+
+
+class ResultsPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+        cls.user = User.objects.create_user("user")
+        ideas = [
+            models.Idea.objects.create(value="idea %s" % index) for index in range(3)
+        ]
+        reactions = {"alice": [0, 1], "bob": [], "carol": [2]}
+        for username, indexes in reactions.items():
+            result = models.Result.objects.create(
+                user=User.objects.create_user(username),
+                experiment=cls.experiment,
+                expansion_rate=0.2,
+            )
+            # the reactions are created in the reverse order of the steps
+            for order, index in reversed(list(enumerate(indexes))):
+                models.ResultOnIdea.objects.create(
+                    result=result,
+                    idea=ideas[index],
+                    order=order,
+                    did_expand=False,
+                    reaction=models.Reactions.CONTINUE.value,
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse("protocole1.results_experiment", args=[self.experiment.id])
+
+    def page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return b"".join(response.streaming_content)
+        return response.content
+
+    def test_rows(self):
+        rows = re.findall(
+            r"<p>(Result of \w+) on .*?</p>|<em>(Idea [^<]*)</em>",
+            self.page().decode(),
+        )
+        self.assertEqual(
+            [result or idea for result, idea in rows],
+            [
+                "Result of alice",
+                "Idea idea 0",
+                "Idea idea 1",
+                "Result of bob",
+                "Result of carol",
+                "Idea idea 2",
+            ],
+        )
+
+    def test_cached_page(self):
+        page = self.page()
+        with self.settings(PROTOCOLE1_RESULTS_CACHE="default"):
+            self.assertEqual(self.page(), page)
+            response = self.client.get(self.url)
+            # the page is read from the cache
+            self.assertFalse(response.streaming)
+            self.assertEqual(response.content, page)
+
+    def test_deleted_result(self):
+        with self.settings(PROTOCOLE1_RESULTS_CACHE="default"):
+            page = self.page()
+            results = models.Result.objects.filter(experiment=self.experiment)
+            # the steps of the results deleted do not query their experiment
+            with CaptureQueriesContext(connection) as two_steps:
+                results.get(user__username="alice").delete()
+            with CaptureQueriesContext(connection) as one_step:
+                results.get(user__username="carol").delete()
+            self.assertEqual(len(two_steps), len(one_step))
+            self.assertNotEqual(self.page(), page)
+
+
+class ParticipationLinksTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+
+    def create_participants(self, *args):
+        stdout = io.StringIO()
+        call_command("create_participants", *args, stdout=stdout, stderr=io.StringIO())
+        return list(csv.DictReader(io.StringIO(stdout.getvalue())))
+
+    def test_create_participants(self):
+        rows = self.create_participants("3", "--processes", "1")
+        self.assertEqual(
+            [row["username"] for row in rows],
+            ["participant-1", "participant-2", "participant-3"],
+        )
+        self.assertTrue(
+            User.objects.get(username="participant-2").check_password(
+                rows[1]["password"]
+            )
+        )
+        # the existing participants are skipped
+        rows = self.create_participants("4", "--no-password")
+        self.assertEqual([row["username"] for row in rows], ["participant-4"])
+        self.assertFalse(
+            User.objects.get(username="participant-4").has_usable_password()
+        )
+
+    def test_create_participants_spawned(self):
+        # the processes of the pool start a new interpreter, as on Windows and
+        # macOS
+        with mock.patch.object(
+            multiprocessing, "Pool", multiprocessing.get_context("spawn").Pool
+        ):
+            rows = self.create_participants("2", "--processes", "2")
+        self.assertTrue(
+            User.objects.get(username="participant-2").check_password(
+                rows[1]["password"]
+            )
+        )
+
+    def test_participation_link(self):
+        rows = self.create_participants(
+            "1", "--no-password", "--experiment", str(self.experiment.id)
+        )
+        participate_url = reverse(
+            "protocole1.participate_experiment", args=[self.experiment.id]
+        )
+        response = self.client.get(rows[0]["link"])
+        self.assertRedirects(response, participate_url, fetch_redirect_response=False)
+        self.assertEqual(
+            int(self.client.session["_auth_user_id"]),
+            User.objects.get(username="participant-1").pk,
+        )
+        self.assertEqual(self.client.get(rows[0]["link"][:-2] + "x/").status_code, 404)
+
+    def test_participation_link_staff(self):
+        staff = User.objects.create_user("staff", is_staff=True)
+        token = views.participation_token(staff, self.experiment)
+        response = self.client.get(
+            reverse("protocole1.participate_with_token", args=[token])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class SpeculationTests(ExperimentFixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user("user")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.react_url = reverse(
+            "protocole1.react_experiment", args=[self.experiment.id]
+        )
+        # the first idea is proposed
+        self.client.get(
+            reverse("protocole1.participate_experiment", args=[self.experiment.id])
+        )
+
+    def state(self):
+        return views.load_participation_state(self.experiment, self.user)
+
+    def speculate(self):
+        return views.speculate_next_steps(
+            self.experiment, pools.get_pool(self.experiment.id), self.state()
+        )["token"]
+
+    def react(self, token, reaction=1):
+        with mock.patch.object(
+            views, "pick_next_idea", wraps=views.pick_next_idea
+        ) as pick_next_idea:
+            response = self.client.post(
+                self.react_url, {"reaction": reaction, "speculation": token}
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json(), pick_next_idea.called
+
+    def test_page_does_not_show_next_ideas(self):
+        response = self.client.get(
+            reverse("protocole1.participate_experiment", args=[self.experiment.id])
+        )
+        self.assertEqual(list(response.context["speculation"]), ["token"])
+        pending = self.state().last_result.idea
+        self.assertContains(response, pending.value)
+        for idea in models.Idea.objects.exclude(pk=pending.pk):
+            self.assertNotContains(response, idea.value)
+
+    def test_discarded_branches(self):
+        token = self.speculate()
+        steps = signing.loads(token, salt=views.SPECULATION_SALT)["steps"]
+        # selecting in advance does not use any idea
+        self.assertEqual(self.state().used_ideas, {self.state().last_result.idea_id})
+        answer, picked = self.react(token, models.Reactions.CONTINUE.value)
+        self.assertFalse(picked)
+        self.assertEqual(answer["idea"]["id"], steps["1"][0])
+        used_ideas = self.state().used_ideas
+        self.assertEqual(len(used_ideas), 2)
+        for idea_id, did_expand in steps.values():
+            if idea_id != steps["1"][0]:
+                self.assertNotIn(idea_id, used_ideas)
+
+    def test_forged_token(self):
+        state = self.state()
+        unused = models.Idea.objects.exclude(pk__in=state.used_ideas).first()
+        forged = signing.dumps(
+            {
+                "result_on_idea": state.last_result.pk,
+                "steps": {"1": (unused.id, False)},
+            },
+            salt="forged",
+        )
+        _, picked = self.react(forged)
+        self.assertTrue(picked)
+
+    def test_token_of_previous_step(self):
+        token = self.speculate()
+        self.react(token)
+        # the token is sent again for the next idea
+        _, picked = self.react(token)
+        self.assertTrue(picked)
+        self.assertEqual(len(self.state().used_ideas), 3)
+
+    def test_stale_token(self):
+        state = self.state()
+        token = signing.dumps(
+            {
+                "result_on_idea": state.last_result.pk,
+                "steps": {"1": (state.last_result.idea_id, False)},
+            },
+            salt=views.SPECULATION_SALT,
+        )
+        answer, picked = self.react(token)
+        self.assertTrue(picked)
+        self.assertNotEqual(answer["idea"]["id"], state.last_result.idea_id)
+
+
+class JournalTests(ExperimentFixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user("user")
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROTOCOLE1_WRITE_BEHIND_LOG=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # the journal is flushed by the tests instead of a thread
+        journal._journal = self.journal = journal.ReactionJournal(self.directory)
+        self.addCleanup(setattr, journal, "_journal", None)
+        self.client.force_login(self.user)
+        self.participate_url = reverse(
+            "protocole1.participate_experiment", args=[self.experiment.id]
+        )
+
+    def reactions(self):
+        return list(
+            models.ResultOnIdea.objects.order_by("order").values_list(
+                "reaction", flat=True
+            )
+        )
+
+    def test_write_behind(self):
+        self.client.get(self.participate_url)
+        self.client.get(self.participate_url, {"reaction": 1})
+        self.assertEqual(self.client.get(self.participate_url).status_code, 200)
+        # the reaction is not written yet, but the next idea is proposed
+        self.assertEqual(self.reactions(), [0, 0])
+        self.journal.flush()
+        self.assertEqual(self.reactions(), [1, 0])
+        self.assertTrue(models.Result.objects.get().pending)
+        self.assertEqual(
+            summaries.experiment_summary(self.experiment)["summary"]["reactions_count"],
+            1,
+        )
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_replay(self):
+        self.client.get(self.participate_url)
+        self.client.get(self.participate_url, {"reaction": 1})
+        # the process stops before flushing the journal
+        self.journal.segment.close()
+        journal.ReactionJournal(self.directory).replay()
+        self.assertEqual(self.reactions(), [1])
+        self.assertFalse(models.Result.objects.get().pending)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_replay_at_startup(self):
+        self.client.get(self.participate_url)
+        self.client.get(self.participate_url, {"reaction": 1})
+        # the process stops before flushing the journal
+        self.journal.segment.close()
+        journal._journal = None
+        self.assertIsNone(journal.open_at_startup(["manage.py", "migrate"]))
+        self.assertEqual(self.reactions(), [0])
+        started = journal.open_at_startup(["gunicorn", "feedback.wsgi"])
+        self.addCleanup(started.stop)
+        self.assertEqual(self.reactions(), [1])
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", is_staff=True)
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        pools.invalidate_pool()
+        self.client.force_login(self.staff)
+
+    def test_metrics(self):
+        self.client.get(
+            reverse("protocole1.participate_experiment", args=[self.experiment.id])
+        )
+        response = self.client.get(reverse("metrics"))
+        self.assertContains(
+            response,
+            'protocole1_request_queries_count{view="protocole1.participate_experiment"}',
+        )
+        self.assertContains(
+            response,
+            'protocole1_stage_seconds_bucket{stage="pick_next_idea",le="+Inf"}',
+        )
+        self.client.force_login(User.objects.create_user("user"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 302)
+
+    def test_metrics_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROTOCOLE1_METRICS_DIR=directory):
+                # the metrics of another process
+                metrics.observe("protocole1_history_length", 1, experiment="other")
+                metrics.dump()
+                os.rename(
+                    os.path.join(directory, os.listdir(directory)[0]),
+                    os.path.join(directory, "other.json"),
+                )
+                response = self.client.get(reverse("metrics"))
+        self.assertContains(
+            response, 'protocole1_history_length_count{experiment="other"} 2'
+        )
+
+
+class SlowQueriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", is_staff=True)
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        pools.invalidate_pool()
+        self.client.force_login(self.staff)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "slow_queries.log")
+
+    def test_slow_request(self):
+        with override_settings(
+            PROTOCOLE1_SLOW_REQUEST_THRESHOLD=0, PROTOCOLE1_SLOW_QUERY_LOG=self.path
+        ):
+            response = self.client.get(
+                reverse("protocole1.results_experiment", args=[self.experiment.id])
+            )
+            b"".join(response.streaming_content)
+            entries = slow_queries.read_entries()
+            page = self.client.get(reverse("slow_queries"))
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertEqual(entry["view"], "protocole1.results_experiment")
+        self.assertEqual(entry["experiment"]["id"], self.experiment.id)
+        self.assertEqual(entry["experiment"]["results"], 0)
+        self.assertTrue(entry["statements"])
+        self.assertTrue(any(statement["plan"] for statement in entry["statements"]))
+        self.assertContains(page, "protocole1.results_experiment")
+        self.client.force_login(User.objects.create_user("user"))
+        self.assertEqual(self.client.get(reverse("slow_queries")).status_code, 302)
+
+    def test_fast_request(self):
+        with override_settings(
+            PROTOCOLE1_SLOW_REQUEST_THRESHOLD=60, PROTOCOLE1_SLOW_QUERY_LOG=self.path
+        ):
+            self.client.get(reverse("protocole1.homepage"))
+            self.assertEqual(slow_queries.read_entries(), [])
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user("staff", is_staff=True)
+        cls.user = User.objects.create_user("user")
+        cls.experiment = models.Experiment.objects.create(
+            name="Experiment", running=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        pools.invalidate_pool()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def get_profile(self, **extra):
+        self.client.force_login(self.staff)
+        with override_settings(PROTOCOLE1_PROFILING_DIR=self.directory):
+            response = self.client.get(
+                reverse("protocole1.results_experiment", args=[self.experiment.id]),
+                **extra
+            )
+            b"".join(response.streaming_content)
+            self.assertIn("X-Profile-Url", response)
+            profile = self.client.get(response["X-Profile-Url"])
+            self.assertEqual(profile.status_code, 200)
+            self.assertEqual(len(profiling.list_profiles()), 1)
+            return b"".join(profile.streaming_content)
+
+    def test_cprofile(self):
+        content = self.get_profile(QUERY_STRING="profile=cprofile")
+        path = os.path.join(self.directory, "profile.prof")
+        with open(path, "wb") as stream:
+            stream.write(content)
+        stats = pstats.Stats(path)
+        self.assertTrue(
+            any(function == "render_results" for _, _, function in stats.stats)
+        )
+
+    def test_sampling(self):
+        content = self.get_profile(HTTP_X_PROFILE="sampling")
+        data = json.loads(content.decode())
+        self.assertEqual(data["profiles"][0]["type"], "sampled")
+        self.assertEqual(
+            len(data["profiles"][0]["samples"]), len(data["profiles"][0]["weights"])
+        )
+
+    def assertSamplerStopped(self):
+        self.assertNotIn(
+            "profiling-sampler", [thread.name for thread in threading.enumerate()]
+        )
+
+    def test_sampling_closed(self):
+        self.client.force_login(self.staff)
+        with override_settings(PROTOCOLE1_PROFILING_DIR=self.directory):
+            response = self.client.get(
+                reverse("protocole1.results_experiment", args=[self.experiment.id]),
+                HTTP_X_PROFILE="sampling",
+            )
+            next(iter(response.streaming_content))
+            # the client disconnected
+            response.close()
+            self.assertSamplerStopped()
+            self.assertEqual(len(profiling.list_profiles()), 1)
+
+    def test_sampling_error(self):
+        def get_response(request):
+            raise ValueError("view failed")
+
+        request = RequestFactory().get(
+            reverse("protocole1.homepage"), HTTP_X_PROFILE="sampling"
+        )
+        request.user = self.staff
+        with override_settings(PROTOCOLE1_PROFILING_DIR=self.directory):
+            with self.assertRaises(ValueError):
+                profiling.ProfilingMiddleware(get_response)(request)
+        self.assertSamplerStopped()
+
+    def test_not_staff(self):
+        self.client.force_login(self.user)
+        with override_settings(PROTOCOLE1_PROFILING_DIR=self.directory):
+            response = self.client.get(
+                reverse("protocole1.homepage"), {"profile": "cprofile"}
+            )
+            self.assertNotIn("X-Profile-Url", response)
+            self.assertEqual(profiling.list_profiles(), [])
+            self.assertEqual(self.client.get(reverse("profiles")).status_code, 302)
+
+    def test_background(self):
+        self.client.force_login(self.user)
+        with override_settings(
+            PROTOCOLE1_PROFILING_DIR=self.directory,
+            PROTOCOLE1_PROFILING_SAMPLE_RATE=1,
+            PROTOCOLE1_PROFILING_KEEP=2,
+        ):
+            for _ in range(3):
+                response = self.client.get(reverse("protocole1.homepage"))
+                self.assertNotIn("X-Profile-Url", response)
+            profiles = profiling.list_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertTrue(all(name.endswith(".speedscope.json") for name in profiles))
+
+
+class ConcurrentReactionsTests(SimpleTestCase):
+    def manage(self, environment, *arguments):
+        return subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, "manage.py")]
+            + list(arguments),
+            env=environment,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+    def test_concurrent_reactions(self):
+        for profile in ("default", "sqlite"):
+            with self.subTest(
+                profile=profile
+            ), tempfile.TemporaryDirectory() as directory:
+                environment = dict(
+                    os.environ,
+                    FEEDBACK_DB_PROFILE=profile,
+                    FEEDBACK_DB_NAME=os.path.join(directory, "db.sqlite3"),
+                )
+                self.assertEqual(
+                    self.manage(environment, "migrate", "--verbosity=0").returncode, 0
+                )
+                completed = self.manage(
+                    environment,
+                    "benchmark_participation",
+                    "--json",
+                    "--participants=16",
+                    "--threads=8",
+                    "--fixation-ideas=10",
+                    "--expansion-ideas=10",
+                    "--limit=6",
+                    "--seed=0",
+                )
+                self.assertEqual(completed.returncode, 0, completed.stderr)
+                self.assertNotIn("stopped by an error", completed.stderr)
+                # all the reactions have been recorded
+                self.assertRegex(completed.stdout, r"(?m)^react_json +96 ")
+
+
+class CheckResultsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        experiment = models.Experiment.objects.create(name="Experiment", running=True)
+        cls.result = models.Result.objects.create(
+            experiment=experiment,
+            user=User.objects.create_user("user"),
+            expansion_rate=0.2,
+        )
+        for order in range(3):
+            last = models.ResultOnIdea.objects.create(
+                result=cls.result,
+                idea=models.Idea.objects.create(value="idea %s" % order),
+                order=order,
+                did_expand=False,
+                reaction=models.Reactions.CONTINUE.value if order < 2 else 0,
+            )
+        cls.last = last
+
+    def check_results(self, *arguments):
+        out = io.StringIO()
+        call_command("check_results", *arguments, stdout=out)
+        return out.getvalue()
+
+    def test_repair(self):
+        # the counters are left as if the ideas were proposed without them
+        self.assertIn("1 inconsistent", self.check_results())
+        result = models.Result.objects.get()
+        self.assertEqual(result.reactions_count, 0)
+        self.assertIn("1 repaired", self.check_results("--repair"))
+        result = models.Result.objects.get()
+        self.assertEqual(result.reactions_count, 3)
+        self.assertEqual(result.last_result_on_idea_id, self.last.pk)
+        self.assertTrue(result.pending)
+        self.assertIn("1 results checked\n", self.check_results())
+
+
+class SummariesTests(ExperimentFixtureMixin, TestCase):
+    ideas_count = 5
+
+    def summaries(self):
+        data = summaries.experiment_summary(self.experiment)
+        return (
+            data["summary"],
+            [
+                (step.order, step.reactions_count, round(step.expansion_rate_sum, 6))
+                for step in data["steps_summaries"]
+            ],
+            sorted(
+                (summary.idea_id, summary.reactions_count)
+                for summary in data["ideas_summaries"]
+            ),
+            [(bin.bin, bin.results_count) for bin in data["expansion_rate_bins"]],
+        )
+
+    def test_rebuild(self):
+        url = reverse("protocole1.participate_experiment", args=[self.experiment.id])
+        for index, reactions in enumerate(([1, 2, 3, 2], [3, 3], [])):
+            self.client.force_login(User.objects.create_user("user%s" % index))
+            self.client.get(url)
+            for reaction in reactions:
+                self.client.get(url, {"reaction": reaction})
+                self.client.get(url)
+        incremental = self.summaries()
+        self.assertEqual(incremental[0]["results_count"], 3)
+        self.assertEqual(incremental[0]["reactions_count"], 6)
+        self.assertEqual(
+            incremental[0]["neutral_fixation"] + incremental[0]["neutral_expansion"], 3
+        )
+        # the ideas waiting for a reaction are not counted
+        summaries.rebuild_summaries(self.experiment)
+        self.assertEqual(self.summaries(), incremental)
+
+
+@unittest.skipIf(analysis.np is None, "NumPy is not installed")
+class AnalysisTests(TestCase):
+    def test_pending_reactions(self):
+        np = analysis.np
+        # the reactions of two users, the last ideas of both waiting for a
+        # reaction (UNDEFINED, or the default value of the model)
+        data = analysis.ExperimentData(
+            {
+                "result_id": np.array([1, 1, 1, 2, 2]),
+                "order": np.array([0, 1, 2, 0, 1]),
+                "idea_id": np.array([1, 2, 3, 1, -1]),
+                "did_expand": np.array([False, True, False, False, True]),
+                "reaction": np.array([1, 2, 0, 3, -1]),
+                "expansion_rate": np.array([0.2, 0.3, 0.2, 0.4, 0.2]),
+            }
+        )
+        ideas, counts, rates = analysis.reactions_by_idea(data)
+        self.assertEqual(ideas.tolist(), [1, 2])
+        self.assertEqual(counts.tolist(), [[1, 0, 1], [0, 1, 0]])
+        steps_counts, _, _ = analysis.expansion_rate_by_step(data)
+        self.assertEqual(steps_counts.tolist(), [2, 1])
+        self.assertEqual(
+            analysis.reaction_transitions(data).tolist(),
+            [[0, 1, 0], [0, 0, 0], [0, 0, 0]],
+        )
+        self.assertEqual(
+            analysis.expansion_contingency(data).tolist(), [[1, 0, 1], [0, 1, 0]]
+        )
+
+    def test_experiment_stats(self):
+        experiment = models.Experiment.objects.create(name="Experiment", running=True)
+        result = models.Result.objects.create(
+            experiment=experiment, user=User.objects.create_user("user")
+        )
+        for order, reaction in enumerate((1, 3, 0)):
+            models.ResultOnIdea.objects.create(
+                result=result,
+                idea=models.Idea.objects.create(value="idea %s" % order),
+                order=order,
+                reaction=reaction,
+            )
+        self.assertEqual(len(analysis.load_experiment_data(experiment)), 2)
+        stats = analysis.experiment_stats(experiment)
+        self.assertEqual(stats["reactions_count"], 2)
+        self.assertEqual(stats["transitions"]["CONTINUE"]["NEUTRAL"], 1)
+
+
+class ExportTests(ExperimentFixtureMixin, TestCase):
+    ideas_count = 5
+    idea_value = "%s idée %s"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.url = reverse("protocole1.export_experiment", args=[cls.experiment.id])
+
+    def setUp(self):
+        super().setUp()
+        self.participate_url = reverse(
+            "protocole1.participate_experiment", args=[self.experiment.id]
+        )
+        self.client.force_login(User.objects.create_user("user"))
+
+    def export(self, since=None, until=None, **kwargs):
+        return list(
+            export.export_rows(
+                self.experiment, since, until or timezone.now(), **kwargs
+            )
+        )
+
+    def test_incremental(self):
+        start = timezone.now()
+        self.client.get(self.participate_url)
+        # the idea waiting for a reaction is only in the full exports
+        (row,) = self.export()
+        self.assertEqual(row[export.COLUMNS_NAMES.index("reaction")], 0)
+        self.assertEqual(self.export(start), [])
+        until = timezone.now()
+        self.client.get(self.participate_url, {"reaction": 2})
+        self.client.get(self.participate_url)
+        (reacted,) = self.export(until)
+        self.assertEqual(reacted[0], row[0])
+        self.assertEqual(reacted[export.COLUMNS_NAMES.index("reaction")], 2)
+        self.assertEqual(len(self.export(chunk_size=1)), 2)
+        self.assertEqual(self.export(start), [reacted])
+        # the last reactions are left to the next export
+        self.assertEqual(list(export.export_rows(self.experiment, start)), [])
+
+    def test_formats(self):
+        rows = [
+            (1, 1, 1, 1, "user", 0, 1, 'idée, "1"\n', False, 1, 0.25, None, False),
+            (2, 1, 1, 1, "user", 1, 2, "", True, 0, None, 0.5, True),
+            (3, 1, 2, 2, None, 0, 3, "idea 3", False, 3, 0.0, 0.0, False),
+        ]
+        data = b"".join(export.export_chunks(rows, "csv", chunk_size=2))
+        self.assertEqual(
+            list(csv.reader(io.StringIO(data.decode("utf-8")))),
+            [export.COLUMNS_NAMES]
+            + [["" if value is None else str(value) for value in row] for row in rows],
+        )
+        data = b"".join(export.export_chunks(rows, "jsonl", chunk_size=2))
+        self.assertEqual(
+            [json.loads(line) for line in data.decode("utf-8").splitlines()],
+            [dict(zip(export.COLUMNS_NAMES, row)) for row in rows],
+        )
+        data = b"".join(export.export_chunks(rows, "columnar", chunk_size=2))
+        chunks = list(export.read_columnar(io.BytesIO(data)))
+        self.assertEqual([len(chunk["id"]) for chunk in chunks], [2, 1])
+        self.assertEqual(
+            [
+                row
+                for chunk in chunks
+                for row in zip(*(chunk[name] for name in export.COLUMNS_NAMES))
+            ],
+            rows,
+        )
+        with self.assertRaises(ValueError):
+            list(export.read_columnar(io.BytesIO(b"id,experiment\n")))
+        for export_format in export.FORMATS:
+            self.assertEqual(
+                gzip.decompress(
+                    b"".join(
+                        export.export_chunks(rows, export_format, 1, compress=True)
+                    )
+                ),
+                b"".join(export.export_chunks(rows, export_format, 1)),
+            )
+
+    def test_command(self):
+        self.client.get(self.participate_url)
+        self.client.get(self.participate_url, {"reaction": 1})
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "export.jsonl.gz")
+            stderr = io.StringIO()
+            call_command(
+                "export_results",
+                str(self.experiment.id),
+                "--format=jsonl",
+                "--output",
+                output,
+                stderr=stderr,
+            )
+            with open(output, "rb") as stream:
+                lines = gzip.decompress(stream.read()).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["reaction"] for line in lines], [1])
+        self.assertRegex(stderr.getvalue(), "^1 reactions exported, next export since")
+        # the reaction is too recent for an incremental export
+        stderr = io.StringIO()
+        call_command(
+            "export_results",
+            str(self.experiment.id),
+            "--since=2020-01-01T00:00:00",
+            "--output",
+            os.devnull,
+            stderr=stderr,
+        )
+        self.assertRegex(stderr.getvalue(), "^0 reactions exported")
+        with self.assertRaises(CommandError):
+            call_command("export_results", str(self.experiment.id), "--since=yesterday")
+        # a chunk size of 0 or less would export nothing
+        for chunk_size in ("0", "-1"):
+            with self.assertRaises(CommandError):
+                call_command(
+                    "export_results",
+                    str(self.experiment.id),
+                    "--chunk-size",
+                    chunk_size,
+                )
+
+    def test_view(self):
+        self.client.get(self.participate_url)
+        self.client.get(self.participate_url, {"reaction": 1})
+        # only for the staff
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(User.objects.create_user("staff", is_staff=True))
+        response = self.client.get(self.url, {"format": "csv", "gzip": ""})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn(
+            "experiment-%s.csv.gz" % self.experiment.id, response["Content-Disposition"]
+        )
+        rows = list(
+            csv.reader(
+                io.StringIO(
+                    gzip.decompress(b"".join(response.streaming_content)).decode(
+                        "utf-8"
+                    )
+                )
+            )
+        )
+        self.assertEqual(len(rows), 2)
+        until = export.parse_since(response["X-Export-Until"])
+        response = self.client.get(self.url, {"since": until.isoformat()})
+        self.assertEqual(b"".join(response.streaming_content).count(b"\n"), 1)
+        self.assertEqual(self.client.get(self.url, {"since": "x"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"format": "xls"}).status_code, 404)
+
+
+class ImportIdeasTests(TestCase):
+    def import_ideas(self, groups, *arguments):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ideas.json")
+            with open(path, "w", encoding="utf-8") as stream:
+                json.dump(groups, stream)
+            stdout = io.StringIO()
+            call_command("import_ideas", path, *arguments, stdout=stdout)
+        return stdout.getvalue()
+
+    def contents(self):
+        return sorted(
+            models.IdeasGroup.ideas.through.objects.values_list(
+                "ideasgroup__name", "ideasgroup__description", "idea__value"
+            )
+        )
+
+    def test_import_again(self):
+        groups = [
+            {"name": "fixation", "ideas": ["idea 1", "idea 2"]},
+            {"name": "expansion", "description": "Ideas", "ideas": ["idea 1"]},
+        ]
+        self.assertIn(
+            "2 groups created, 0 groups updated, 3 ideas created",
+            self.import_ideas(groups),
+        )
+        contents = self.contents()
+        self.assertIn(
+            "0 groups created, 0 groups updated, 0 ideas created",
+            self.import_ideas(groups),
+        )
+        self.assertEqual(self.contents(), contents)
+        # the descriptions are updated and the ideas missing added
+        groups[0]["description"] = "Fixation"
+        groups[0]["ideas"].append("idea 3")
+        self.assertIn(
+            "0 groups created, 1 groups updated, 1 ideas created",
+            self.import_ideas(groups, "--batch-size=1"),
+        )
+        self.assertEqual(
+            self.contents(),
+            [
+                ("expansion", "Ideas", "idea 1"),
+                ("fixation", "Fixation", "idea 1"),
+                ("fixation", "Fixation", "idea 2"),
+                ("fixation", "Fixation", "idea 3"),
+            ],
+        )
+        self.assertEqual(models.IdeasGroup.objects.count(), 2)
+        self.assertEqual(models.Idea.objects.count(), 4)
+
+    def test_large_import(self):
+        # more groups and ideas than variables allowed by a SQLite query
+        groups = [
+            {
+                "name": "group %s" % group,
+                "ideas": ["idea %s" % idea for idea in range(3)],
+            }
+            for group in range(1500)
+        ]
+        groups.append(
+            {"name": "large", "ideas": ["idea %s" % idea for idea in range(5000)]}
+        )
+        self.assertIn(
+            "1501 groups created, 0 groups updated, 9500 ideas created",
+            self.import_ideas(groups),
+        )
+        groups[-1]["ideas"].append("idea 5000")
+        self.assertIn(
+            "0 groups created, 0 groups updated, 1 ideas created",
+            self.import_ideas(groups),
+        )
+        self.assertEqual(
+            models.IdeasGroup.objects.get(name="large").ideas.count(), 5001
+        )
+        self.assertEqual(
+            models.IdeasGroup.ideas.through.objects.count(), models.Idea.objects.count()
+        )
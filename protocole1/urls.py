@@ -4,11 +4,31 @@ from protocole1 import views
 
 urlpatterns = [
     path("", views.homepage, name="protocole1.homepage"),
+    re_path(
+        r"experiment/link/(?P<token>[^/]+)/",
+        views.participate_with_token,
+        name="protocole1.participate_with_token",
+    ),
+    re_path(
+        r"experiment/(?P<experiment_id>[0-9]+)/react/",
+        views.react_experiment,
+        name="protocole1.react_experiment",
+    ),
     re_path(
         r"experiment/(?P<experiment_id>[0-9]+)/",
         views.participate_experiment,
         name="protocole1.participate_experiment",
     ),
+    re_path(
+        r"experiment/results/(?P<experiment_id>[0-9]+)/export/",
+        views.export_experiment,
+        name="protocole1.export_experiment",
+    ),
+    re_path(
+        r"experiment/results/(?P<experiment_id>[0-9]+)/stats/",
+        views.results_experiment_stats,
+        name="protocole1.results_experiment_stats",
+    ),
     re_path(
         r"experiment/results/(?P<experiment_id>[0-9]+)/",
         views.results_experiment,
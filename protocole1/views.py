@@ -1,12 +1,45 @@
+import itertools
+import operator
 import random
 
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render, redirect, reverse
+from django.template import loader
+from django.utils import timezone
 from django.views.decorators.debug import sensitive_post_parameters
-
-from protocole1 import forms, models
+from django.views.decorators.http import require_POST
+
+from protocole1 import (
+    analysis,
+    export,
+    forms,
+    journal,
+    metrics,
+    models,
+    pools,
+    profiling,
+    results_cache,
+    slow_queries,
+    statuses,
+    summaries,
+)
+
+SPECULATION_SALT = "protocole1.speculation"
+PARTICIPATION_TOKEN_SALT = "protocole1.participation"
 
 
 ##
@@ -21,18 +54,11 @@ def homepage(request):
     user. If the user has already participated, a mention will appear to mention so.
     The results of an experiment are available through a link for each experiment.
     """
-    experiments_available = models.Experiment.objects.filter(running=True)
-    results = models.Result.objects.filter(user=request.user)
-
-    # Groups the result by experiment
-    results_filtered = {}
-    for result in results.all():
-        results_filtered[result.experiment.id] = result.finished
+    # The experiments running with the status of the user on each
+    experiments_available = statuses.running_experiments(request.user)
 
     return render(
-        request,
-        "homepage.html",
-        {"experiments_available": experiments_available, "results": results_filtered},
+        request, "homepage.html", {"experiments_available": experiments_available}
     )
 
 
@@ -41,61 +67,165 @@ def homepage(request):
 ##
 
 
-def sort_by_grouptype(groups):
+def iterate_results(experiment):
     """
-    Sorts the groups between the two group types.
+    Iterates over the results of an experiment with their reactions, in linear 
+    time and constant memory: the results and the reactions are both read in
+    chunks, in the order of the results, and the reactions are grouped on the fly.
     
-    :param groups: the groups to sorts
-    :type groups: QuerySet
-    :return: a dict with groups gathered by group type (one entry for fixation 
-            groups, another one for expansion groups).
-    :rtype: dict
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :return: the results with an iterable of their reactions (in order)
+    :rtype: generator of tuple of Result and iterable of ResultOnIdea
+    """
+    results = (
+        models.Result.objects.select_related("user")
+        .filter(experiment=experiment)
+        .order_by("pk")
+    )
+    reactions_ideas = (
+        models.ResultOnIdea.objects.select_related("idea")
+        .filter(result__experiment=experiment)
+        .order_by("result_id", "order")
+    )
+    # Groups the reactions by user result
+    groups = itertools.groupby(
+        reactions_ideas.iterator(), key=operator.attrgetter("result_id")
+    )
+    result_id, reactions = next(groups, (None, ()))
+    for result in results.iterator():
+        # avoids loading the experiment for each result
+        result.experiment = experiment
+        while result_id is not None and result_id < result.pk:
+            result_id, reactions = next(groups, (None, ()))
+        if result_id == result.pk:
+            # the reactions must be consumed before the next group is read
+            yield result, reactions
+            result_id, reactions = next(groups, (None, ()))
+        else:
+            yield result, ()
+
+
+def render_results(request, experiment, page_key=None):
     """
-    group_fix = groups.filter(group_type_here=models.GroupType.FIXATION.value)
-    ideas_fix = [idea for group in group_fix.all() for idea in group.group.ideas.all()]
-    group_exp = groups.filter(group_type_here=models.GroupType.EXPANSION.value)
-    ideas_exp = [idea for group in group_exp.all() for idea in group.group.ideas.all()]
-    return {models.GroupType.FIXATION: ideas_fix, models.GroupType.EXPANSION: ideas_exp}
+    Renders the results page piece by piece: the header then each result. The 
+    fragments of the results which did not progress are read from the cache, and
+    the page is cached once rendered unless too large (see ``results_cache``).
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param page_key: the key caching the page (see ``results_cache.get_page``),
+        defaults to None
+    :type page_key: str, optional
+    :return: the chunks of the page
+    :rtype: generator of str
+    """
+    page = results_cache.PageWriter(page_key)
+    with metrics.stage("results_summary"):
+        chunk = loader.render_to_string(
+            "results_experiment.html",
+            dict(summaries.experiment_summary(experiment), experiment=experiment),
+            request,
+        )
+    page.write(chunk)
+    yield chunk
+    template = loader.get_template("results_experiment_result.html")
+    results = iterate_results(experiment)
+    while True:
+        # the reactions of a result are read before the next result
+        batch = [
+            (result, list(reactions))
+            for result, reactions in itertools.islice(
+                results, results_cache.BATCH_SIZE
+            )
+        ]
+        if not batch:
+            break
+        fragments = results_cache.get_fragments(result for result, _ in batch)
+        rendered = {}
+        for result, reactions in batch:
+            if result.pk not in fragments:
+                rendered[result] = fragments[result.pk] = template.render(
+                    {"result": result, "reactions": reactions}
+                )
+        results_cache.set_fragments(rendered)
+        chunk = "".join(fragments[result.pk] for result, _ in batch)
+        page.write(chunk)
+        yield chunk
+    page.save()
 
 
 @login_required
 def results_experiment(request, experiment_id):
     """
-    Displays the results of a selected experiment.
+    Displays the results of a selected experiment. The page is streamed, unless
+    cached for the current version of the results.
     
     :param experiment_id: the experiment selected id
     :type experiment_id: int
     """
     experiment = get_object_or_404(models.Experiment, Q(id=experiment_id, running=True))
-    experiment_groups = models.ExperimentGroups.objects.prefetch_related(
-        "group", "group__ideas"
-    ).filter(experiment=experiment)
 
-    results = models.Result.objects.prefetch_related("user", "reactions_ideas").filter(
-        experiment=experiment
-    )
-    reactions_ideas = models.ResultOnIdea.objects.prefetch_related(
-        "result", "result__experiment"
-    ).filter(result__experiment=experiment)
+    page_key, page = results_cache.get_page(experiment.id)
+    if page is not None:
+        return HttpResponse(page)
+    return StreamingHttpResponse(render_results(request, experiment, page_key))
 
-    # Groups the reactions by user result
-    reactions_ideas_result = {}
-    for reaction in reactions_ideas.all():
-        reactions_ideas_result[reaction.result.id] = reactions_ideas_result.get(
-            reaction.result.id, []
-        ) + [reaction]
-    # Sorts the groups by group type
-    groups = sort_by_grouptype(experiment_groups.all())
 
-    return render(
-        request,
-        "results_experiment.html",
-        {
-            "experiment": experiment,
-            "results": results,
-            "reactions_ideas_result": reactions_ideas_result,
-        },
+@login_required
+def results_experiment_stats(request, experiment_id):
+    """
+    Gives the statistics of the results of a selected experiment in JSON (see
+    ``analysis.experiment_stats``).
+    
+    :param experiment_id: the experiment selected id
+    :type experiment_id: int
+    """
+    experiment = get_object_or_404(models.Experiment, Q(id=experiment_id, running=True))
+
+    return JsonResponse(analysis.experiment_stats(experiment))
+
+
+@staff_member_required
+def export_experiment(request, experiment_id):
+    """
+    Streams the export of the reactions of a selected experiment. The format is
+    given by the format GET parameter (see ``export.FORMATS``), the export can
+    be compressed with gzip (gzip GET parameter) and restricted to the reactions
+    written after a time (since GET parameter, ISO 8601), the time to give to
+    the next export being in the X-Export-Until header.
+    
+    :param experiment_id: the experiment selected id
+    :type experiment_id: int
+    """
+    experiment = get_object_or_404(models.Experiment, id=experiment_id)
+    export_format = request.GET.get("format", "csv")
+    if export_format not in export.FORMATS:
+        raise Http404("Unknown format")
+    try:
+        since = request.GET.get("since")
+        since = export.parse_since(since) if since is not None else None
+    except ValueError:
+        raise Http404("Invalid since")
+    until = export.export_until()
+    compress = "gzip" in request.GET
+
+    response = StreamingHttpResponse(
+        export.export_chunks(
+            export.export_rows(experiment, since, until),
+            export_format,
+            compress=compress,
+        ),
+        content_type=export.CONTENT_TYPES[export_format],
     )
+    filename = "experiment-%s.%s%s" % (
+        experiment.id,
+        export_format,
+        ".gz" if compress else "",
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s"' % filename
+    response["X-Export-Until"] = until.isoformat()
+    return response
 
 
 ##
@@ -103,28 +233,37 @@ def results_experiment(request, experiment_id):
 ##
 
 
-def get_next_idea(ideas):
+def get_next_idea(ideas, group_type, consume=True):
     """
     Selects the next idea to display/test.
     
     :param ideas: the ideas available
-    :type ideas: list
-    :return: a randomly selected idea
+    :type ideas: RemainingIdeas
+    :param group_type: the group type to pick the idea in
+    :type group_type: GroupType
+    :param consume: whether the idea is removed from the ideas available, 
+                    defaults to True
+    :type consume: boolean, optional
+    :return: the idea selected by the selection strategy of the experiment
     :rtype: Idea
     """
-    return random.choice(ideas)
+    return ideas.draw(group_type, consume)
 
 
-def get_next_step(experiment_ideas, expansion_rate=0.2):
+def get_next_step(experiment_ideas, expansion_rate=0.2, consume=True):
     """
     Apply the algorithm: gets a random value and compare it to the expansion rate
-    to know whether we expanded or not. If expanded, picks a random idea in
-    the expansion groups. Otherwise, picks a random idea in fixation groups.
+    to know whether we expanded or not. If expanded, picks an idea in the
+    expansion groups. Otherwise, picks an idea in fixation groups. The idea is
+    selected by the selection strategy of the experiment.
     
     :param experiment_ideas: the ideas of the experiment
-    :type experiment_ideas: Idea list
+    :type experiment_ideas: RemainingIdeas
     :param expansion_rate: the expansion rate to apply, defaults to 0.2
     :type expansion_rate: float, optional
+    :param consume: whether the idea is removed from the ideas available, 
+                    defaults to True
+    :type consume: boolean, optional
     :return: the idea and whether we expanded or not
     :rtype: tuple of Idea and boolean
     """
@@ -132,65 +271,427 @@ def get_next_step(experiment_ideas, expansion_rate=0.2):
     # if the random element is less than expansion rate => expand
     if will_expand <= expansion_rate:
         expansion = True
-        idea = get_next_idea(experiment_ideas[models.GroupType.EXPANSION])
+        idea = get_next_idea(experiment_ideas, models.GroupType.EXPANSION, consume)
     # otherwise, picks an idea in fixation group
     else:
         expansion = False
-        idea = get_next_idea(experiment_ideas[models.GroupType.FIXATION])
+        idea = get_next_idea(experiment_ideas, models.GroupType.FIXATION, consume)
     return idea, expansion
 
 
-def remove_already_used_ideas(groups, reactions_ideas):
+@metrics.stage("remove_already_used_ideas")
+def remove_already_used_ideas(pool, used_ideas, strategy="uniform"):
     """
     Removes the already used ideas from the available ideas for next step.
     
-    :param groups: the groups available for next step
-    :type groups: dict of ideas separated among two elements (fixation and expansion)
-    :param reactions_ideas: the ideas already used by other reactions
-    :type reactions_ideas: QuerySet
-    :return: the dictionary filtered
-    :rtype: dict of Idea
-    """
-    ideas_already_used = [reaction.idea for reaction in reactions_ideas.all()]
-    for idea in ideas_already_used:
-        # removes idea from fixation or expansion group when it has already been used
-        if idea in groups[models.GroupType.FIXATION]:
-            groups[models.GroupType.FIXATION].remove(idea)
-        if idea in groups[models.GroupType.EXPANSION]:
-            groups[models.GroupType.EXPANSION].remove(idea)
-    return groups
-
-
-def create_next_idea(groups, result):
-    """
-    Creates the next reaction for an user.
+    :param pool: the pool of ideas of the experiment
+    :type pool: IdeaPool
+    :param used_ideas: the ids of the ideas already used by other reactions
+    :type used_ideas: set of int
+    :param strategy: the selection strategy of the experiment, defaults to 
+                    "uniform"
+    :type strategy: str, optional
+    :return: the ideas remaining, separated among two elements (fixation and 
+            expansion)
+    :rtype: RemainingIdeas
+    """
+    return pools.RemainingIdeas(pool, used_ideas, strategy=strategy)
+
+
+class ParticipationState:
+    """
+    The state of the participation of a user to an experiment, shared by the 
+    participation view and ``create_next_idea``. The progress of the user is 
+    read from the fields maintained on his result, the ideas already used are 
+    only loaded when needed.
     
-    :param groups: the groups available
-    :type groups: dict
-    :param result: the result concerned
+    :param result: the result of the user on the experiment (None if the user
+                    never participated)
     :type result: Result
+    :param used_ideas: the ids of the ideas already proposed to the user, 
+                        defaults to None (loaded when needed)
+    :type used_ideas: set of int, optional
+    """
+
+    def __init__(self, result=None, used_ideas=None):
+        self.result = result
+        self._used_ideas = used_ideas
+
+    @property
+    def last_result(self):
+        """
+        The last idea proposed to the user (None if none yet)
+
+        :rtype: ResultOnIdea
+        """
+        return self.result.last_result_on_idea if self.result is not None else None
+
+    @property
+    def reactions_count(self):
+        """
+        The number of ideas proposed to the user
+
+        :rtype: int
+        """
+        return self.result.reactions_count if self.result is not None else 0
+
+    @property
+    def pending(self):
+        """
+        Whether the last idea proposed to the user is waiting for a reaction
+
+        :rtype: boolean
+        """
+        return self.result is not None and self.result.pending
+
+    @property
+    def used_ideas(self):
+        """
+        The ids of the ideas already proposed to the user
+
+        :rtype: set of int
+        """
+        if self._used_ideas is None:
+            # without the default ordering, which joins the result to sort
+            self._used_ideas = set(
+                models.ResultOnIdea.objects.filter(result=self.result)
+                .order_by()
+                .values_list("idea_id", flat=True)
+            )
+        return self._used_ideas
+
+    def add(self, result_on_idea):
+        """
+        Registers a new idea proposed to the user.
+        
+        :param result_on_idea: the idea proposed
+        :type result_on_idea: ResultOnIdea
+        """
+        self.result.last_result_on_idea = result_on_idea
+        self.result.reactions_count += 1
+        self.result.pending = True
+        if self._used_ideas is not None:
+            self._used_ideas.add(result_on_idea.idea_id)
+
+
+@metrics.stage("load_participation_state")
+def load_participation_state(experiment, user):
+    """
+    Loads the participation state of an user on an experiment in one query 
+    (the result with the last idea proposed).
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param user: the user considered
+    :type user: User
+    :return: the participation state
+    :rtype: ParticipationState
+    """
+    # the reaction not written yet is read first (see ``journal``)
+    reaction_journal = journal.get_journal()
+    entry = None
+    if reaction_journal is not None:
+        entry = reaction_journal.latest(experiment, user)
+    result = (
+        models.Result.objects.select_related("last_result_on_idea")
+        .filter(experiment=experiment, user=user)
+        .first()
+    )
+    state = ParticipationState(result)
+    if entry is not None:
+        reaction_journal.apply(state, entry)
+    return state
+
+
+def create_participation(experiment, user):
+    """
+    Creates the result of an user on an experiment with the starting expansion 
+    rate of the experiment. If a concurrent request (double click, two tabs) 
+    created it meanwhile, the unique constraint on the experiment and the user 
+    makes the creation fail and the result created is used.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param user: the user considered
+    :type user: User
+    :return: the participation state
+    :rtype: ParticipationState
+    """
+    result = models.Result(
+        user=user,
+        experiment=experiment,
+        expansion_rate=experiment.starting_expansion_rate,
+    )
+    try:
+        with transaction.atomic():
+            result.save()
+            summaries.count_result(result)
+    except IntegrityError:
+        return load_participation_state(experiment, user)
+    return ParticipationState(result, used_ideas=set())
+
+
+@metrics.stage("create_next_idea")
+def create_next_idea(groups, state, next_step=None, reserved=False):
+    """
+    Creates the next reaction for an user. If a concurrent request (double 
+    click, two tabs) proposed an idea at this step meanwhile, the unique 
+    constraint on the result and the order makes the creation fail and the idea
+    proposed is used. When the step is reserved by the reaction recorded in the
+    same transaction (see ``react_experiment``), no other request can propose 
+    an idea at this step and the creation is not wrapped in a savepoint.
+    
+    :param groups: the ideas remaining
+    :type groups: RemainingIdeas
+    :param state: the participation state of the user
+    :type state: ParticipationState
+    :param next_step: the idea to use next and whether we expanded if already 
+                        selected (see ``speculate_next_steps``), defaults to None
+    :type next_step: tuple of Idea and boolean, optional
+    :param reserved: whether the step is reserved by a reaction recorded in the
+                    current transaction, defaults to False
+    :type reserved: boolean, optional
     :return: the idea used next and whether we expanded
     :rtype: tuple of Idea and boolean
     """
     # Gets the next idea to use
-    next_idea, did_expand = get_next_step(groups, result.expansion_rate)
-    # Computes the step we are at in the experiment
-    new_order = len(result.reactions_ideas.all())
+    if next_step is None:
+        next_step = get_next_step(groups, state.result.expansion_rate)
+    elif groups is not None:
+        groups.use(next_step[0].id)
+    next_idea, did_expand = next_step
 
     # Creates the new object to store the user's reaction to the idea
-    # picked previously
+    # picked previously, the step we are at being the number of ideas
+    # already proposed
     next_result = models.ResultOnIdea(
         idea=next_idea,
-        result=result,
-        order=new_order,
+        result=state.result,
+        order=state.reactions_count,
         did_expand=did_expand,
         reaction=models.Reactions.UNDEFINED.value,
     )
-    next_result.save()
+    try:
+        with transaction.atomic(savepoint=not reserved):
+            next_result.save()
+            # Updates the progress of the user
+            models.Result.objects.filter(pk=state.result.pk).update(
+                reactions_count=F("reactions_count") + 1,
+                last_result_on_idea=next_result,
+                pending=True,
+            )
+    except IntegrityError:
+        if reserved:
+            raise
+        next_result = models.ResultOnIdea.objects.select_related("idea").get(
+            result=state.result, order=state.reactions_count
+        )
+        next_idea, did_expand = next_result.idea, next_result.did_expand
+    state.add(next_result)
 
     return next_idea, did_expand
 
 
+@metrics.stage("record_reaction")
+@transaction.atomic(savepoint=False)
+def record_reaction(state, reaction):
+    """
+    Stores the reaction of the user on the last idea proposed and updates the
+    expansion rate of his result and the summaries of the experiment. The 
+    reaction is only stored if the idea is still waiting for one, so that a 
+    reaction cannot be registered twice. Within a transaction, no savepoint is 
+    created: a failure aborts the whole transaction.
+    
+    :param state: the participation state of the user
+    :type state: ParticipationState
+    :param reaction: the reaction of the user
+    :type reaction: Reactions
+    :return: whether the reaction has been stored
+    :rtype: boolean
+    """
+    result = state.result
+    last_result = state.last_result
+    expansion_rate = result.expansion_rate
+    # Updates the expansion rate
+    result.update_expansion_rate(last_result.did_expand, reaction)
+    # In write-behind mode, the reaction is only appended to the journal
+    reaction_journal = journal.get_journal()
+    if reaction_journal is not None:
+        if not reaction_journal.append(
+            journal.reaction_entry(result, last_result, reaction, expansion_rate)
+        ):
+            result.expansion_rate = expansion_rate
+            return False
+        result.pending = False
+        last_result.reaction = reaction.value
+        last_result.expansion_rate = result.expansion_rate
+        return True
+    # Updates the last idea seen to register the reaction and the new expansion
+    # rate computed, unless another request already did
+    updated = models.ResultOnIdea.objects.filter(
+        pk=last_result.pk, reaction=models.Reactions.UNDEFINED.value
+    ).update(
+        reaction=reaction.value,
+        expansion_rate=result.expansion_rate,
+        reacted_at=timezone.now(),
+    )
+    if not updated:
+        result.expansion_rate = expansion_rate
+        return False
+    models.Result.objects.filter(pk=result.pk).update(
+        expansion_rate=result.expansion_rate, pending=False
+    )
+    result.pending = False
+    last_result.reaction = reaction.value
+    last_result.expansion_rate = result.expansion_rate
+    summaries.count_reaction(result, last_result, expansion_rate)
+    results_cache.bump_version(result.experiment_id)
+    return True
+
+
+@metrics.stage("pick_next_idea")
+def pick_next_idea(experiment, pool, state, groups=None, reserved=False):
+    """
+    Picks the next idea for the user if there are ideas remaining in both 
+    EXPANSION and FIXATION groups and if the number of ideas to test per user 
+    is not exceeded. Otherwise, finishes the user's experiment.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param pool: the pool of ideas of the experiment
+    :type pool: IdeaPool
+    :param state: the participation state of the user
+    :type state: ParticipationState
+    :param groups: the ideas remaining, defaults to None (computed from the 
+                    state)
+    :type groups: RemainingIdeas, optional
+    :param reserved: whether the step is reserved by a reaction recorded in the
+                    current transaction (see ``create_next_idea``), defaults to
+                    False
+    :type reserved: boolean, optional
+    :return: the next idea or None if the experiment is finished for the user
+    :rtype: Idea
+    """
+    if groups is None:
+        groups = remove_already_used_ideas(
+            pool, state.used_ideas, experiment.selection_strategy
+        )
+    if groups.is_exhausted() or (
+        experiment.limit_ideas_number > 0
+        and state.reactions_count >= experiment.limit_ideas_number
+    ):
+        # If no idea remain,
+        state.result.finished = True
+        state.result.save(update_fields=["finished"])
+        return None
+
+    next_idea, did_expand = create_next_idea(groups, state, reserved=reserved)
+    return next_idea
+
+
+def pending_idea(pool, state):
+    """
+    Gives the idea waiting for a reaction of the user, from the pool if possible.
+    
+    :param pool: the pool of ideas of the experiment
+    :type pool: IdeaPool
+    :param state: the participation state of the user
+    :type state: ParticipationState
+    :rtype: Idea
+    """
+    idea_id = state.last_result.idea_id
+    if idea_id in pool.values:
+        return pool.idea(idea_id)
+    return state.last_result.idea
+
+
+@metrics.stage("speculate_next_steps")
+def speculate_next_steps(experiment, pool, state, groups=None):
+    """
+    Selects in advance the idea which would be proposed next after each possible
+    reaction of the user to the idea waiting for it: the next idea only depends
+    on the expansion rate after the reaction. Nothing is stored: the selection 
+    is signed to be sent to the page and sent back with the reaction (see 
+    ``speculated_step``), so the branches discarded do not use any idea. Only 
+    the ids of the ideas are sent, the participant must not read the ideas 
+    coming next.
+    
+    :param experiment: the experiment considered
+    :type experiment: Experiment
+    :param pool: the pool of ideas of the experiment
+    :type pool: IdeaPool
+    :param state: the participation state of the user
+    :type state: ParticipationState
+    :param groups: the ideas remaining, defaults to None (computed from the 
+                    state)
+    :type groups: RemainingIdeas, optional
+    :return: the signed selection (token)
+    :rtype: dict
+    """
+    if groups is None:
+        groups = remove_already_used_ideas(
+            pool, state.used_ideas, experiment.selection_strategy
+        )
+    finished = groups.is_exhausted() or (
+        experiment.limit_ideas_number > 0
+        and state.reactions_count >= experiment.limit_ideas_number
+    )
+    steps = {}
+    for reaction in models.Reactions:
+        if reaction.value <= 0:
+            continue
+        if finished:
+            steps[reaction.value] = None
+            continue
+        expansion_rate = models.next_expansion_rate(
+            state.result.expansion_rate, state.last_result.did_expand, reaction
+        )
+        idea, did_expand = get_next_step(groups, expansion_rate, consume=False)
+        steps[reaction.value] = (idea.id, did_expand)
+    token = signing.dumps(
+        {"result_on_idea": state.last_result.pk, "steps": steps},
+        salt=SPECULATION_SALT,
+    )
+    return {"token": token}
+
+
+def speculated_step(token, pool, state, reaction):
+    """
+    Gives the idea selected in advance (by ``speculate_next_steps``) for the 
+    reaction of the user, if it can still be used.
+    
+    :param token: the signed selection sent back by the page
+    :type token: str
+    :param pool: the pool of ideas of the experiment
+    :type pool: IdeaPool
+    :param state: the participation state of the user
+    :type state: ParticipationState
+    :param reaction: the reaction of the user
+    :type reaction: Reactions
+    :return: the idea to use next and whether we expanded, or None if no valid 
+            idea has been selected
+    :rtype: tuple of Idea and boolean
+    """
+    if not token:
+        return None
+    try:
+        speculation = signing.loads(token, salt=SPECULATION_SALT)
+    except signing.BadSignature:
+        return None
+    if speculation["result_on_idea"] != state.last_result.pk:
+        return None
+    step = speculation["steps"].get(str(reaction.value))
+    if step is None:
+        return None
+    idea_id, did_expand = step
+    group_type = (
+        models.GroupType.EXPANSION if did_expand else models.GroupType.FIXATION
+    )
+    if idea_id in state.used_ideas or idea_id not in pool.sets[group_type]:
+        return None
+    return pool.idea(idea_id), did_expand
+
+
 @login_required
 def participate_experiment(request, experiment_id):
     """
@@ -215,91 +716,53 @@ def participate_experiment(request, experiment_id):
                 to display. Otherwise, finishes the user's experiment and 
                 redirects to the homepage.
 
+    The page can also register the reactions through ``react_experiment`` to 
+    avoid reloading, the next ideas being selected in advance for each reaction.
+
     :param experiment_id: the experiment considered id
     :type experiment_id: int
     """
     experiment = get_object_or_404(models.Experiment, Q(id=experiment_id, running=True))
-    experiment_groups = models.ExperimentGroups.objects.prefetch_related(
-        "group", "group__ideas"
-    ).filter(experiment=experiment)
-    result = models.Result.objects.filter(experiment=experiment, user=request.user)
-    groups = sort_by_grouptype(experiment_groups.all())
-
-    # If the user is already answering to this experiment, a result must exist
-    # link to his account
-    if result.count() > 0:
-        result = result[0]
-        # if the result is finished, redirect to the homepage
-        if result.finished:
+    state = load_participation_state(experiment, request.user)
+    pool = pools.get_pool(experiment.id)
+    metrics.observe(
+        "protocole1_history_length", state.reactions_count, experiment=experiment.id
+    )
+
+    # If the user never participated to this experiment, creates his result (the
+    # first idea is then picked as the next one)
+    if state.result is None:
+        state = create_participation(experiment, request.user)
+    result = state.result
+
+    # if the result is finished, redirect to the homepage
+    if result.finished:
+        return redirect(reverse("protocole1.homepage"))
+
+    # If the last idea proposed has already had a reaction from the user (or
+    # if no idea has been proposed yet), picks the next idea
+    if not state.pending:
+        next_idea = pick_next_idea(experiment, pool, state)
+        if next_idea is None:
             return redirect(reverse("protocole1.homepage"))
 
-        # otherwise, checks for the ideas proposed
-        reactions_ideas = models.ResultOnIdea.objects.filter(result=result).all()
-
-        # if there is at least one idea proposed
-        if len(reactions_ideas) > 0:
-            # Takes the last idea proposed
-            last_result = reactions_ideas[len(reactions_ideas) - 1]
-            # If the last idea proposed has already had a reaction from the user,
-            # picks the next idea
-            if last_result.reaction != models.Reactions.UNDEFINED.value:
-                # Checks that there are ideas remaining in both EXPANSION
-                # and FIXATION groups
-                # OR that we exceeded the number of ideas to test per user
-                groups = remove_already_used_ideas(groups, reactions_ideas)
-                if (
-                    len(groups[models.GroupType.EXPANSION]) == 0
-                    or len(groups[models.GroupType.FIXATION]) == 0
-                ) or (
-                    experiment.limit_ideas_number > 0
-                    and len(reactions_ideas) >= experiment.limit_ideas_number
-                ):
-                    # If no idea remain,
-                    result.finished = True
-                    result.save()
-                    return redirect(reverse("protocole1.homepage"))
-
-                # Picks the next idea
-                next_idea, did_expand = create_next_idea(groups, result)
-
-            # Case where the user has not reacted to the last idea proposed
-            # BUT has sent a reaction in GET parameters
-            elif "reaction" in request.GET:
-                reaction = int(request.GET["reaction"])
-                # If the reaction is valid (not UNDEFINED)
-                if reaction >= 1:
-                    reaction = models.Reactions(reaction)
-                    # Updates the expansion rate
-                    result.update_expansion_rate(last_result.did_expand, reaction)
-                    result.save()
-                    # Updates the last idea seen to register the reaction
-                    # and the new expansion rate computed
-                    last_result.reaction = reaction.value
-                    last_result.expansion_rate = result.expansion_rate
-                    last_result.save()
-                    # Redirects to avoid registering the reaction twice
-                    return redirect(
-                        reverse(
-                            "protocole1.participate_experiment", args=[experiment.id]
-                        )
-                    )
-                # Else keeps the same idea so the user can react rightfully
-                else:
-                    next_idea = last_result.idea
-            # Else displays the idea so the user can react
-            else:
-                next_idea = last_result.idea
+    # Case where the user has not reacted to the last idea proposed
+    # BUT has sent a reaction in GET parameters
+    elif "reaction" in request.GET:
+        reaction = int(request.GET["reaction"])
+        # If the reaction is valid (not UNDEFINED)
+        if reaction >= 1:
+            record_reaction(state, models.Reactions(reaction))
+            # Redirects to avoid registering the reaction twice
+            return redirect(
+                reverse("protocole1.participate_experiment", args=[experiment.id])
+            )
+        # Else keeps the same idea so the user can react rightfully
+        else:
+            next_idea = pending_idea(pool, state)
+    # Else displays the idea so the user can react
     else:
-        # Creates a result for this user on this experiment with default expansion rate
-        result = models.Result(
-            user=request.user,
-            experiment=experiment,
-            expansion_rate=experiment.starting_expansion_rate,
-        )
-        result.save()
-
-        # Picks the first idea
-        next_idea, did_expand = create_next_idea(groups, result)
+        next_idea = pending_idea(pool, state)
 
     return render(
         request,
@@ -308,10 +771,78 @@ def participate_experiment(request, experiment_id):
             "experiment": experiment,
             "next_idea": next_idea,
             "reactions": [rea for rea in models.Reactions if rea.value > 0],
+            "speculation": speculate_next_steps(experiment, pool, state),
         },
     )
 
 
+@login_required
+@require_POST
+def react_experiment(request, experiment_id):
+    """
+    Registers the reaction of the user (POST reaction parameter) on the idea 
+    waiting for it and picks the next idea in the same transaction, so that 
+    the participation page does not need to be reloaded. Answers in JSON with
+    the next idea or, if the experiment is finished for the user, the page to 
+    redirect to. If the page sends back the ideas selected in advance 
+    (speculation POST parameter), the one matching the reaction is used.
+
+    :param experiment_id: the experiment considered id
+    :type experiment_id: int
+    """
+    experiment = get_object_or_404(models.Experiment, Q(id=experiment_id, running=True))
+    try:
+        reaction = models.Reactions(int(request.POST.get("reaction", "")))
+    except ValueError:
+        reaction = models.Reactions.UNDEFINED
+    if reaction == models.Reactions.UNDEFINED:
+        return JsonResponse({"error": "Invalid reaction."}, status=400)
+    pool = pools.get_pool(experiment.id)
+
+    # The state is read before the transaction, which then starts with a write:
+    # SQLite does not wait for the lock when a transaction reading the database
+    # starts writing, and fails at once with concurrent participants. The
+    # reaction is only written on an idea still waiting for one, so a state
+    # changed meanwhile is rejected by ``record_reaction``.
+    state = load_participation_state(experiment, request.user)
+    if state.result is None or state.result.finished or not state.pending:
+        return JsonResponse({"error": "No idea waiting for a reaction."}, status=409)
+    # the ideas remaining, read once to pick the next idea and to select the 
+    # following ones in advance
+    groups = remove_already_used_ideas(
+        pool, state.used_ideas, experiment.selection_strategy
+    )
+    with transaction.atomic():
+        if not record_reaction(state, reaction):
+            return JsonResponse(
+                {"error": "No idea waiting for a reaction."}, status=409
+            )
+        # the reaction recorded reserves the next step to this request
+        next_step = speculated_step(
+            request.POST.get("speculation"), pool, state, reaction
+        )
+        if next_step is not None:
+            next_idea, did_expand = create_next_idea(
+                groups, state, next_step, reserved=True
+            )
+        else:
+            next_idea = pick_next_idea(experiment, pool, state, groups, reserved=True)
+
+    if next_idea is None:
+        return JsonResponse(
+            {"finished": True, "redirect": reverse("protocole1.homepage")}
+        )
+    return JsonResponse(
+        {
+            "finished": False,
+            "idea": {"id": next_idea.id, "value": next_idea.value},
+            "label": str(next_idea),
+            "order": state.last_result.order,
+            "speculation": speculate_next_steps(experiment, pool, state, groups),
+        }
+    )
+
+
 ##
 # USER PAGES
 ##
@@ -349,6 +880,99 @@ def log_in(request):
     )
 
 
+def participation_token(user, experiment):
+    """
+    Signs the token of the participation link of a user to an experiment (see 
+    ``participate_with_token``).
+
+    :param user: the participant
+    :type user: User
+    :param experiment: the experiment
+    :type experiment: Experiment
+    :rtype: str
+    """
+    return signing.dumps(
+        {"user": user.pk, "experiment": experiment.pk}, salt=PARTICIPATION_TOKEN_SALT
+    )
+
+
+def participate_with_token(request, token):
+    """
+    Logs the participant in from the signed token of his participation link
+    (see ``participation_token``) and redirects him to the experiment, without 
+    hashing any password. The links expire after
+    PROTOCOLE1_PARTICIPATION_TOKEN_MAX_AGE seconds and do not log the staff in.
+
+    :param token: the signed token
+    :type token: str
+    """
+    try:
+        data = signing.loads(
+            token,
+            salt=PARTICIPATION_TOKEN_SALT,
+            max_age=getattr(settings, "PROTOCOLE1_PARTICIPATION_TOKEN_MAX_AGE", None),
+        )
+    except signing.BadSignature:
+        raise Http404("Invalid or expired participation link.")
+    if request.user.pk != data["user"]:
+        user = get_object_or_404(
+            User, pk=data["user"], is_active=True, is_staff=False, is_superuser=False
+        )
+        login(request, user, backend="django.contrib.auth.backends.ModelBackend")
+    return redirect(
+        reverse("protocole1.participate_experiment", args=[data["experiment"]])
+    )
+
+
+@staff_member_required
+def metrics_view(request):
+    """
+    Gives the metrics of the application in the text format of Prometheus (see
+    ``metrics``).
+    """
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@staff_member_required
+def slow_queries_view(request):
+    """
+    Lists the latest slow requests with the plans of their slowest statements
+    (see ``slow_queries``).
+    """
+    return render(
+        request,
+        "slow_queries.html",
+        {
+            "entries": slow_queries.read_entries(),
+            "threshold": settings.PROTOCOLE1_SLOW_REQUEST_THRESHOLD,
+        },
+    )
+
+
+@staff_member_required
+def profiles_view(request):
+    """
+    Lists the profiles of the requests saved (see ``profiling``).
+    """
+    return render(request, "profiles.html", {"profiles": profiling.list_profiles()})
+
+
+@staff_member_required
+def profile_view(request, name):
+    """
+    Downloads a profile of a request.
+
+    :param name: the name of the profile
+    :type name: str
+    """
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404("No such profile")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
+
+
 @login_required
 def log_out(request):
     """